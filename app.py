@@ -1,19 +1,33 @@
-import json
 import logging
+import multiprocessing
 import os
+import threading
 from datetime import datetime
 from functools import wraps
+from hmac import compare_digest
 
 from flask import Flask, render_template, redirect, url_for, flash, request, jsonify, session
 from flask import send_file
 from flask import send_from_directory
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, emit, join_room
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 
-from filterScreen import find_screenshots_by_date
+from capture_broker import DISTRIBUTED_CAPTURE, CaptureBroker, run_remote_captures
+from capture_runs import run_store
+from chrome_governor import chrome_governor
+from filterScreen import search_screenshot_index
 from forms import AddDomainForm, LoginForm, RegisterForm
-from screenshot_utils import is_valid_url, visit_links_and_take_screenshots, create_directory_for_domain, get_screenshots
+from job_queue import JobCancelled, JobQueue
+from log_store import LogStore, LEVELS, line_matches, read_from
+from metrics import Gauge, registry as metrics_registry, summary as summarize_metrics
+from repository import DomainRepository, UserRepository
+from scheduler import SCHEDULER_ENABLED, CaptureScheduler
+from screenshot_index import screenshot_index
+from screenshot_store import collect_garbage, storage_stats, store_screenshot
+from thumbnails import generate_derivatives, get_derivative, remove_derivatives
+from screenshot_utils import crawl_site, create_directory_for_domain, get_screenshots, \
+    capture_batch, crawl_log_listeners, driver_pool, kill_screenshot_process
 
 # Załadowanie zmiennych środowiskowych
 load_dotenv()
@@ -21,6 +35,12 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'fallback_secret_key_only_for_development')
 socketio = SocketIO(app)
+job_queue = JobQueue(socketio)
+# Distributed mode: captures go to the broker and run on capture_worker.py nodes
+capture_broker = CaptureBroker() if DISTRIBUTED_CAPTURE else None
+WORKER_TOKEN = os.environ.get('WORKER_TOKEN')
+# Bearer token that lets a scraper read /metrics without logging in
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
 
 # Paths to files
 LOG_FILE = 'logs/logfile.log'
@@ -30,52 +50,41 @@ USERS_FILE = 'users.json'
 SCREENSHOT_DIR = 'static/screenshots'
 BASE_SCREENSHOT_FOLDER = 'static/screenshots'
 
-# Configure logging
-os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
-logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+domain_repository = DomainRepository(DOMAINS_FILE)
+user_repository = UserRepository(USERS_FILE)
+
+# Configure logging: append-only log file plus an in-memory buffer of the newest lines
+log_store = LogStore(LOG_FILE, max_lines=MAX_LOG_LINES)
+log_store.install()
 
 
 # Funkcje pomocnicze
-def get_logs():
-    ensure_log_directory()
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, 'r') as file:
-            logs = file.readlines()
-        logs.reverse()
-    else:
-        logs = []
-    return logs
+def get_logs(limit=None):
+    """Returns the newest log lines, newest first, from the in-memory buffer."""
+    return log_store.recent(limit)
 
 
 def load_domains():
-    if not os.path.exists(DOMAINS_FILE):
-        return []
-    with open(DOMAINS_FILE, 'r') as f:
-        data = json.load(f)
-        return data.get('domains', [])
+    return domain_repository.list()
 
 
 def save_domains(domains):
-    unique_domains = list(set(domains))
-    with open(DOMAINS_FILE, 'w') as f:
-        json.dump({'domains': unique_domains}, f, indent=4)
+    domain_repository.replace_all(domains)
 
 
 # Funkcje związane z użytkownikami i autoryzacją
 def load_users():
-    if not os.path.exists(USERS_FILE):
+    if not user_repository.exists():
         # Utwórz domyślnego admina podczas pierwszego uruchomienia
         admin_username = os.environ.get('ADMIN_USERNAME', 'admin')
         admin_password = os.environ.get('ADMIN_PASSWORD', 'SnapShot2024!')
-        save_users({admin_username: {'password': generate_password_hash(admin_password), 'role': 'admin'}})
-    
-    with open(USERS_FILE, 'r') as f:
-        return json.load(f)
+        user_repository.add(admin_username, {'password': generate_password_hash(admin_password), 'role': 'admin'})
+
+    return user_repository.all()
 
 
 def save_users(users):
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=4)
+    user_repository.replace_all(users)
 
 
 def login_required(f):
@@ -95,8 +104,8 @@ def admin_required(f):
             flash('Zaloguj się, aby uzyskać dostęp do tej strony.', 'danger')
             return redirect(url_for('login', next=request.url))
         
-        users = load_users()
-        if session['user'] not in users or users[session['user']].get('role') != 'admin':
+        user = user_repository.get(session['user'])
+        if user is None or user.get('role') != 'admin':
             flash('Nie masz uprawnień do tej strony.', 'danger')
             return redirect(url_for('dashboard'))
         
@@ -116,11 +125,12 @@ def login():
         username = form.username.data
         password = form.password.data
         
-        users = load_users()
-        
-        if username in users and check_password_hash(users[username]['password'], password):
+        load_users()
+        user = user_repository.get(username)
+
+        if user is not None and check_password_hash(user['password'], password):
             session['user'] = username
-            session['role'] = users[username].get('role', 'user')
+            session['role'] = user.get('role', 'user')
             flash(f'Witaj, {username}!', 'success')
             
             next_page = request.args.get('next')
@@ -143,16 +153,14 @@ def register():
         password = form.password.data
         role = form.role.data
         
-        users = load_users()
-        
-        if username in users:
+        user = {
+            'password': generate_password_hash(password),
+            'role': role
+        }
+
+        if not user_repository.add(username, user):
             flash(f'Użytkownik {username} już istnieje.', 'danger')
         else:
-            users[username] = {
-                'password': generate_password_hash(password),
-                'role': role
-            }
-            save_users(users)
             flash(f'Użytkownik {username} został zarejestrowany.', 'success')
             return redirect(url_for('dashboard'))
     
@@ -176,8 +184,7 @@ def dashboard():
     logs = get_logs()
     domains = load_domains()
     screenshots = get_screenshots(SCREENSHOT_DIR)
-    screenshot_files = [f for f in os.listdir(SCREENSHOT_DIR) if os.path.isfile(os.path.join(SCREENSHOT_DIR, f))]
-    screenshot_count = len(screenshot_files)
+    screenshot_count = screenshot_index.count()
     log_count = len(logs)
     domain_count = len(domains)
 
@@ -197,27 +204,24 @@ def dashboard():
 @login_required
 def manage_domains():
     form = AddDomainForm()
-    domains = load_domains()
 
     if form.validate_on_submit():
         domain = form.new_domain.data
         if domain:
-            domains.append(domain)
-            save_domains(domains)
+            domain_repository.add(domain)
             flash('Domain added successfully!', 'success')
         else:
             flash('Please provide all required information.', 'danger')
 
+    domains = load_domains()
+
     return render_template('manage_pages.html', domains=domains, add_domain_form=form)
 
 
 @app.route('/domains/delete/<domain>', methods=['POST'])
 @admin_required
 def delete_domain(domain):
-    domains = load_domains()
-    if domain in domains:
-        domains.remove(domain)
-        save_domains(domains)
+    if domain_repository.remove(domain):
         flash('Domain deleted successfully!', 'success')
     else:
         flash('Domain does not exist.', 'danger')
@@ -228,13 +232,10 @@ def delete_domain(domain):
 @app.route('/domains/edit/<old_domain>', methods=['GET', 'POST'])
 def edit_domain(old_domain):
     form = AddDomainForm()
-    domains = load_domains()
 
     if request.method == 'POST' and form.validate_on_submit():
         new_domain = form.new_domain.data
-        if old_domain in domains:
-            domains[domains.index(old_domain)] = new_domain
-            save_domains(domains)
+        if domain_repository.rename(old_domain, new_domain):
             flash('Domain updated successfully!', 'success')
         else:
             flash('Domain does not exist.', 'danger')
@@ -257,8 +258,9 @@ def copy_domain(domain):
             flash(f"Domain '{new_domain}' already exists!", 'danger')
             return redirect(url_for('manage_domains'))
 
-        domains.append(new_domain)
-        save_domains(domains)
+        if not domain_repository.add(new_domain):
+            flash(f"Domain '{new_domain}' already exists!", 'danger')
+            return redirect(url_for('manage_domains'))
         flash(f"Domain '{domain}' copied as '{new_domain}'.", 'success')
     except Exception as e:
         flash(f"Error copying domain: {str(e)}", 'danger')
@@ -268,8 +270,7 @@ def copy_domain(domain):
 
 @app.route('/filtrScreen')
 def gallery():
-    screenshots_dir = os.path.join(app.static_folder, 'screenshots')
-    images = [f for f in os.listdir(screenshots_dir) if os.path.isfile(os.path.join(screenshots_dir, f))]
+    images = screenshot_index.list_folder('')
     return render_template('FiltrScreen.html', images=images)
 
 
@@ -278,6 +279,8 @@ def delete_screenshot_from_folder(folder, screenshot):
     screenshot_path = os.path.join(SCREENSHOT_DIR, folder, screenshot)
     if os.path.exists(screenshot_path):
         os.remove(screenshot_path)
+        screenshot_index.remove(screenshot_path)
+        remove_derivatives(os.path.join(folder, screenshot))
         flash('Screenshot deleted successfully!', 'success')
     else:
         flash('Screenshot does not exist.', 'danger')
@@ -286,45 +289,19 @@ def delete_screenshot_from_folder(folder, screenshot):
 
 @app.route('/logs/delete', methods=['POST'])
 def delete_logs_route():
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, 'r') as file:
-            lines = file.readlines()
-        if len(lines) >= 500:
-            lines = lines[500:]
-            with open(LOG_FILE, 'w') as file:
-                file.writelines(lines)
-            return jsonify({"success": True})
-        else:
-            return jsonify({"success": False, "error": "Log count is less than 500."}), 400
+    if log_store.count() >= 500:
+        log_store.trim(500)
+        return jsonify({"success": True})
     else:
-        return jsonify({"success": False, "error": "Log file does not exist."}), 404
+        return jsonify({"success": False, "error": "Log count is less than 500."}), 400
 
 
 def setup_logging():
-    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
-    logging.basicConfig(
-        filename=LOG_FILE,
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
+    log_store.install()
 
 
 def write_log(message, level=logging.INFO):
-    ensure_log_directory()
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, 'r') as file:
-            lines = file.readlines()
-        lines.reverse()
-        if len(lines) >= MAX_LOG_LINES:
-            lines = lines[:MAX_LOG_LINES - 1]
-    else:
-        lines = []
-
-    lines.insert(0, f"{logging.getLevelName(level)} - {message}\n")
-
-    with open(LOG_FILE, 'w') as file:
-        file.writelines(lines)
+    logging.log(level, message)
 
 
 def ensure_log_directory():
@@ -337,16 +314,12 @@ def ensure_log_directory():
 @app.route('/manyScreen/<folder>')
 def many_screen(folder=None):
     if folder:
-        folder_path = os.path.join(SCREENSHOT_DIR, folder)
-        if os.path.exists(folder_path) and os.path.isdir(folder_path):
-            screenshots = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
-        else:
-            screenshots = []
+        screenshots = screenshot_index.list_folder(folder)
         return render_template('manyScreen.html', folder=folder, screenshots=screenshots)
     else:
-        screenshot_dirs = [d for d in os.listdir(SCREENSHOT_DIR) if os.path.isdir(os.path.join(SCREENSHOT_DIR, d))]
-        domains = load_domains()
         screenshots = get_screenshots(SCREENSHOT_DIR)
+        screenshot_dirs = sorted({path.split('/')[0] for path in screenshots if path})
+        domains = load_domains()
         return render_template('manyScreen.html', screenshot_dirs=screenshot_dirs, domains=domains,
                                screenshots=screenshots)
 
@@ -356,6 +329,8 @@ def delete_screenshots(screenshot):
     screenshot_path = os.path.join(SCREENSHOT_DIR, screenshot)
     if os.path.exists(screenshot_path):
         os.remove(screenshot_path)
+        screenshot_index.remove(screenshot_path)
+        remove_derivatives(screenshot)
         flash('Screenshot deleted successfully!', 'success')
     else:
         flash('Screenshot does not exist.', 'danger')
@@ -389,21 +364,10 @@ def search_screenshots():
             flash('Invalid date format. Please use YYYY-MM-DD.', 'danger')
             return redirect(url_for('search_screenshots'))
 
-        screenshots_dir = os.path.join(app.static_folder, 'screenshots')
-        filtered_screenshots = []
-
-        for folder in os.listdir(screenshots_dir):
-            folder_path = os.path.join(screenshots_dir, folder)
-            if os.path.isdir(folder_path):
-                subfolders = ['desktop', 'mobile'] if not device_type else [device_type]
-                for subfolder in subfolders:
-                    subfolder_path = os.path.join(folder_path, subfolder)
-                    if os.path.exists(subfolder_path) and os.path.isdir(subfolder_path):
-                        screenshots = find_screenshots_by_date(subfolder_path, start_date, end_date, domain,
-                                                               device_type)
-                        filtered_screenshots.extend(screenshots)
-
-        return render_template('filtrScreen.html', screenshots=filtered_screenshots,
+        rows, next_cursor = search_screenshot_index(start_date, end_date, domain, device_type)
+        filtered_screenshots = [row['path'] for row in rows]
+
+        return render_template('filtrScreen.html', screenshots=filtered_screenshots, next_cursor=next_cursor,
                                start_date=start_date_str, end_date=end_date_str, domain=domain, device_type=device_type)
 
     domains = load_domains()
@@ -423,40 +387,47 @@ def download_file(filename):
     return send_from_directory(screenshots_dir, filename, as_attachment=True)
 
 
-@app.route('/api/search_screenshots', methods=['POST'])
+@app.route('/thumbnails/<size>/<path:filename>')
+def screenshot_thumbnail(size, filename):
+    """Serves a small thumbnail or mid-size preview, falling back to the original screenshot."""
+    screenshots_dir = os.path.join(app.static_folder, 'screenshots')
+    derivative = get_derivative(filename, size)
+    if derivative is None:
+        return send_from_directory(screenshots_dir, filename)
+    return send_file(os.path.abspath(derivative), max_age=86400, conditional=True)
+
+
+@app.route('/api/search_screenshots', methods=['GET', 'POST'])
 def api_search_screenshots():
-    start_date_str = request.form.get('start_date')
-    end_date_str = request.form.get('end_date')
-    domain = request.form.get('domain')
-    device_type = request.form.get('device_type')
+    params = request.form if request.method == 'POST' else request.args
+    start_date_str = params.get('start_date')
+    end_date_str = params.get('end_date')
 
     try:
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d') if start_date_str else None
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d') if end_date_str else None
     except ValueError:
         return jsonify({"error": "Invalid date format. Please use YYYY-MM-DD."}), 400
 
-    screenshots_dir = os.path.join(app.static_folder, 'screenshots')
-    filtered_screenshots = []
-
-    for folder in os.listdir(screenshots_dir):
-        folder_path = os.path.join(screenshots_dir, folder)
-        if os.path.isdir(folder_path):
-            subfolders = ['desktop', 'mobile'] if not device_type else [device_type.lower()]
-            for subfolder in subfolders:
-                subfolder_path = os.path.join(folder_path, subfolder)
-                if os.path.exists(subfolder_path) and os.path.isdir(subfolder_path):
-                    screenshots = [f for f in os.listdir(subfolder_path) if
-                                   os.path.isfile(os.path.join(subfolder_path, f))]
-                    for screenshot in screenshots:
-                        file_path = os.path.join(subfolder_path, screenshot)
-                        file_date = datetime.fromtimestamp(os.path.getmtime(file_path)).date()
-
-                        if (start_date.date() <= file_date <= end_date.date()) and (
-                                not domain or domain.lower() in folder.lower()):
-                            filtered_screenshots.append(os.path.join(folder, subfolder, screenshot))
-
-    return jsonify({"screenshots": filtered_screenshots})
+    try:
+        rows, next_cursor = search_screenshot_index(
+            start_date, end_date,
+            domain=params.get('domain'),
+            device_type=params.get('device_type'),
+            domain_match=params.get('domain_match', 'exact'),
+            sort=params.get('sort', 'captured_at'),
+            order=params.get('order', 'desc'),
+            limit=params.get('limit', 50, type=int),
+            cursor=params.get('cursor'),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "screenshots": [row['path'] for row in rows],
+        "items": rows,
+        "next_cursor": next_cursor,
+    })
 
 
 @app.route('/screenshots/delete', methods=['POST'])
@@ -465,6 +436,8 @@ def delete_screenshot():
     screenshot_path = os.path.join(SCREENSHOT_DIR, screenshot)
     if os.path.exists(screenshot_path):
         os.remove(screenshot_path)
+        screenshot_index.remove(screenshot_path)
+        remove_derivatives(screenshot)
         return jsonify({"success": True})
     else:
         return jsonify({"success": False, "error": "Screenshot does not exist."}), 404
@@ -480,21 +453,80 @@ def download_logs():
         return redirect(url_for('dashboard'))
 
 
+def crawl_log_file(domain, date_str):
+    """Returns the path of a crawl's log.txt, or None for names that leave the screenshot folder."""
+    if not domain or not date_str or '..' in (domain, date_str) or '/' in domain + date_str:
+        return None
+    return os.path.join(BASE_SCREENSHOT_FOLDER, domain, date_str, 'log.txt')
+
+
 @app.route('/logs', methods=['GET'])
 @app.route('/logs/<domain>/<date_str>', methods=['GET'])
 def fetch_logs(domain=None, date_str=None):
+    """
+    Returns log lines; with `?offset=` only the lines written after that offset.
+
+    The offset of the app log is a line sequence number, the offset of a crawl log is a byte
+    position in its log.txt. Either way the response carries the offset to resume from.
+    """
+    offset = request.args.get('offset', type=int)
     if domain and date_str:
-        log_folder = os.path.join(BASE_SCREENSHOT_FOLDER, domain, date_str)
-        log_file = os.path.join(log_folder, 'log.txt')
-        if os.path.exists(log_file):
-            with open(log_file, 'r') as file:
-                logs = file.readlines()
-            return jsonify({"logs": logs})
-        else:
+        log_file = crawl_log_file(domain, date_str)
+        if log_file is None or not os.path.exists(log_file):
             return jsonify({"error": "Log file does not exist."}), 404
+        logs, new_offset = read_from(log_file, offset or 0)
+        return jsonify({"logs": logs, "offset": new_offset})
+    if offset is None:
+        return jsonify({"logs": get_logs(20), "offset": log_store.offset})
+    entries = log_store.since(offset)
+    return jsonify({"logs": [line for seq, line in entries], "offset": entries[-1][0] if entries else offset})
+
+
+def run_domain_capture(job):
+    """Background job for /zrobscreen: crawls a single domain in one device view."""
+    domain = job.params['domain']
+    device_type = job.params['deviceType']
+    links = job.params.get('links')
+    try:
+        if capture_broker:
+            result = run_remote_captures(capture_broker, job, [(domain, device_type)], max_links=50, links=links)[0]
+            if result['error']:
+                job.check_cancelled()
+                raise RuntimeError(f"{domain} failed on {result['worker']}: {result['error']}")
+            screenshots = result['screenshots']
+        else:
+            # crawl_site raises when the main page cannot be captured, so the job ends as failed
+            screenshots = crawl_site(domain, device_type, max_links=50, progress=job, links=links)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        write_log(f"Error taking screenshots: {str(e)}", level=logging.ERROR)
+        raise
+    write_log(f"User {job.user} took screenshots for {domain} on {device_type}")
+    return {"screenshots": screenshots}
+
+
+def summarize_batch(results):
+    """Collects all screenshot paths and per-URL errors from capture_batch results."""
+    screenshots = [path for result in results for path in result['screenshots']]
+    errors = [result for result in results if result['error']]
+    for result in errors:
+        write_log(f"Error processing {result['url']} ({result['deviceType']}): {result['error']}",
+                  level=logging.ERROR)
+    return {"results": results, "screenshots": screenshots, "failed": len(errors)}
+
+
+def run_url_capture(job):
+    """Background job for /screenshot: crawls every submitted URL in every requested device view."""
+    urls = [url for url in job.params['urls'] if isinstance(url, str)]
+    if capture_broker:
+        captures = [(url, device_type) for url in urls for device_type in job.params['deviceTypes']]
+        results = run_remote_captures(capture_broker, job, captures)
     else:
-        logs = get_logs()
-        return jsonify({"logs": logs[-20:]})
+        results = capture_batch(urls, job.params['deviceTypes'], progress=job)
+    summary = summarize_batch(results)
+    write_log(f"User {job.user} took screenshots for {len(urls)} URLs ({summary['failed']} failed)")
+    return summary
 
 
 @app.route('/zrobscreen', methods=['POST'])
@@ -512,16 +544,15 @@ def zrobscreen():
     if data['deviceType'] not in ['mobile', 'desktop']:
         return jsonify({"error": "Invalid device type. Must be 'mobile' or 'desktop'"}), 400
 
-    domain = data['domain']
-    device_type = data['deviceType']
-    
-    try:
-        visit_links_and_take_screenshots(domain, device_type, max_links=50)
-        write_log(f"User {session.get('user')} took screenshots for {domain} on {device_type}")
-        return jsonify({"success": True}), 200
-    except Exception as e:
-        write_log(f"Error taking screenshots: {str(e)}", level=logging.ERROR)
-        return jsonify({"error": str(e)}), 500
+    if 'links' in data and (not isinstance(data['links'], list)
+                            or not all(isinstance(link, str) for link in data['links'])):
+        return jsonify({"error": "'links' must be an array of URLs"}), 400
+
+    params = {'domain': data['domain'], 'deviceType': data['deviceType']}
+    if data.get('links'):
+        params['links'] = data['links']
+    job = job_queue.submit('zrobscreen', params, run_domain_capture, user=session.get('user'))
+    return jsonify({"success": True, "job_id": job.id}), 202
 
 
 @app.route('/screenshot', methods=['POST'])
@@ -538,33 +569,301 @@ def screenshot():
         return jsonify({"error": "'urls' must be an array"}), 400
     if not data['urls']:
         return jsonify({"error": "'urls' cannot be empty"}), 400
-    if 'deviceType' not in data:
+    if 'deviceTypes' in data:
+        device_types = data['deviceTypes']
+        if not isinstance(device_types, list) or not device_types:
+            return jsonify({"error": "'deviceTypes' must be a non-empty array"}), 400
+    elif 'deviceType' in data:
+        device_types = [data['deviceType']]
+    else:
         return jsonify({"error": "Missing 'deviceType' field"}), 400
-    if data['deviceType'] not in ['mobile', 'desktop']:
+    if any(device_type not in ['mobile', 'desktop'] for device_type in device_types):
         return jsonify({"error": "Invalid device type. Must be 'mobile' or 'desktop'"}), 400
 
-    urls = data['urls']
-    device_type = data['deviceType']
-    screenshots = []
+    params = {'urls': data['urls'], 'deviceTypes': list(dict.fromkeys(device_types))}
+    job = job_queue.submit('screenshot', params, run_url_capture, user=session.get('user'))
+    return jsonify({"success": True, "job_id": job.id}), 202
+
+
+def submit_scheduled_capture(domain, device_type):
+    params = {'domain': domain, 'deviceType': device_type}
+    return job_queue.submit('scheduled', params, run_domain_capture, user='scheduler')
+
+
+scheduler = CaptureScheduler(job_queue, load_domains, submit_scheduled_capture)
+
 
-    for url in urls:
+@app.route('/schedule', methods=['GET'])
+@login_required
+def schedule_status():
+    return jsonify({"enabled": SCHEDULER_ENABLED, "schedule": scheduler.status()})
+
+
+def static_url(path):
+    if not path:
+        return None
+    return url_for('static', filename=os.path.relpath(path, 'static').replace(os.sep, '/'))
+
+
+@app.route('/api/runs', methods=['GET'])
+@login_required
+def api_runs():
+    runs = run_store.list(domain=request.args.get('domain'), device=request.args.get('deviceType'),
+                          limit=request.args.get('limit', 50, type=int))
+    return jsonify({"runs": runs})
+
+
+@app.route('/api/runs/<run_id>', methods=['GET'])
+@login_required
+def api_run_manifest(run_id):
+    """The run's planned links and which screenshot file every captured URL was saved to."""
+    manifest = run_store.manifest(run_id)
+    if manifest is None:
+        return jsonify({"error": "Run does not exist."}), 404
+    for page in manifest['pages']:
+        page['screenshot_url'] = static_url(page['path'])
+    return jsonify(manifest)
+
+
+@app.route('/api/diffs', methods=['GET'])
+@login_required
+def api_diffs():
+    """Pages that changed the most since the previous capture run, with their diff masks."""
+    diffs = run_store.most_changed(domain=request.args.get('domain'), device=request.args.get('deviceType'),
+                                   run_id=request.args.get('run_id'),
+                                   limit=request.args.get('limit', 20, type=int),
+                                   min_score=request.args.get('min_score', 0.0, type=float))
+    for diff in diffs:
+        diff['mask_url'] = static_url(diff.pop('mask_path'))
+    return jsonify({"diffs": diffs})
+
+
+@app.route('/api/workers/files/<path:rel_path>', methods=['PUT'])
+def receive_worker_file(rel_path):
+    """Stores a screenshot uploaded by a capture worker under the same path as a local capture."""
+    token = request.headers.get('X-Worker-Token', '')
+    if not WORKER_TOKEN or not compare_digest(token, WORKER_TOKEN):
+        return jsonify({"error": "Forbidden"}), 403
+    rel_path = os.path.normpath(rel_path)
+    if os.path.isabs(rel_path) or rel_path.startswith('..') or not rel_path.lower().endswith('.png'):
+        return jsonify({"error": "Invalid path."}), 400
+
+    path = os.path.join(SCREENSHOT_DIR, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Never write into an existing file, it may be a hard link to a shared blob
+    tmp_path = f"{path}.upload"
+    with open(tmp_path, 'wb') as f:
+        f.write(request.get_data())
+    os.replace(tmp_path, path)
+    store_screenshot(path)
+    screenshot_index.record(path, source_url=request.headers.get('X-Source-Url') or None)
+    generate_derivatives(path)
+    return jsonify({"success": True, "path": path}), 201
+
+
+@app.route('/jobs', methods=['GET'])
+@login_required
+def list_jobs():
+    return jsonify({"jobs": [job.to_dict() for job in job_queue.list()]})
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job does not exist."}), 404
+    status = job.to_dict()
+    status['resources'] = chrome_governor.usage(job.id)
+    return jsonify(status)
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Job does not exist."}), 404
+    # ?force=1 does not wait for the current pages and kills the job's browsers
+    killed = kill_screenshot_process(job.id) if request.args.get('force') == '1' else 0
+    return jsonify({"success": True, "status": job.status, "killed_browsers": killed})
+
+
+@app.route('/api/resources', methods=['GET'])
+@login_required
+def resource_usage():
+    """Chrome instances and memory in use, per browser and per job."""
+    return jsonify({"chrome": chrome_governor.usage(), "pool": driver_pool.stats()})
+
+
+def pool_gauge(state):
+    return {(profile,): stats[state] for profile, stats in driver_pool.stats().items()}
+
+
+metrics_registry.register(Gauge('snapshot_chrome_instances', 'Chrome instances started by the app.',
+                                func=lambda: {(): chrome_governor.usage()['instances']}))
+metrics_registry.register(Gauge('snapshot_chrome_rss_megabytes', 'Resident memory of all Chrome instances.',
+                                func=lambda: {(): chrome_governor.usage()['rss_mb']}))
+metrics_registry.register(Gauge('snapshot_drivers_idle', 'Idle pooled drivers.', ('profile',),
+                                func=lambda: pool_gauge('idle')))
+metrics_registry.register(Gauge('snapshot_drivers_leased', 'Drivers in use.', ('profile',),
+                                func=lambda: pool_gauge('leased')))
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Capture pipeline metrics in the Prometheus text format, for logged-in users or, when
+    METRICS_TOKEN is set, for scrapers sending it as a bearer token.
+    """
+    authorization = request.headers.get('Authorization', '')
+    token_ok = bool(METRICS_TOKEN) and compare_digest(authorization, f"Bearer {METRICS_TOKEN}")
+    if 'user' not in session and not token_ok:
+        return jsonify({"error": "Forbidden"}), 403
+    return metrics_registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+@app.route('/api/metrics/summary', methods=['GET'])
+@login_required
+def metrics_summary():
+    """Per-stage and per-site timings for the dashboard panel."""
+    return jsonify(summarize_metrics())
+
+
+@app.cli.command('capture-all')
+def capture_all_command():
+    """Captures every domain from data.json in both device views (e.g. for a nightly cron run)."""
+    domains = load_domains()
+    results = capture_batch(domains, ['desktop', 'mobile'], max_links=50)
+    summary = summarize_batch(results)
+    write_log(f"Nightly capture finished for {len(domains)} domains ({summary['failed']} failed)")
+    print(f"Captured {len(summary['screenshots'])} screenshots, {summary['failed']} of {len(results)} crawls failed.")
+
+
+@app.cli.command('storage-gc')
+def storage_gc_command():
+    """Deletes stored screenshot blobs that no screenshot links to anymore."""
+    freed = collect_garbage(keep=run_store.referenced_hashes())
+    stats = storage_stats()
+    print(f"Freed {freed / (1024 * 1024):.1f} MB, {stats['blobs']} blobs use {stats['bytes'] / (1024 * 1024):.1f} MB.")
+
+
+@socketio.on('subscribe_job')
+def subscribe_job(data):
+    if 'user' not in session:
+        return
+    job = job_queue.get((data or {}).get('job_id'))
+    if job is None:
+        emit('job_failed', {"job_id": (data or {}).get('job_id'), "error": "Job does not exist."})
+        return
+    join_room(job.id)
+    # Send the current state right away so late subscribers do not miss finished jobs
+    event = 'job_progress' if job.status in ('queued', 'running') else f"job_{job.status}"
+    emit(event, job.to_dict())
+
+
+# sid -> {"domain", "date_str", "level", "filter"} of clients following a log; domain/date_str are
+# None for the app log
+log_subscribers = {}
+
+
+def push_log_line(source, offset, line):
+    """Sends a new log line to every client following `source` whose filters it passes."""
+    for sid, subscription in list(log_subscribers.items()):
+        if (subscription['domain'], subscription['date_str']) != source:
+            continue
+        if line_matches(line, subscription['level'], subscription['filter']):
+            socketio.emit('log_lines', {"source": subscription['source'], "logs": [line], "offset": offset}, to=sid)
+
+
+log_store.add_listener(lambda seq, line: push_log_line((None, None), seq, line))
+crawl_log_listeners.append(lambda domain, date_str, offset, line: push_log_line((domain, date_str), offset, line))
+
+
+@socketio.on('subscribe_logs')
+def subscribe_logs(data):
+    """
+    Starts streaming a log to this client: the app log, or a crawl log when `domain` and
+    `date_str` are given. Lines after `offset` are sent first so reconnecting clients resume
+    where they stopped; `level` (minimum) and `filter` (substring, e.g. a domain) narrow it down.
+    """
+    if 'user' not in session:
+        return
+    data = data or {}
+    level = (data.get('level') or '').upper() or None
+    if level and level not in LEVELS:
+        emit('log_error', {"error": f"Invalid level. Must be one of {', '.join(LEVELS)}."})
+        return
+    domain, date_str = data.get('domain'), data.get('date_str')
+    offset = data.get('offset')
+    if offset is not None:
         try:
-            # Walidacja URL
-            if not isinstance(url, str):
-                continue
-                
-            url = is_valid_url(url)
-            visit_links_and_take_screenshots(url, device_type)
-            domain_name = url.split('/')[2].replace('www.', '').replace(':', '_')
-            domain_folder = os.path.join('static', 'screenshots', domain_name, device_type)
-            if os.path.exists(domain_folder):
-                screenshots.extend([os.path.join(domain_folder, f) for f in os.listdir(domain_folder) if
-                                   os.path.isfile(os.path.join(domain_folder, f))])
-        except Exception as e:
-            write_log(f"Error processing {url}: {e}", level=logging.ERROR)
-            return jsonify({"error": f"Error processing {url}: {str(e)}"}), 500
-
-    return jsonify({"screenshots": screenshots}), 200
+            offset = int(offset)
+        except (TypeError, ValueError):
+            emit('log_error', {"error": "Invalid offset. Must be an integer."})
+            return
+    if domain or date_str:
+        log_file = crawl_log_file(domain, date_str)
+        if log_file is None:
+            emit('log_error', {"error": "Invalid log."})
+            return
+        source = f"{domain}/{date_str}"
+        logs, new_offset = read_from(log_file, offset or 0)
+    else:
+        domain = date_str = None
+        source = 'app'
+        if offset is None:
+            entries = log_store.since(0)[-20:]
+        else:
+            entries = log_store.since(offset)
+        logs = [line for seq, line in entries]
+        new_offset = entries[-1][0] if entries else (offset or log_store.offset)
+
+    subscription = {"source": source, "domain": domain, "date_str": date_str, "level": level,
+                    "filter": data.get('filter') or None}
+    # Register before sending the backlog; a line arriving in between may be delivered twice,
+    # clients drop it by its offset
+    log_subscribers[request.sid] = subscription
+    logs = [line for line in logs if line_matches(line, level, subscription['filter'])]
+    emit('log_lines', {"source": source, "logs": logs, "offset": new_offset, "backlog": True})
+
+
+@socketio.on('unsubscribe_logs')
+def unsubscribe_logs(data=None):
+    log_subscribers.pop(request.sid, None)
+
+
+@socketio.on('disconnect')
+def forget_log_subscriber(*args):
+    log_subscribers.pop(request.sid, None)
+
+
+def start_background_services():
+    """
+    Starts the screenshot index reconciler and, with SCHEDULER_ENABLED=1, the capture scheduler
+    once per process, from app setup so they also run under `flask run`. The file-watching
+    parent process of the reloader starts nothing, otherwise every scheduled crawl would run
+    twice.
+    """
+    global background_services_started
+    if app.debug and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        return
+    # Spawned processes (the visual diff workers) import the main module again
+    if multiprocessing.parent_process() is not None:
+        return
+    with background_services_lock:
+        if background_services_started:
+            return
+        background_services_started = True
+    # Keep the screenshot index in sync with files added or removed outside the app
+    screenshot_index.start_reconciler()
+    if SCHEDULER_ENABLED:
+        scheduler.start()
+
+
+background_services_started = False
+background_services_lock = threading.Lock()
+start_background_services()
 
 
 if __name__ == '__main__':
@@ -573,11 +872,12 @@ if __name__ == '__main__':
     os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
     os.makedirs(SCREENSHOT_DIR, exist_ok=True)
     if not os.path.exists(DOMAINS_FILE):
-        with open(DOMAINS_FILE, 'w') as f:
-            json.dump({'domains': []}, f)
+        save_domains([])
     
     # Upewnij się, że plik użytkowników istnieje
     if not os.path.exists(USERS_FILE):
         load_users()  # Ta funkcja utworzy plik z domyślnym adminem
 
-    socketio.run(app, debug=True)
+    # The background services are already running in this process; a reloader would start a
+    # second process with its own scheduler and job queue
+    socketio.run(app, debug=True, use_reloader=False)
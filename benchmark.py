@@ -0,0 +1,356 @@
+"""
+Benchmark of the capture engine against a local fixture site.
+
+Serves a generated site on 127.0.0.1, crawls it with crawl_site in every combination of the
+given concurrency and wait strategies, and appends one JSON line per scenario to the results
+file, so runs before and after a change can be compared:
+
+    python benchmark.py --pages 30 --height 6000 --asset-kb 200 --slow-ms 800 --workers 1,2,4 \\
+        --modes cdp,resize --label "before"
+
+The crawls run in a scratch working directory, so screenshots, indexes and caches of the app
+are not touched.
+"""
+import argparse
+import json
+import logging
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psutil
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'results.jsonl')
+RSS_SAMPLE_INTERVAL = 0.2
+
+
+def _chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+def fixture_png(seed, size_kb):
+    """A valid 1x1 PNG of the given color seed, padded with a private chunk to `size_kb`."""
+    pixel = bytes([(seed * 37) % 256, (seed * 91) % 256, (seed * 53) % 256])
+    png = b'\x89PNG\r\n\x1a\n' + _chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0))
+    png += _chunk(b'IDAT', zlib.compress(b'\x00' + pixel))
+    padding = max(0, size_kb * 1024 - len(png) - 24)
+    return png + _chunk(b'paDd', b'\x00' * padding) + _chunk(b'IEND', b'')
+
+
+class FixtureSite:
+    """
+    A generated site: an index page linking to `pages` pages, each `height` pixels tall with
+    `assets` images of `asset_kb` KB and, with `slow_ms`, a script that answers that late.
+    Bumping `generation` changes every page and image, so captures are never deduplicated.
+    """
+
+    def __init__(self, pages=20, height=4000, assets=4, asset_kb=100, slow_ms=0):
+        self.pages = pages
+        self.height = height
+        self.assets = assets
+        self.asset_kb = asset_kb
+        self.slow_ms = slow_ms
+        self.generation = 0
+        self.server = None
+
+    def params(self):
+        return {'pages': self.pages, 'height': self.height, 'assets': self.assets, 'asset_kb': self.asset_kb,
+                'slow_ms': self.slow_ms}
+
+    def index_html(self):
+        links = ''.join(f'<li><a href="/page/{n}">Page {n}</a></li>' for n in range(1, self.pages + 1))
+        return f'<html><head><title>Fixture</title><link rel="stylesheet" href="/site.css"></head>' \
+               f'<body><h1>Fixture site {self.generation}</h1><ul>{links}</ul></body></html>'
+
+    def page_html(self, n):
+        block = max(200, self.height // max(1, self.assets + 1))
+        sections = ''.join(
+            f'<section style="height:{block}px"><h2>Section {k}</h2>'
+            f'<img src="/asset/{self.generation}/{n}/{k}.png" width="600" height="300"></section>'
+            for k in range(self.assets))
+        slow = f'<script src="/slow/{n}.js"></script>' if self.slow_ms else ''
+        filler = self.height - block * self.assets
+        return f'<html><head><title>Page {n}</title><link rel="stylesheet" href="/site.css">{slow}</head>' \
+               f'<body><h1>Page {n} of generation {self.generation}</h1>{sections}' \
+               f'<div style="height:{max(0, filler)}px"></div><a href="/">Home</a></body></html>'
+
+    def handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                parts = path.strip('/').split('/')
+                if path == '/':
+                    self.respond(200, 'text/html', site.index_html().encode())
+                elif parts[0] == 'page' and len(parts) == 2 and parts[1].isdigit():
+                    self.respond(200, 'text/html', site.page_html(int(parts[1])).encode())
+                elif parts[0] == 'asset' and len(parts) == 4:
+                    seed = zlib.crc32(path.encode())
+                    self.respond(200, 'image/png', fixture_png(seed, site.asset_kb))
+                elif parts[0] == 'slow':
+                    time.sleep(site.slow_ms / 1000)
+                    self.respond(200, 'application/javascript', b'document.body && (window.slowLoaded = true);')
+                elif path == '/site.css':
+                    self.respond(200, 'text/css', b'body { font-family: sans-serif; margin: 0; } h1 { color: #236; }')
+                else:
+                    self.respond(404, 'text/plain', b'Not found')
+
+            def respond(self, status, content_type, body):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', 'no-store')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class ResourceSampler:
+    """Samples the resident memory of this process and its children (the browsers) in the background."""
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        process = psutil.Process()
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        self.peak_rss = max(self.peak_rss, total)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = (len(values) - 1) * q
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+
+def bytes_written():
+    try:
+        return psutil.Process().io_counters().write_bytes
+    except (AttributeError, psutil.AccessDenied):
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_domain_config(path, mode, ready_timeout, workers):
+    """Settings of one scenario, applied to every domain through the config defaults."""
+    config = {'defaults': {
+        'capture_mode': mode,
+        'ready_timeout': ready_timeout,
+        # Measure the engine, not the change cache or the politeness limits
+        'change_detection': 'off',
+        'rate_limit': 1000,
+        'burst': 1000,
+        'max_concurrency': workers,
+        'link_source': 'page',
+    }}
+    previous = os.path.getmtime(path) if os.path.exists(path) else 0
+    with open(path, 'w') as f:
+        json.dump(config, f)
+    # The config is reloaded when its mtime changes; make sure it does between scenarios
+    stamp = max(time.time(), previous + 1)
+    os.utime(path, (stamp, stamp))
+
+
+def run_scenario(site, url, device, workers, mode, ready_timeout, config_path):
+    from metrics import stage_listeners
+    from screenshot_utils import crawl_site, driver_pool
+
+    site.generation += 1
+    write_domain_config(config_path, mode, ready_timeout, workers)
+    # Every scenario starts its browsers itself instead of reusing those of the previous one
+    driver_pool.clear()
+
+    page_seconds = []
+    stage_seconds = {}
+    lock = threading.Lock()
+
+    def listener(stage, seconds, domain, listener_device):
+        with lock:
+            stage_seconds[stage] = stage_seconds.get(stage, 0.0) + seconds
+            if stage == 'page':
+                page_seconds.append(seconds)
+
+    stage_listeners.append(listener)
+    written_before = bytes_written()
+    error = None
+    saved = []
+    started = time.perf_counter()
+    try:
+        with ResourceSampler() as sampler:
+            saved = crawl_site(url, device, max_links=site.pages, workers=workers)
+    except Exception as e:
+        error = str(e)
+        logging.error(f"Scenario failed: {e}")
+    finally:
+        stage_listeners.remove(listener)
+    elapsed = time.perf_counter() - started
+    written_after = bytes_written()
+
+    screenshot_bytes = sum(os.path.getsize(path) for path in saved if os.path.exists(path))
+    return {
+        'scenario': {'device': device, 'workers': workers, 'capture_mode': mode, 'ready_timeout': ready_timeout},
+        'pages': len(saved),
+        'seconds': round(elapsed, 3),
+        'pages_per_minute': round(len(saved) / elapsed * 60, 2) if elapsed else None,
+        'page_p50': round(percentile(page_seconds, 0.5), 3) if page_seconds else None,
+        'page_p95': round(percentile(page_seconds, 0.95), 3) if page_seconds else None,
+        'peak_rss_mb': round(sampler.peak_rss / (1024 * 1024), 1),
+        'bytes_written': written_after - written_before if written_before is not None else None,
+        'screenshot_bytes': screenshot_bytes,
+        'stage_seconds': {stage: round(seconds, 3) for stage, seconds in sorted(stage_seconds.items())},
+        'error': error,
+    }
+
+
+def scenario_key(result):
+    return json.dumps([result['fixture'], result['scenario']], sort_keys=True)
+
+
+def load_results(path):
+    results = []
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    results.append(json.loads(line))
+    return results
+
+
+def print_result(result, previous=None):
+    scenario = result['scenario']
+    line = (f"{scenario['device']:<8} workers={scenario['workers']:<2} mode={scenario['capture_mode']:<6} "
+            f"ready={scenario['ready_timeout']:<3} pages={result['pages']:<4} "
+            f"{result['pages_per_minute'] or 0:>7.1f} pages/min  p50={result['page_p50'] or 0:.2f}s "
+            f"p95={result['page_p95'] or 0:.2f}s  rss={result['peak_rss_mb'] or 0:.0f} MB  "
+            f"written={(result['bytes_written'] or 0) / (1024 * 1024):.1f} MB")
+    if previous and previous.get('pages_per_minute') and result.get('pages_per_minute'):
+        change = (result['pages_per_minute'] / previous['pages_per_minute'] - 1) * 100
+        line += f"  ({change:+.1f}% vs {previous.get('label') or previous.get('commit') or 'previous'})"
+    if result['error']:
+        line += f"  ERROR: {result['error']}"
+    print(line)
+
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SnapShot capture engine benchmark')
+    parser.add_argument('--pages', type=int, default=20, help='Pages linked from the fixture index')
+    parser.add_argument('--height', type=int, default=4000, help='Height of every page in pixels')
+    parser.add_argument('--assets', type=int, default=4, help='Images per page')
+    parser.add_argument('--asset-kb', type=int, default=100, help='Size of every image in KB')
+    parser.add_argument('--slow-ms', type=int, default=0, help='Delay of a script on every page in ms')
+    parser.add_argument('--workers', default='1,2', help='Comma-separated concurrency levels')
+    parser.add_argument('--modes', default='cdp', help="Comma-separated capture modes ('cdp', 'resize')")
+    parser.add_argument('--ready-timeouts', default='15', help='Comma-separated readiness timeouts in seconds')
+    parser.add_argument('--devices', default='desktop', help="Comma-separated device views")
+    parser.add_argument('--label', help='Name of this run in the results')
+    parser.add_argument('--results', default=RESULTS_FILE, help='JSON lines file the results are appended to')
+    parser.add_argument('--workdir', help='Scratch directory for the crawls (a temporary one by default)')
+    args = parser.parse_args()
+
+    workers = parse_list(args.workers, int)
+    modes = parse_list(args.modes)
+    ready_timeouts = parse_list(args.ready_timeouts, int)
+    devices = parse_list(args.devices)
+    results_path = os.path.abspath(args.results)
+
+    # The engine reads these when it is imported, and resolves its folders against the working directory
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='snapshot-bench-'))
+    os.makedirs(workdir, exist_ok=True)
+    config_path = os.path.join(workdir, 'domain_config.json')
+    os.environ['DOMAIN_CONFIG_FILE'] = config_path
+    for name, value in (('DRIVER_POOL_SIZE', max(workers)), ('MAX_CAPTURES_GLOBAL', max(workers)),
+                        ('MAX_CHROME_INSTANCES', max(workers) + 1), ('DIFF_ON_CAPTURE', '0'),
+                        ('RESUME_CRAWLS', '0'), ('REQUEST_INTERCEPTION', 'off')):
+        os.environ.setdefault(name, str(value))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+
+    site = FixtureSite(pages=args.pages, height=args.height, assets=args.assets, asset_kb=args.asset_kb,
+                       slow_ms=args.slow_ms)
+    url = site.start()
+    print(f"Fixture site at {url}, crawling in {workdir}")
+
+    history = {}
+    for result in load_results(results_path):
+        history[scenario_key(result)] = result
+
+    commit = git_commit()
+    os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    try:
+        for device in devices:
+            for mode in modes:
+                for ready_timeout in ready_timeouts:
+                    for worker_count in workers:
+                        result = run_scenario(site, url, device, worker_count, mode, ready_timeout, config_path)
+                        result.update({'fixture': site.params(), 'label': args.label, 'commit': commit,
+                                       'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')})
+                        print_result(result, history.get(scenario_key(result)))
+                        with open(results_path, 'a') as f:
+                            f.write(json.dumps(result) + '\n')
+    finally:
+        site.stop()
+    print(f"Results appended to {results_path}")
+
+
+if __name__ == '__main__':
+    main()
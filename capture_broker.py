@@ -0,0 +1,221 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+# Shared task queue between the app (coordinator) and capture worker processes.
+# SQLite is a local stand-in broker for a single host: its WAL journal needs shared memory, so
+# never put the file on a network share (NFS/SMB) for workers on other machines.
+CAPTURE_BROKER_DB = os.environ.get('CAPTURE_BROKER_DB', 'capture_broker.db')
+# When set, the app publishes captures to the broker instead of running Chrome itself
+DISTRIBUTED_CAPTURE = os.environ.get('DISTRIBUTED_CAPTURE', '0') == '1'
+# A claimed task whose worker has not sent a heartbeat for this long is handed to another worker
+TASK_LEASE = int(os.environ.get('CAPTURE_TASK_LEASE', 120))
+MAX_TASK_ATTEMPTS = int(os.environ.get('CAPTURE_TASK_ATTEMPTS', 3))
+POLL_INTERVAL = 1.0
+
+QUEUED = 'queued'
+CLAIMED = 'claimed'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    device_type TEXT NOT NULL,
+    max_links INTEGER NOT NULL,
+    links TEXT,
+    status TEXT NOT NULL,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    heartbeat_at REAL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_job ON tasks (job_id);
+CREATE TABLE IF NOT EXISTS task_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id TEXT NOT NULL,
+    job_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_task_events_job ON task_events (job_id, id);
+"""
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class CaptureBroker:
+    """
+    Capture tasks (one site in one device view) and their progress events.
+
+    The coordinator publishes tasks and reads events, workers claim tasks, append events and
+    finish them. Claims are leases kept alive by heartbeats, so tasks of a crashed worker are
+    picked up by another one.
+    """
+
+    def __init__(self, db_path=CAPTURE_BROKER_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            # Only safe while every node opens the file on the same host
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def publish(self, job_id, url, device_type, max_links=40, links=None):
+        """Queues a capture of `url` (and `links`, or the links found on it) and returns the task id."""
+        task_id = uuid.uuid4().hex
+        self._connect().execute(
+            'INSERT INTO tasks (id, job_id, url, device_type, max_links, links, status, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (task_id, job_id, url, device_type, max_links, json.dumps(links) if links is not None else None,
+             QUEUED, time.time()))
+        return task_id
+
+    def claim(self, worker):
+        """Leases the oldest queued (or abandoned) task to `worker` and returns it as a dict, or None."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT * FROM tasks WHERE status = ? OR (status = ? AND heartbeat_at < ?) '
+                'ORDER BY created_at LIMIT 1',
+                (QUEUED, CLAIMED, now - TASK_LEASE)).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            if row['attempts'] >= MAX_TASK_ATTEMPTS:
+                conn.execute('UPDATE tasks SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                             (FAILED, 'Too many attempts', now, row['id']))
+                conn.execute('COMMIT')
+                return self.claim(worker)
+            conn.execute('UPDATE tasks SET status = ?, worker = ?, attempts = attempts + 1, heartbeat_at = ? '
+                         'WHERE id = ?', (CLAIMED, worker, now, row['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        task = dict(row)
+        task['links'] = json.loads(task['links']) if task['links'] else None
+        if row['status'] == CLAIMED:
+            logging.warning(f"Task {task['id']} taken over from {row['worker']} by {worker}")
+        return task
+
+    def heartbeat(self, task_id, worker):
+        """Extends the lease; returns False when the task was cancelled or taken over."""
+        cursor = self._connect().execute(
+            'UPDATE tasks SET heartbeat_at = ? WHERE id = ? AND worker = ? AND status = ?',
+            (time.time(), task_id, worker, CLAIMED))
+        return cursor.rowcount == 1
+
+    def status(self, task_id):
+        row = self._connect().execute('SELECT status FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        return row['status'] if row else None
+
+    def add_event(self, task, kind, **data):
+        self._connect().execute('INSERT INTO task_events (task_id, job_id, kind, data) VALUES (?, ?, ?, ?)',
+                                (task['id'], task['job_id'], kind, json.dumps(data)))
+
+    def events(self, job_id, after=0):
+        """Returns the events of a job's tasks newer than event id `after`."""
+        rows = self._connect().execute('SELECT * FROM task_events WHERE job_id = ? AND id > ? ORDER BY id',
+                                       (job_id, after))
+        return [{'id': row['id'], 'task_id': row['task_id'], 'kind': row['kind'], **json.loads(row['data'])}
+                for row in rows]
+
+    def finish(self, task_id, worker, result=None, error=None):
+        """Marks the task done (or failed when `error` is set) unless it was cancelled or taken over."""
+        self._connect().execute(
+            'UPDATE tasks SET status = ?, result = ?, error = ?, finished_at = ? '
+            'WHERE id = ? AND worker = ? AND status = ?',
+            (FAILED if error else DONE, json.dumps(result), error, time.time(), task_id, worker, CLAIMED))
+
+    def cancel_job(self, job_id):
+        """Cancels every unfinished task of a job; workers stop after their current page."""
+        self._connect().execute(
+            'UPDATE tasks SET status = ?, finished_at = ? WHERE job_id = ? AND status IN (?, ?)',
+            (CANCELLED, time.time(), job_id, QUEUED, CLAIMED))
+
+    def job_tasks(self, job_id):
+        rows = self._connect().execute('SELECT * FROM tasks WHERE job_id = ? ORDER BY created_at', (job_id,))
+        tasks = []
+        for row in rows:
+            task = dict(row)
+            task['result'] = json.loads(task['result']) if task['result'] else None
+            tasks.append(task)
+        return tasks
+
+    def purge(self, older_than=7 * 24 * 3600):
+        """Deletes finished tasks and their events after `older_than` seconds."""
+        conn = self._connect()
+        cutoff = time.time() - older_than
+        with conn:
+            conn.execute('DELETE FROM task_events WHERE task_id IN '
+                         '(SELECT id FROM tasks WHERE finished_at < ?)', (cutoff,))
+            conn.execute('DELETE FROM tasks WHERE finished_at < ?', (cutoff,))
+
+
+def run_remote_captures(broker, job, captures, max_links=40, links=None):
+    """
+    Publishes `captures` [(url, device_type)] for `job` and waits until workers finished them.
+
+    Worker progress is replayed onto the job (see job_queue.Job) and cancelling the job
+    cancels the tasks. Returns one {url, deviceType, screenshots, error} result per capture,
+    like screenshot_utils.capture_batch.
+    """
+    for url, device_type in captures:
+        broker.publish(job.id, url, device_type, max_links=max_links, links=links)
+
+    last_event = 0
+    cancelled = False
+    while True:
+        for event in broker.events(job.id, last_event):
+            last_event = event['id']
+            if event['kind'] == 'total':
+                job.add_total(event['count'])
+            elif event['kind'] == 'page_done':
+                job.page_done(event['link'], event.get('path'))
+            elif event['kind'] == 'page_failed':
+                job.page_failed(event['link'], event['error'])
+        if job.cancelled and not cancelled:
+            broker.cancel_job(job.id)
+            cancelled = True
+        tasks = broker.job_tasks(job.id)
+        if all(task['status'] in FINISHED_STATES for task in tasks):
+            break
+        time.sleep(POLL_INTERVAL)
+
+    results = []
+    for task in tasks:
+        error = task['error'] or ('Cancelled' if task['status'] == CANCELLED else None)
+        results.append({
+            'url': task['url'],
+            'deviceType': task['device_type'],
+            'screenshots': (task['result'] or {}).get('screenshots', []),
+            'error': error,
+            'worker': task['worker'],
+        })
+    return results
@@ -0,0 +1,280 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+from screenshot_index import SCREENSHOT_INDEX_DB
+
+# Every crawl of a domain in one device view is a run; its pages point at content-addressed
+# blobs (see screenshot_store.py), so earlier versions survive the next capture of a page
+RUN_HISTORY = int(os.environ.get('RUN_HISTORY', 10))
+# An interrupted run (failed, cancelled, or still 'running' without a page for RESUME_STALE_AFTER
+# seconds) is continued by the next crawl of the same domain and view within RESUME_WINDOW seconds
+RESUME_CRAWLS = os.environ.get('RESUME_CRAWLS', '1') == '1'
+RESUME_WINDOW = int(os.environ.get('RESUME_WINDOW', 6 * 3600))
+RESUME_STALE_AFTER = int(os.environ.get('RESUME_STALE_AFTER', 900))
+DIFF_FOLDER = os.path.join('static', 'diffs')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    domain TEXT NOT NULL,
+    device TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    status TEXT NOT NULL,
+    explicit INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_runs_domain ON runs (domain, device, started_at);
+CREATE TABLE IF NOT EXISTS run_pages (
+    run_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    path TEXT NOT NULL,
+    content_hash TEXT,
+    changed INTEGER NOT NULL,
+    captured_at REAL NOT NULL,
+    PRIMARY KEY (run_id, url)
+);
+CREATE INDEX IF NOT EXISTS idx_run_pages_hash ON run_pages (content_hash);
+CREATE TABLE IF NOT EXISTS run_links (
+    run_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (run_id, position)
+);
+CREATE TABLE IF NOT EXISTS page_diffs (
+    run_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    previous_hash TEXT,
+    content_hash TEXT,
+    score REAL NOT NULL,
+    changed_pixels INTEGER NOT NULL,
+    boxes TEXT NOT NULL,
+    mask_path TEXT,
+    method TEXT NOT NULL,
+    computed_at REAL NOT NULL,
+    PRIMARY KEY (run_id, url)
+);
+CREATE INDEX IF NOT EXISTS idx_page_diffs_score ON page_diffs (run_id, score);
+"""
+
+
+class RunStore:
+    """Capture runs and the page versions they produced, kept next to the screenshot index."""
+
+    def __init__(self, db_path=SCREENSHOT_INDEX_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(runs)')]
+            if 'explicit' not in columns:
+                conn.execute('ALTER TABLE runs ADD COLUMN explicit INTEGER NOT NULL DEFAULT 0')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def start(self, domain, device, resume=RESUME_CRAWLS, explicit=False):
+        """
+        Starts a run, or continues the latest interrupted one when `resume` is set. An
+        `explicit` run captures a given list of links, only part of the site, and is never resumed.
+        """
+        if resume and not explicit:
+            interrupted = self.resumable(domain, device)
+            if interrupted:
+                with self._write_lock, self._connect() as conn:
+                    conn.execute("UPDATE runs SET status = 'running', finished_at = NULL WHERE id = ?",
+                                 (interrupted['id'],))
+                return CaptureRun(self, interrupted['id'], domain, device, links=self.links(interrupted['id']),
+                                  captured=self.captured(interrupted['id']))
+        run = CaptureRun(self, uuid.uuid4().hex, domain, device)
+        with self._write_lock, self._connect() as conn:
+            conn.execute('INSERT INTO runs (id, domain, device, started_at, status, explicit) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', (run.id, domain, device, time.time(), 'running', int(explicit)))
+        return run
+
+    def resumable(self, domain, device, window=RESUME_WINDOW, stale_after=RESUME_STALE_AFTER):
+        """Returns the latest run of a domain and view that stopped before capturing all its links."""
+        now = time.time()
+        row = self._connect().execute(
+            """
+            SELECT r.*, COALESCE((SELECT MAX(p.captured_at) FROM run_pages p WHERE p.run_id = r.id),
+                                 r.started_at) AS last_activity
+            FROM runs r WHERE r.domain = ? AND r.device = ? AND r.started_at > ? AND r.explicit = 0
+            AND EXISTS (SELECT 1 FROM run_links l WHERE l.run_id = r.id)
+            ORDER BY r.started_at DESC LIMIT 1
+            """, (domain, device, now - window)).fetchone()
+        if row is None or row['status'] == 'completed':
+            return None
+        # A 'running' run that still records pages belongs to a live crawl
+        if row['status'] == 'running' and row['last_activity'] > now - stale_after:
+            return None
+        return dict(row)
+
+    def set_links(self, run_id, links):
+        """Stores the links a run is going to capture, so it can be resumed in the same order."""
+        with self._write_lock, self._connect() as conn:
+            conn.execute('DELETE FROM run_links WHERE run_id = ?', (run_id,))
+            conn.executemany('INSERT INTO run_links (run_id, position, url) VALUES (?, ?, ?)',
+                             [(run_id, position, url) for position, url in enumerate(links)])
+
+    def links(self, run_id):
+        rows = self._connect().execute('SELECT url FROM run_links WHERE run_id = ? ORDER BY position', (run_id,))
+        return [row['url'] for row in rows]
+
+    def captured(self, run_id):
+        """Returns {url: screenshot path} of the pages a run already saved that are still on disk."""
+        return {page['url']: page['path'] for page in self.pages(run_id) if os.path.exists(page['path'])}
+
+    def manifest(self, run_id):
+        """Returns the run with its planned links and the URL-to-file mapping of its pages."""
+        run = self.get(run_id)
+        if run is None:
+            return None
+        run['links'] = self.links(run_id)
+        run['pages'] = self.pages(run_id)
+        return run
+
+    def record_page(self, run_id, url, path, content_hash, changed):
+        with self._write_lock, self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO run_pages (run_id, url, path, content_hash, changed, captured_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)', (run_id, url, path, content_hash, int(changed), time.time()))
+
+    def finish(self, run_id, status):
+        with self._write_lock, self._connect() as conn:
+            conn.execute('UPDATE runs SET finished_at = ?, status = ? WHERE id = ?', (time.time(), status, run_id))
+
+    def get(self, run_id):
+        row = self._connect().execute('SELECT * FROM runs WHERE id = ?', (run_id,)).fetchone()
+        return dict(row) if row else None
+
+    def pages(self, run_id):
+        rows = self._connect().execute('SELECT * FROM run_pages WHERE run_id = ? ORDER BY url', (run_id,))
+        return [dict(row) for row in rows]
+
+    def list(self, domain=None, device=None, limit=50):
+        query = 'SELECT * FROM runs WHERE 1 = 1'
+        params = []
+        if domain:
+            query += ' AND domain = ?'
+            params.append(domain)
+        if device:
+            query += ' AND device = ?'
+            params.append(device)
+        query += ' ORDER BY started_at DESC LIMIT ?'
+        params.append(limit)
+        return [dict(row) for row in self._connect().execute(query, params)]
+
+    def previous_versions(self, run_id):
+        """Returns {url: content hash} of the latest earlier capture of every page of the run."""
+        run = self.get(run_id)
+        if run is None:
+            return {}
+        rows = self._connect().execute(
+            """
+            SELECT p.url, p.content_hash FROM run_pages p JOIN runs r ON r.id = p.run_id
+            WHERE r.domain = ? AND r.device = ? AND r.started_at < ? AND p.content_hash IS NOT NULL
+            ORDER BY r.started_at
+            """, (run['domain'], run['device'], run['started_at']))
+        return {row['url']: row['content_hash'] for row in rows}
+
+    def record_diff(self, run_id, diff):
+        with self._write_lock, self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO page_diffs (run_id, url, previous_hash, content_hash, score, changed_pixels, '
+                'boxes, mask_path, method, computed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (run_id, diff['url'], diff['previous_hash'], diff['content_hash'], diff['score'],
+                 diff['changed_pixels'], json.dumps(diff['boxes']), diff.get('mask_path'), diff['method'],
+                 time.time()))
+
+    def most_changed(self, domain=None, device=None, run_id=None, limit=20, min_score=0.0):
+        """
+        Returns the page diffs with the highest change score, from the given run or from the
+        latest diffed run of every matching domain and device view.
+        """
+        query = 'SELECT d.*, r.domain, r.device, r.started_at FROM page_diffs d JOIN runs r ON r.id = d.run_id ' \
+                'WHERE d.score > ?'
+        params = [min_score]
+        if run_id:
+            query += ' AND d.run_id = ?'
+            params.append(run_id)
+        else:
+            query += ' AND r.started_at = (SELECT MAX(r2.started_at) FROM runs r2 JOIN page_diffs d2 ' \
+                     'ON d2.run_id = r2.id WHERE r2.domain = r.domain AND r2.device = r.device)'
+        if domain:
+            query += ' AND r.domain = ?'
+            params.append(domain)
+        if device:
+            query += ' AND r.device = ?'
+            params.append(device)
+        query += ' ORDER BY d.score DESC LIMIT ?'
+        params.append(limit)
+        diffs = []
+        for row in self._connect().execute(query, params):
+            diff = dict(row)
+            diff['boxes'] = json.loads(diff['boxes'])
+            diffs.append(diff)
+        return diffs
+
+    def referenced_hashes(self):
+        """Returns the content hashes any retained run still points at (kept by the blob GC)."""
+        return {row[0] for row in self._connect().execute(
+            'SELECT DISTINCT content_hash FROM run_pages WHERE content_hash IS NOT NULL')}
+
+    def prune(self, domain, device, keep=RUN_HISTORY):
+        """Forgets all but the newest `keep` runs of a domain in one device view."""
+        with self._write_lock, self._connect() as conn:
+            old = [row['id'] for row in conn.execute(
+                'SELECT id FROM runs WHERE domain = ? AND device = ? ORDER BY started_at DESC LIMIT -1 OFFSET ?',
+                (domain, device, keep))]
+            for run_id in old:
+                conn.execute('DELETE FROM page_diffs WHERE run_id = ?', (run_id,))
+                conn.execute('DELETE FROM run_pages WHERE run_id = ?', (run_id,))
+                conn.execute('DELETE FROM run_links WHERE run_id = ?', (run_id,))
+                conn.execute('DELETE FROM runs WHERE id = ?', (run_id,))
+        for run_id in old:
+            shutil.rmtree(os.path.join(DIFF_FOLDER, run_id), ignore_errors=True)
+        if old:
+            logging.info(f"Pruned {len(old)} old capture runs of {domain} ({device})")
+        return old
+
+
+class CaptureRun:
+    """Handle of a running crawl, passed down to capture_page like the change cache."""
+
+    def __init__(self, store, run_id, domain, device, links=None, captured=None):
+        self.store = store
+        self.id = run_id
+        self.domain = domain
+        self.device = device
+        # A resumed run starts with its planned links and the pages it already saved
+        self.resumed = links is not None
+        self.links = links
+        self.captured = captured or {}
+
+    def set_links(self, links):
+        if not self.resumed:
+            self.links = list(links)
+            self.store.set_links(self.id, self.links)
+
+    def record_page(self, url, path, content_hash, changed):
+        self.store.record_page(self.id, url, path, content_hash, changed)
+
+    def finish(self, status='completed'):
+        self.store.finish(self.id, status)
+        self.store.prune(self.domain, self.device)
+
+
+run_store = RunStore()
@@ -0,0 +1,166 @@
+"""
+Headless capture worker for distributed mode.
+
+Claims capture tasks from the broker (see capture_broker.py), crawls them with the regular
+capture engine and uploads every screenshot to the coordinating app:
+
+    python capture_worker.py --coordinator http://localhost:5000 --token $WORKER_TOKEN
+
+The SQLite broker only works for workers on the coordinator's host. Without --coordinator
+the screenshots stay in this worker's static/screenshots, which is enough when it runs in
+the app's directory.
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from capture_broker import CAPTURE_BROKER_DB, TASK_LEASE, CaptureBroker, worker_name
+from job_queue import JobCancelled
+from log_store import LOG_DATE_FORMAT, LOG_FORMAT
+from screenshot_index import screenshot_index
+from screenshot_utils import BASE_SCREENSHOT_FOLDER, CAPTURE_WORKERS, crawl_site
+
+UPLOAD_TIMEOUT = 60
+# Uploads run off the capture threads, so a slow coordinator does not hold up a browser
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 4))
+IDLE_SLEEP = 2.0
+
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+
+
+def upload_screenshot(coordinator, token, path, source_url=None):
+    """PUTs a screenshot to the coordinator under its path relative to the screenshot root."""
+    rel_path = screenshot_index.relative_path(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    request = urllib.request.Request(
+        f"{coordinator.rstrip('/')}/api/workers/files/{quote(rel_path)}", data=data, method='PUT',
+        headers={'X-Worker-Token': token or '', 'X-Source-Url': source_url or '',
+                 'Content-Type': 'application/octet-stream'})
+    with urllib.request.urlopen(request, timeout=UPLOAD_TIMEOUT) as response:
+        response.read()
+    return rel_path
+
+
+class TaskProgress:
+    """The job progress interface (see job_queue.Job) reporting into the broker."""
+
+    def __init__(self, broker, task, worker, coordinator=None, token=None):
+        self.broker = broker
+        self.task = task
+        # Chrome usage of the task is reported under the coordinator's job id
+        self.id = task['job_id']
+        self.worker = worker
+        self.coordinator = coordinator
+        self.token = token
+        self.screenshots = []
+        self._uploads = []
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        self._heartbeat = threading.Thread(target=self._keep_alive, daemon=True)
+        self._heartbeat.start()
+
+    def _keep_alive(self):
+        while not self._done.wait(max(1, TASK_LEASE / 4)):
+            if not self.broker.heartbeat(self.task['id'], self.worker):
+                self._cancelled.set()
+                return
+
+    def stop(self):
+        self._done.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    def add_total(self, count):
+        self.broker.add_event(self.task, 'total', count=count)
+
+    def page_done(self, link, path=None):
+        if path and self.coordinator:
+            with self._lock:
+                self._uploads.append(upload_executor.submit(self._upload, link, path))
+            return
+        self._report_done(link, path)
+
+    def _upload(self, link, path):
+        try:
+            upload_screenshot(self.coordinator, self.token, path, source_url=link)
+        except Exception as e:
+            self.page_failed(link, f"Upload failed: {e}")
+            return
+        self._report_done(link, path)
+
+    def _report_done(self, link, path):
+        if path:
+            # Paths are reported relative to the app's working directory, like local captures
+            path = os.path.join(BASE_SCREENSHOT_FOLDER, screenshot_index.relative_path(path))
+            with self._lock:
+                self.screenshots.append(path)
+        self.broker.add_event(self.task, 'page_done', link=link, path=path)
+
+    def wait_for_uploads(self):
+        """Waits until every screenshot handed to page_done() is uploaded (or reported as failed)."""
+        with self._lock:
+            uploads = list(self._uploads)
+        for future in uploads:
+            future.result()
+
+    def page_failed(self, link, error):
+        self.broker.add_event(self.task, 'page_failed', link=link, error=str(error))
+
+
+def run_task(broker, task, worker, coordinator=None, token=None, workers=CAPTURE_WORKERS):
+    progress = TaskProgress(broker, task, worker, coordinator, token)
+    logging.info(f"Worker {worker} capturing {task['url']} ({task['device_type']}), task {task['id']}")
+    try:
+        try:
+            crawl_site(task['url'], task['device_type'], max_links=task['max_links'], workers=workers,
+                       progress=progress, links=task['links'])
+        finally:
+            progress.wait_for_uploads()
+    except Exception as e:
+        logging.error(f"Task {task['id']} failed: {e}")
+        broker.finish(task['id'], worker, result={'screenshots': progress.screenshots}, error=str(e))
+    else:
+        broker.finish(task['id'], worker, result={'screenshots': progress.screenshots})
+    finally:
+        progress.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SnapShot capture worker')
+    parser.add_argument('--broker', default=CAPTURE_BROKER_DB, help='Path of the broker database')
+    parser.add_argument('--coordinator', default=os.environ.get('COORDINATOR_URL'),
+                        help='Base URL of the app that receives the screenshots')
+    parser.add_argument('--token', default=os.environ.get('WORKER_TOKEN'), help='Upload token (WORKER_TOKEN)')
+    parser.add_argument('--workers', type=int, default=CAPTURE_WORKERS, help='Pages captured in parallel')
+    parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+    broker = CaptureBroker(args.broker)
+    worker = worker_name()
+    logging.info(f"Capture worker {worker} started")
+    while True:
+        task = broker.claim(worker)
+        if task is None:
+            if args.once:
+                break
+            time.sleep(IDLE_SLEEP)
+            continue
+        run_task(broker, task, worker, args.coordinator, args.token, args.workers)
+
+
+if __name__ == '__main__':
+    main()
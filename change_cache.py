@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import urllib.request
+
+from repository import file_lock
+
+CAPTURE_CACHE_FOLDER = 'capture_cache'
+HEAD_TIMEOUT = 5
+
+# Text, images and document size describe what ends up on the screenshot well enough
+# while ignoring markup noise such as CSRF tokens or inline timestamps.
+PAGE_SIGNATURE_SCRIPT = """
+var body = document.body;
+var root = document.documentElement;
+var images = Array.prototype.map.call(document.images || [], function (img) { return img.currentSrc || img.src; });
+var styles = Array.prototype.map.call(document.styleSheets || [], function (sheet) { return sheet.href || ''; });
+return [
+    body ? body.innerText : '',
+    images.join('|'),
+    styles.join('|'),
+    root ? root.scrollWidth + 'x' + root.scrollHeight : ''
+].join('\\n');
+"""
+
+
+def get_page_signature(driver):
+    """Returns a hash of the rendered page content."""
+    content = driver.execute_script(PAGE_SIGNATURE_SCRIPT) or ''
+    return hashlib.sha256(content.encode('utf-8', 'replace')).hexdigest()
+
+
+def get_http_validators(url, timeout=HEAD_TIMEOUT):
+    """Returns the ETag and Last-Modified headers of the URL, or None when unavailable."""
+    try:
+        request = urllib.request.Request(url, method='HEAD', headers={'User-Agent': 'SnapShot'})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+    except Exception as e:
+        logging.info(f"HEAD request failed for {url}: {e}")
+        return None
+    if not etag and not last_modified:
+        return None
+    return {'etag': etag, 'last_modified': last_modified}
+
+
+class ChangeCache:
+    """
+    Remembers what was captured for every URL of a domain in one device view.
+
+    Entries are kept in `capture_cache/<domain>_<device>.json` and hold the page signature,
+    the HTTP validators and the size and mtime of the written file, so a cached file is only
+    reused while it is still the exact file that was captured.
+    """
+
+    def __init__(self, domain_name, device_type):
+        os.makedirs(CAPTURE_CACHE_FOLDER, exist_ok=True)
+        self.path = os.path.join(CAPTURE_CACHE_FOLDER, f"{domain_name}_{device_type}.json")
+        self._lock = threading.Lock()
+        self._entries = self._load()
+        # Keys stored by this crawl, merged into the file on save
+        self._changed = set()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Cannot read capture cache '{self.path}': {e}")
+            return {}
+
+    @staticmethod
+    def _key(url, device_type):
+        return f"{device_type}|{url}"
+
+    def _valid_entry(self, url, device_type):
+        entry = self._entries.get(self._key(url, device_type))
+        if not entry:
+            return None
+        try:
+            stat = os.stat(entry['path'])
+        except (OSError, KeyError):
+            return None
+        if stat.st_size != entry.get('size') or int(stat.st_mtime) != entry.get('mtime'):
+            return None
+        return entry
+
+    def matches_validators(self, url, device_type, validators):
+        """Checks whether the server reports the same ETag/Last-Modified as last time."""
+        with self._lock:
+            entry = self._valid_entry(url, device_type)
+        return bool(entry and validators and entry.get('validators') == validators)
+
+    def matches_signature(self, url, device_type, signature):
+        """Checks whether the rendered page looks the same as last time."""
+        with self._lock:
+            entry = self._valid_entry(url, device_type)
+        return bool(entry and entry.get('signature') == signature)
+
+    def reuse(self, url, device_type, screenshot_path):
+        """Makes the previous capture of the URL available under `screenshot_path`."""
+        with self._lock:
+            entry = self._valid_entry(url, device_type)
+            if entry is None:
+                return False
+            # The file may be a hard link to a shared blob, so it is never touched in place
+            if os.path.abspath(entry['path']) != os.path.abspath(screenshot_path):
+                tmp_path = f"{screenshot_path}.tmp"
+                shutil.copyfile(entry['path'], tmp_path)
+                os.replace(tmp_path, screenshot_path)
+            self._store(url, device_type, screenshot_path, entry.get('signature'), entry.get('validators'))
+            return True
+
+    def record(self, url, device_type, screenshot_path, signature=None, validators=None):
+        """Remembers a fresh capture."""
+        with self._lock:
+            self._store(url, device_type, screenshot_path, signature, validators)
+
+    def _store(self, url, device_type, screenshot_path, signature, validators):
+        stat = os.stat(screenshot_path)
+        key = self._key(url, device_type)
+        self._changed.add(key)
+        self._entries[key] = {
+            'path': screenshot_path,
+            'signature': signature,
+            'validators': validators,
+            'size': stat.st_size,
+            'mtime': int(stat.st_mtime),
+            'captured_at': time.time(),
+        }
+
+    def save(self):
+        """
+        Merges the entries stored by this crawl into the file and writes it atomically, so
+        concurrent crawls of the same domain and view keep each other's entries.
+        """
+        with self._lock, file_lock(self.path):
+            entries = self._load()
+            for key in self._changed:
+                ours = self._entries[key]
+                theirs = entries.get(key)
+                if theirs is None or theirs.get('captured_at', 0) <= ours['captured_at']:
+                    entries[key] = ours
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f, indent=4)
+            os.replace(tmp_path, self.path)
+            self._entries = entries
+            self._changed.clear()
@@ -0,0 +1,340 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import psutil
+
+# Limits for all Chrome instances of this process (overridable through environment variables)
+MAX_CHROME_INSTANCES = int(os.environ.get('MAX_CHROME_INSTANCES', 6))
+MAX_CHROME_RSS_MB = int(os.environ.get('MAX_CHROME_RSS_MB', 6000))
+# A leased browser that has not finished a page for this long is considered stuck and killed
+CHROME_STUCK_TIMEOUT = int(os.environ.get('CHROME_STUCK_TIMEOUT', 600))
+# Processes of a quit browser still alive after this many seconds are leaked and killed
+CHROME_LEAK_GRACE = int(os.environ.get('CHROME_LEAK_GRACE', 30))
+CHROME_WATCHDOG_INTERVAL = int(os.environ.get('CHROME_WATCHDOG_INTERVAL', 15))
+# How many finished owners (jobs) keep their usage figures
+MAX_OWNER_HISTORY = 200
+
+
+class ChromeTree:
+    """A chromedriver process and the browser processes it started."""
+
+    def __init__(self, pid, profile):
+        self.pid = pid
+        self.profile = profile
+        self.owner = None
+        self.leased_at = None
+        self.last_activity = time.time()
+        self.pages = 0
+        self.rss_mb = 0.0
+        self.cpu_percent = 0.0
+        # pid -> psutil.Process of every process seen in the tree, kept to catch leaked children
+        self.processes = {}
+        self.closed_at = None
+
+    def sample(self):
+        """Refreshes the tree's processes, resident memory and CPU usage."""
+        try:
+            root = self.processes.get(self.pid) or psutil.Process(self.pid)
+            found = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            found = []
+        for process in found:
+            # Keep the known Process objects, cpu_percent() measures since their last call
+            self.processes.setdefault(process.pid, process)
+        rss = 0
+        cpu = 0.0
+        for pid, process in list(self.processes.items()):
+            try:
+                if not process.is_running():
+                    raise psutil.NoSuchProcess(pid)
+                rss += process.memory_info().rss
+                cpu += process.cpu_percent(None)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                del self.processes[pid]
+        self.rss_mb = rss / (1024 * 1024)
+        self.cpu_percent = cpu
+        return self.rss_mb
+
+    def alive(self):
+        return [process for process in self.processes.values() if process.is_running()]
+
+    def kill(self):
+        """Kills every process of the tree, children first. Returns the number of killed processes."""
+        self.sample()
+        processes = sorted(self.processes.values(), key=lambda process: process.pid != self.pid)
+        killed = 0
+        for process in reversed(processes):
+            try:
+                process.kill()
+                killed += 1
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        psutil.wait_procs(processes, timeout=5)
+        self.processes.clear()
+        return killed
+
+    def to_dict(self):
+        return {
+            'pid': self.pid,
+            'profile': self.profile,
+            'owner': self.owner,
+            'processes': len(self.processes),
+            'rss_mb': round(self.rss_mb, 1),
+            'cpu_percent': round(self.cpu_percent, 1),
+            'pages': self.pages,
+            'idle_for': round(time.time() - self.last_activity, 1),
+        }
+
+
+class ChromeGovernor:
+    """
+    Keeps track of the Chrome process trees started by the driver pools.
+
+    New browsers are admitted only while fewer than `max_instances` run and their combined
+    resident memory stays below `max_rss_mb`. To make room, idle browsers are killed first,
+    the largest ones above the memory limit and the longest idle one at the instance limit
+    (the pool discards them on the next health check). A watchdog thread kills
+    trees that are stuck on a page or that survived their driver's quit, and never touches
+    Chrome processes this governor did not start. Usage is attributed to the owner (job)
+    that leased the browser.
+    """
+
+    def __init__(self, max_instances=MAX_CHROME_INSTANCES, max_rss_mb=MAX_CHROME_RSS_MB,
+                 stuck_timeout=CHROME_STUCK_TIMEOUT, leak_grace=CHROME_LEAK_GRACE,
+                 interval=CHROME_WATCHDOG_INTERVAL):
+        self.max_instances = max_instances
+        self.max_rss_mb = max_rss_mb
+        self.stuck_timeout = stuck_timeout
+        self.leak_grace = leak_grace
+        self.interval = interval
+        self._trees = {}
+        self._closing = []
+        self._starting = 0
+        self._owners = OrderedDict()
+        self._killed = {'stuck': 0, 'leaked': 0, 'memory': 0, 'idle': 0}
+        self._condition = threading.Condition()
+        self._watchdog = None
+
+    def _total_rss_mb(self):
+        return sum(tree.rss_mb for tree in self._trees.values())
+
+    @contextmanager
+    def instance_slot(self, timeout=None):
+        """Waits until another browser may be started; the new browser is registered inside."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._condition:
+                victims = self._wait_for_room(deadline)
+                if not victims:
+                    self._starting += 1
+                    break
+            self._kill_trees(victims)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._starting -= 1
+                self._condition.notify_all()
+
+    def _wait_for_room(self, deadline):
+        """Waits until another browser fits; returns the idle trees to kill instead when that makes room."""
+        while len(self._trees) + self._starting >= self.max_instances or self._total_rss_mb() >= self.max_rss_mb:
+            victims = self._make_room()
+            if victims:
+                return victims
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise TimeoutError(f"No Chrome instance available ({len(self._trees)} running, "
+                                   f"{self._total_rss_mb():.0f} MB used)")
+            self._condition.wait(min(self.interval, remaining) if remaining is not None else self.interval)
+            self._sample_all()
+        return []
+
+    def register(self, pid, profile):
+        tree = ChromeTree(pid, profile)
+        tree.sample()
+        with self._condition:
+            self._trees[pid] = tree
+        self._start_watchdog()
+        return tree
+
+    def unregister(self, pid):
+        """Called right before a driver quits; processes that outlive the grace period are killed."""
+        with self._condition:
+            tree = self._trees.pop(pid, None)
+            if tree is not None:
+                # Remember the children while chromedriver can still list them
+                tree.sample()
+                self._release_owner(tree)
+                tree.closed_at = time.time()
+                self._closing.append(tree)
+            self._condition.notify_all()
+
+    def lease(self, pid, owner=None):
+        with self._condition:
+            tree = self._trees.get(pid)
+            if tree is None:
+                return
+            tree.owner = owner
+            tree.leased_at = tree.last_activity = time.time()
+            if owner is not None:
+                usage = self._owner_usage(owner)
+                usage['instances'] += 1
+
+    def release(self, pid):
+        with self._condition:
+            tree = self._trees.get(pid)
+            if tree is not None:
+                self._release_owner(tree)
+                tree.leased_at = None
+                tree.last_activity = time.time()
+
+    def touch(self, pid):
+        """Records a finished page, which resets the stuck timer."""
+        with self._condition:
+            tree = self._trees.get(pid)
+            if tree is None:
+                return
+            tree.pages += 1
+            tree.last_activity = time.time()
+            if tree.owner is not None:
+                self._owner_usage(tree.owner)['pages'] += 1
+
+    def _owner_usage(self, owner):
+        usage = self._owners.get(owner)
+        if usage is None:
+            usage = {'instances': 0, 'pages': 0, 'rss_mb': 0.0, 'peak_rss_mb': 0.0, 'cpu_percent': 0.0,
+                     'first_seen': time.time(), 'last_seen': time.time()}
+            self._owners[owner] = usage
+            while len(self._owners) > MAX_OWNER_HISTORY:
+                self._owners.popitem(last=False)
+        self._owners.move_to_end(owner)
+        return usage
+
+    def _release_owner(self, tree):
+        if tree.owner is not None and tree.owner in self._owners:
+            usage = self._owners[tree.owner]
+            usage['instances'] = max(0, usage['instances'] - 1)
+            usage['last_seen'] = time.time()
+        tree.owner = None
+
+    def _sample_all(self):
+        for tree in list(self._trees.values()):
+            tree.sample()
+        for usage in self._owners.values():
+            usage['rss_mb'] = 0.0
+            usage['cpu_percent'] = 0.0
+        for tree in self._trees.values():
+            if tree.owner is not None:
+                usage = self._owner_usage(tree.owner)
+                usage['rss_mb'] += tree.rss_mb
+                usage['cpu_percent'] += tree.cpu_percent
+                usage['peak_rss_mb'] = max(usage['peak_rss_mb'], usage['rss_mb'])
+                usage['last_seen'] = time.time()
+
+    def _detach(self, tree, reason=None):
+        """Stops tracking a tree that is about to be killed; returns (tree, reason, owner) for _kill_trees()."""
+        owner = tree.owner
+        if reason:
+            self._killed[reason] += 1
+        if self._trees.pop(tree.pid, None) is not None:
+            self._release_owner(tree)
+        return tree, reason, owner
+
+    @staticmethod
+    def _kill_trees(victims):
+        """Kills detached trees; called without the lock, as every kill waits up to seconds."""
+        for tree, reason, owner in victims:
+            # The pool notices the dead driver on its next health check and quits it
+            killed = tree.kill()
+            if reason:
+                logging.warning(f"Killed {reason} Chrome tree {tree.pid} ({tree.profile}, owner {owner}): "
+                                f"{killed} processes")
+
+    def _kill_idle(self):
+        """Detaches idle browsers, largest first, until memory is back under the limit."""
+        victims = []
+        for tree in sorted(self._trees.values(), key=lambda tree: tree.rss_mb, reverse=True):
+            if self._total_rss_mb() < self.max_rss_mb:
+                break
+            if tree.leased_at is None:
+                victims.append(self._detach(tree, 'memory'))
+        return victims
+
+    def _make_room(self):
+        """Detaches idle browsers so a new one can start; returns none when all of them are busy."""
+        if self._total_rss_mb() >= self.max_rss_mb:
+            return self._kill_idle()
+        # A browser idling in another profile's pool makes room for this one
+        idle = [tree for tree in self._trees.values() if tree.leased_at is None]
+        if not idle:
+            return []
+        return [self._detach(min(idle, key=lambda tree: tree.last_activity), 'idle')]
+
+    def check(self):
+        """One watchdog pass: samples every tree and kills stuck, leaked and surplus idle ones."""
+        now = time.time()
+        victims = []
+        with self._condition:
+            self._sample_all()
+            for tree in list(self._trees.values()):
+                if tree.leased_at is not None and now - tree.last_activity > self.stuck_timeout:
+                    victims.append(self._detach(tree, 'stuck'))
+            if self._total_rss_mb() >= self.max_rss_mb:
+                logging.warning(f"Chrome uses {self._total_rss_mb():.0f} MB, limit is {self.max_rss_mb} MB")
+                victims.extend(self._kill_idle())
+            for tree in list(self._closing):
+                if now - tree.closed_at < self.leak_grace:
+                    continue
+                self._closing.remove(tree)
+                if tree.alive():
+                    victims.append(self._detach(tree, 'leaked'))
+            self._condition.notify_all()
+        self._kill_trees(victims)
+
+    def _start_watchdog(self):
+        with self._condition:
+            if self._watchdog is not None:
+                return
+            self._watchdog = threading.Thread(target=self._watch, name='chrome-governor', daemon=True)
+        self._watchdog.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"Chrome watchdog failed: {e}")
+
+    def kill(self, owner=None):
+        """Kills the browsers of one owner, or every browser this governor tracks."""
+        with self._condition:
+            victims = [self._detach(tree) for tree in list(self._trees.values())
+                       if owner is None or tree.owner == owner]
+            self._condition.notify_all()
+        self._kill_trees(victims)
+        return len(victims)
+
+    def usage(self, owner=None):
+        """Returns the current Chrome usage, overall or of a single owner."""
+        with self._condition:
+            if owner is not None:
+                usage = self._owners.get(owner)
+                return dict(usage) if usage else None
+            return {
+                'instances': len(self._trees),
+                'max_instances': self.max_instances,
+                'rss_mb': round(self._total_rss_mb(), 1),
+                'max_rss_mb': self.max_rss_mb,
+                'killed': dict(self._killed),
+                'trees': [tree.to_dict() for tree in self._trees.values()],
+                'owners': {owner: dict(usage) for owner, usage in self._owners.items()},
+            }
+
+
+chrome_governor = ChromeGovernor()
@@ -0,0 +1,77 @@
+import json
+import logging
+import os
+import threading
+
+# Per-domain capture settings, e.g.
+# {"defaults": {"ready_timeout": 15}, "domains": {"cukierniapati.pl": {"ready_timeout": 30}}}
+DOMAIN_CONFIG_FILE = os.environ.get('DOMAIN_CONFIG_FILE', 'domain_config.json')
+
+DEFAULT_DOMAIN_CONFIG = {
+    'ready_timeout': 15,
+    # 'dom', 'headers' or 'off'
+    'change_detection': 'dom',
+    # Scheduled captures (see scheduler.py): seconds between runs (0 = off), device views, priority
+    'capture_interval': 24 * 3600,
+    'capture_devices': ['desktop', 'mobile'],
+    'capture_priority': 0,
+    # Politeness settings default to the values in rate_limiter.py: 'rate_limit' (page loads
+    # per second), 'burst', 'max_concurrency', 'backoff_base' and 'backoff_max' (seconds).
+    # Link discovery (see link_rules.py): 'link_rules' replaces the default filters,
+    # 'link_priority' lists regexes of links to capture first, 'tracking_params' and
+    # 'ignore_query' control which query variants count as the same page.
+    # Link source (see link_sources.py): 'page', 'sitemap', 'bfs' or 'auto'
+    'link_source': 'page',
+    'crawl_depth': 2,
+    'respect_robots': True,
+    # Request filtering (see request_filter.py): blocked third-party categories, extra wildcard
+    # URL patterns, blocked resource types ('media', 'font', 'image') and the static asset cache
+    'block_categories': ['analytics', 'ads', 'chat'],
+    'block_urls': [],
+    'block_resource_types': [],
+    'asset_cache': True,
+    # 'cdp' (DevTools full-page capture) or 'resize' (stretch the window to the page height)
+    'capture_mode': 'cdp',
+}
+
+_config_cache = {'mtime': None, 'data': {}}
+_config_lock = threading.Lock()
+
+
+def load_domain_config():
+    """Loads the domain config file, re-reading it only when it changed on disk."""
+    try:
+        mtime = os.path.getmtime(DOMAIN_CONFIG_FILE)
+    except OSError:
+        return {}
+
+    with _config_lock:
+        if _config_cache['mtime'] != mtime:
+            try:
+                with open(DOMAIN_CONFIG_FILE, 'r') as f:
+                    _config_cache['data'] = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.error(f"Cannot read domain config '{DOMAIN_CONFIG_FILE}': {e}")
+                _config_cache['data'] = {}
+            _config_cache['mtime'] = mtime
+        return _config_cache['data']
+
+
+def get_domain_settings(domain):
+    """Returns the merged defaults and overrides for the given domain (with or without 'www.')."""
+    config = load_domain_config()
+    settings = dict(DEFAULT_DOMAIN_CONFIG)
+    settings.update(config.get('defaults', {}))
+
+    domains = config.get('domains', {})
+    bare_domain = domain.replace('www.', '') if domain else domain
+    for key in (bare_domain, f"www.{bare_domain}", domain):
+        if key in domains:
+            settings.update(domains[key])
+            break
+    return settings
+
+
+def get_domain_setting(domain, key, default=None):
+    """Returns a single setting for the given domain."""
+    return get_domain_settings(domain).get(key, default)
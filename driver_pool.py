@@ -0,0 +1,240 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import psutil
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+
+from chrome_governor import chrome_governor
+from metrics import observe, timed
+
+# Pool settings (overridable through environment variables)
+DRIVER_POOL_SIZE = int(os.environ.get('DRIVER_POOL_SIZE', 2))
+DRIVER_MAX_PAGES = int(os.environ.get('DRIVER_MAX_PAGES', 100))
+DRIVER_MAX_RSS_MB = int(os.environ.get('DRIVER_MAX_RSS_MB', 1500))
+DRIVER_BORROW_TIMEOUT = int(os.environ.get('DRIVER_BORROW_TIMEOUT', 900))
+
+
+class PooledDriver:
+    """Bookkeeping for a single Chrome instance owned by the pool."""
+
+    def __init__(self, driver, profile):
+        self.driver = driver
+        self.profile = profile
+        self.pid = getattr(getattr(driver.service, 'process', None), 'pid', None)
+        self.pages = 0
+        self.created_at = time.time()
+
+
+class DriverPool:
+    """
+    Bounded, thread-safe pool of warm headless Chrome drivers.
+
+    Every profile (e.g. 'desktop', 'mobile') has its own set of drivers created with its own
+    options, and at most `size` drivers per profile are alive at any time. Drivers are
+    health-checked when borrowed and recycled after `max_pages` pages or once the Chrome
+    process tree grows beyond `max_rss_mb`. `factory(service=..., options=...)` starts a
+    driver, webdriver.Chrome by default. New browsers also need an instance slot of the
+    Chrome governor (see chrome_governor.py), which limits all pools together.
+    """
+
+    def __init__(self, profiles, size=DRIVER_POOL_SIZE, max_pages=DRIVER_MAX_PAGES, max_rss_mb=DRIVER_MAX_RSS_MB,
+                 factory=None):
+        self._profiles = profiles
+        self._factory = factory or webdriver.Chrome
+        self._size = size
+        self._max_pages = max_pages
+        self._max_rss_mb = max_rss_mb
+        self._idle = {profile: queue.LifoQueue() for profile in profiles}
+        self._slots = {profile: threading.BoundedSemaphore(size) for profile in profiles}
+        self._leased = {}
+        self._lock = threading.Lock()
+        # Separate from _lock: resolving the path may download chromedriver
+        self._driver_path_lock = threading.Lock()
+        self._driver_path = None
+        self._closed = False
+
+    def _get_driver_path(self):
+        """Resolves the chromedriver binary once instead of on every launch."""
+        with self._driver_path_lock:
+            if self._driver_path is None:
+                self._driver_path = ChromeDriverManager().install()
+            return self._driver_path
+
+    def _create(self, profile, timeout=DRIVER_BORROW_TIMEOUT):
+        with chrome_governor.instance_slot(timeout=timeout), timed('driver_start', device=profile):
+            driver = self._factory(service=Service(self._get_driver_path()), options=self._profiles[profile])
+            pooled = PooledDriver(driver, profile)
+            if pooled.pid:
+                chrome_governor.register(pooled.pid, profile)
+        logging.info(f"Started new {profile} Chrome driver")
+        return pooled
+
+    def _quit(self, pooled):
+        if pooled.pid:
+            chrome_governor.unregister(pooled.pid)
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            logging.error(f"Error shutting down {pooled.profile} driver: {e}")
+
+    def rss_mb(self, pooled):
+        """Returns the resident memory of the chromedriver process and all of its children."""
+        try:
+            process = psutil.Process(pooled.pid)
+            total = process.memory_info().rss
+            for child in process.children(recursive=True):
+                try:
+                    total += child.memory_info().rss
+                except psutil.NoSuchProcess:
+                    pass
+            return total / (1024 * 1024)
+        except (psutil.NoSuchProcess, AttributeError):
+            return 0
+
+    def is_healthy(self, pooled):
+        """Checks that the browser process is alive and still answers commands."""
+        try:
+            if pooled.driver.service.process.poll() is not None:
+                return False
+            return pooled.driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def _needs_recycle(self, pooled):
+        if pooled.pages >= self._max_pages:
+            logging.info(f"Recycling {pooled.profile} driver after {pooled.pages} pages")
+            return True
+        rss = self.rss_mb(pooled)
+        if rss > self._max_rss_mb:
+            logging.info(f"Recycling {pooled.profile} driver using {rss:.0f} MB")
+            return True
+        return False
+
+    def acquire(self, profile, timeout=DRIVER_BORROW_TIMEOUT, owner=None):
+        """
+        Borrows a healthy driver for the given profile, starting a new one if none is idle.
+        `owner` (e.g. a job id) is charged for the browser's resource usage.
+        """
+        if profile not in self._profiles:
+            raise ValueError(f"Unknown driver profile: {profile}")
+        if self._closed:
+            raise RuntimeError("Driver pool is shut down.")
+        started = time.perf_counter()
+        if not self._slots[profile].acquire(timeout=timeout):
+            raise TimeoutError(f"No {profile} driver available after {timeout} seconds.")
+
+        try:
+            pooled = None
+            while pooled is None:
+                try:
+                    candidate = self._idle[profile].get_nowait()
+                except queue.Empty:
+                    pooled = self._create(profile)
+                    break
+                if self.is_healthy(candidate):
+                    pooled = candidate
+                else:
+                    logging.warning(f"Discarding unhealthy {profile} driver")
+                    self._quit(candidate)
+        except Exception:
+            self._slots[profile].release()
+            raise
+
+        with self._lock:
+            self._leased[id(pooled.driver)] = pooled
+        observe('driver_acquire', time.perf_counter() - started, device=profile)
+        if pooled.pid:
+            chrome_governor.lease(pooled.pid, owner)
+        return pooled.driver
+
+    def release(self, driver, discard=False):
+        """Returns a driver to the pool, or quits it when it is broken or due for recycling."""
+        with self._lock:
+            pooled = self._leased.pop(id(driver), None)
+        if pooled is None:
+            return
+        if pooled.pid:
+            chrome_governor.release(pooled.pid)
+
+        try:
+            if discard or self._closed or self._needs_recycle(pooled):
+                self._quit(pooled)
+                return
+            try:
+                driver.delete_all_cookies()
+                driver.get("about:blank")
+            except Exception as e:
+                logging.warning(f"Discarding {pooled.profile} driver after failed reset: {e}")
+                self._quit(pooled)
+                return
+            self._idle[pooled.profile].put(pooled)
+        finally:
+            self._slots[pooled.profile].release()
+
+    def record_page(self, driver):
+        """Counts a visited page against the driver's recycling budget."""
+        with self._lock:
+            pooled = self._leased.get(id(driver))
+            if pooled:
+                pooled.pages += 1
+        if pooled and pooled.pid:
+            chrome_governor.touch(pooled.pid)
+
+    @contextmanager
+    def driver(self, profile, owner=None):
+        """Context manager that borrows a driver and always gives it back."""
+        driver = self.acquire(profile, owner=owner)
+        try:
+            yield driver
+        except Exception:
+            self.release(driver, discard=not self._is_alive(driver))
+            raise
+        else:
+            self.release(driver)
+
+    def _is_alive(self, driver):
+        with self._lock:
+            pooled = self._leased.get(id(driver))
+        return pooled is not None and self.is_healthy(pooled)
+
+    def stats(self):
+        """Returns the number of idle and leased drivers per profile."""
+        with self._lock:
+            leased = [pooled.profile for pooled in self._leased.values()]
+        return {
+            profile: {'idle': self._idle[profile].qsize(), 'leased': leased.count(profile), 'max': self._size}
+            for profile in self._profiles
+        }
+
+    def clear(self):
+        """Quits every idle driver; the pool stays open and starts new ones on demand."""
+        for profile, idle in self._idle.items():
+            while True:
+                try:
+                    self._quit(idle.get_nowait())
+                except queue.Empty:
+                    break
+
+    def shutdown(self):
+        """Quits every idle and leased driver. Safe to call more than once."""
+        self._closed = True
+        self.clear()
+        with self._lock:
+            leased = list(self._leased.values())
+            self._leased.clear()
+        for pooled in leased:
+            self._quit(pooled)
+
+
+def create_pool(profiles, **kwargs):
+    """Creates a driver pool that is shut down automatically when the interpreter exits."""
+    pool = DriverPool(profiles, **kwargs)
+    atexit.register(pool.shutdown)
+    return pool
@@ -1,6 +1,9 @@
-from datetime import datetime
+import os
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List
+from typing import List, Tuple
+
+from screenshot_index import screenshot_index
 
 
 def find_screenshots_by_date(screenshots_dir: str, start_date: datetime, end_date: datetime, domain: str = None,
@@ -22,6 +25,20 @@ def find_screenshots_by_date(screenshots_dir: str, start_date: datetime, end_dat
     if not screenshots_dir.exists() or not screenshots_dir.is_dir():
         raise FileNotFoundError(f"Directory '{screenshots_dir}' does not exist or is not a directory.")
 
+    # Directories below the screenshot root are answered from the index without touching the disk
+    folder = screenshot_index.relative_path(screenshots_dir)
+    if not folder.startswith('..'):
+        start = datetime.combine(start_date.date(), datetime.min.time()).timestamp()
+        end = datetime.combine(end_date.date() + timedelta(days=1), datetime.min.time()).timestamp()
+        prefix = '' if folder == '.' else folder
+        for path in screenshot_index.search(start, end, folder_prefix=prefix or None):
+            if domain and domain not in path:
+                continue
+            if device_type and device_type not in path:
+                continue
+            screenshots.append(os.path.relpath(path, prefix) if prefix else path)
+        return screenshots
+
     for file_path in screenshots_dir.rglob('*'):  # Recursively search the directory
         if file_path.is_file():
             try:
@@ -35,3 +52,27 @@ def find_screenshots_by_date(screenshots_dir: str, start_date: datetime, end_dat
             except OSError as e:
                 print(f"Cannot read file '{file_path}'. Error: {e}")
     return screenshots
+
+
+def search_screenshot_index(start_date: datetime = None, end_date: datetime = None, domain: str = None,
+                            device_type: str = None, domain_match: str = 'exact', sort: str = 'captured_at',
+                            order: str = 'desc', limit: int = 50, cursor: str = None) -> Tuple[List[dict], str]:
+    """
+    Finds screenshots captured between the two dates (inclusive) using the screenshot index.
+
+    :param start_date: Optional start date of the range for which to find screenshots.
+    :param end_date: Optional end date of the range for which to find screenshots.
+    :param domain: Optional domain to filter screenshots ('www.' and the port separator are normalized).
+    :param device_type: Optional device type to filter screenshots (e.g., 'desktop' or 'mobile').
+    :param domain_match: 'exact' or 'prefix' matching of the domain.
+    :param sort: Column to sort by ('captured_at', 'size', 'domain' or 'filename').
+    :param order: 'asc' or 'desc'.
+    :param limit: Maximum number of results per page.
+    :param cursor: Cursor returned with the previous page.
+    :return: Tuple of the matching screenshot rows and the cursor of the next page (None on the last page).
+    """
+    start = datetime.combine(start_date.date(), datetime.min.time()).timestamp() if start_date else None
+    end = datetime.combine(end_date.date() + timedelta(days=1), datetime.min.time()).timestamp() if end_date else None
+    return screenshot_index.query(start, end, domain=domain, domain_match=domain_match,
+                                  device=device_type.lower() if device_type else None, sort=sort, order=order,
+                                  limit=limit, cursor=cursor)
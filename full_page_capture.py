@@ -0,0 +1,141 @@
+import base64
+import io
+import logging
+import os
+import struct
+import zlib
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow pages taller than one capture are cut at CDP_MAX_SINGLE_HEIGHT
+    Image = None
+
+# Pages up to this height (CSS pixels) are captured with a single Page.captureScreenshot call,
+# taller ones in tiles of CDP_TILE_HEIGHT that are stitched into the PNG row by row
+CDP_MAX_SINGLE_HEIGHT = int(os.environ.get('CDP_MAX_SINGLE_HEIGHT', 16384))
+CDP_TILE_HEIGHT = int(os.environ.get('CDP_TILE_HEIGHT', 4096))
+# Endless pages are cut here
+MAX_PAGE_HEIGHT = int(os.environ.get('MAX_PAGE_HEIGHT', 60000))
+PNG_IDAT_SIZE = 1024 * 1024
+
+# Lazy images and iframes below the fold are never scrolled into view, load them right away
+EAGER_LOADING_SCRIPT = """
+document.querySelectorAll('img[loading="lazy"], iframe[loading="lazy"]').forEach(e => e.loading = 'eager');
+"""
+
+
+def _chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+class StreamingPNGWriter:
+    """
+    Writes an RGB PNG row by row, so a stitched page never has to be held in memory at once.
+    """
+
+    def __init__(self, path, width, height):
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self._file = open(path, 'wb')
+        self._compressor = zlib.compressobj(6)
+        self._pending = []
+        self._pending_size = 0
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        self._file.write(_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+
+    def write_rows(self, data):
+        """Appends raw RGB rows (width * 3 bytes each)."""
+        stride = self.width * 3
+        for offset in range(0, len(data), stride):
+            if self.rows >= self.height:
+                return
+            compressed = self._compressor.compress(b'\x00' + data[offset:offset + stride])
+            self.rows += 1
+            if compressed:
+                self._pending.append(compressed)
+                self._pending_size += len(compressed)
+            if self._pending_size >= PNG_IDAT_SIZE:
+                self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._file.write(_chunk(b'IDAT', b''.join(self._pending)))
+            self._pending = []
+            self._pending_size = 0
+
+    def close(self):
+        if self.rows < self.height:
+            # Pad a page that shrank while it was captured
+            self.write_rows(b'\xff' * self.width * 3 * (self.height - self.rows))
+        self._pending.append(self._compressor.flush())
+        self._flush()
+        self._file.write(_chunk(b'IEND', b''))
+        self._file.close()
+
+
+def get_page_size(driver, is_mobile=False):
+    """Returns the (width, height) to capture in CSS pixels."""
+    metrics = driver.execute_cdp_cmd('Page.getLayoutMetrics', {})
+    content = metrics.get('cssContentSize') or metrics['contentSize']
+    viewport = metrics.get('cssLayoutViewport') or metrics['layoutViewport']
+    # Mobile pages are captured at the device width, desktop pages including horizontal overflow
+    width = viewport['clientWidth'] if is_mobile else max(viewport['clientWidth'], content['width'])
+    height = max(viewport['clientHeight'], content['height'])
+    return int(width), int(min(height, MAX_PAGE_HEIGHT))
+
+
+def capture_clip(driver, x, y, width, height):
+    """Returns the PNG bytes of a page region, rendered beyond the viewport without resizing it."""
+    result = driver.execute_cdp_cmd('Page.captureScreenshot', {
+        'format': 'png',
+        'captureBeyondViewport': True,
+        'fromSurface': True,
+        'clip': {'x': x, 'y': y, 'width': width, 'height': height, 'scale': 1},
+    })
+    return base64.b64decode(result['data'])
+
+
+def load_lazy_content(driver):
+    driver.execute_script(EAGER_LOADING_SCRIPT)
+
+
+def capture_full_page(driver, filename, is_mobile=False):
+    """
+    Saves a full-page screenshot through the DevTools protocol and returns its (width, height).
+
+    Short pages take one capture; taller ones are captured in tiles and streamed into the
+    PNG, so memory stays bounded by one tile. Raises ValueError when a tile comes back
+    narrower than the first one.
+    """
+    width, height = get_page_size(driver, is_mobile)
+
+    if height <= CDP_MAX_SINGLE_HEIGHT or Image is None:
+        if height > CDP_MAX_SINGLE_HEIGHT:
+            logging.warning(f"Pillow is not installed, cutting {filename} at {CDP_MAX_SINGLE_HEIGHT}px")
+            height = CDP_MAX_SINGLE_HEIGHT
+        with open(filename, 'wb') as f:
+            f.write(capture_clip(driver, 0, 0, width, height))
+        return width, height
+
+    writer = None
+    try:
+        for y in range(0, height, CDP_TILE_HEIGHT):
+            tile_height = min(CDP_TILE_HEIGHT, height - y)
+            with Image.open(io.BytesIO(capture_clip(driver, 0, y, width, tile_height))) as tile:
+                tile = tile.convert('RGB')
+                if writer is None:
+                    # Device pixels per CSS pixel, the same for every tile
+                    scale = tile.height / tile_height
+                    writer = StreamingPNGWriter(filename, tile.width, int(round(height * scale)))
+                if tile.width < writer.width:
+                    # Cropping would pad the tile with black; the caller falls back to resizing
+                    raise ValueError(f"Tile at {y}px is {tile.width}px wide, expected {writer.width}px")
+                if tile.width > writer.width:
+                    tile = tile.crop((0, 0, writer.width, tile.height))
+                writer.write_rows(tile.tobytes())
+        logging.info(f"Stitched {filename} from {-(-height // CDP_TILE_HEIGHT)} tiles")
+    finally:
+        if writer is not None:
+            writer.close()
+    return width, height
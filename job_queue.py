@@ -0,0 +1,202 @@
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+# Number of screenshot jobs processed at the same time
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# How many finished jobs are kept for the status endpoint
+MAX_FINISHED_JOBS = int(os.environ.get('MAX_FINISHED_JOBS', 200))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when it has been cancelled."""
+
+
+class Job:
+    """A single background screenshot job and its progress."""
+
+    def __init__(self, kind, params, func, user=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.func = func
+        self.user = user
+        self.status = QUEUED
+        self.completed = 0
+        self.failed = 0
+        self.total = 0
+        self.message = ''
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.queue = None
+        # Capture workers of one job report pages concurrently
+        self._counter_lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check_cancelled(self):
+        """Stops the job at a safe point if cancellation was requested."""
+        if self.cancelled:
+            raise JobCancelled()
+
+    def add_total(self, count):
+        with self._counter_lock:
+            self.total += count
+        self._notify('job_progress')
+
+    def page_done(self, link, path=None):
+        with self._counter_lock:
+            self.completed += 1
+            self.message = f"Captured {link}"
+        self._notify('job_progress', link=link, path=path)
+
+    def page_failed(self, link, error):
+        with self._counter_lock:
+            self.failed += 1
+            self.message = f"Failed {link}: {error}"
+        self._notify('job_progress', link=link, error=str(error))
+
+    def _notify(self, event, **extra):
+        if self.queue:
+            self.queue.emit(event, self, **extra)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'params': self.params,
+            'user': self.user,
+            'status': self.status,
+            'completed': self.completed,
+            'failed': self.failed,
+            'total': self.total,
+            'message': self.message,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    In-process job queue with a pool of background workers.
+
+    Job state changes are pushed over Socket.IO to the room named after the job id, so
+    clients that emitted 'subscribe_job' receive 'job_progress', 'job_completed',
+    'job_failed' and 'job_cancelled' events.
+    """
+
+    def __init__(self, socketio=None, workers=JOB_WORKERS):
+        self.socketio = socketio
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.workers):
+            if self.socketio:
+                self.socketio.start_background_task(self._worker)
+            else:
+                threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, kind, params, func, user=None):
+        """Queues `func(job)` for background execution and returns the new job."""
+        job = Job(kind, params, func, user=user)
+        job.queue = self
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._queue.put(job)
+        self.start()
+        self.emit('job_queued', job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def cancel(self, job_id):
+        """Requests cancellation. Queued jobs never start, running jobs stop after the current page."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                return job
+            job.cancel_event.set()
+            # Taken under the lock, so a worker cannot start the job at the same time
+            dequeued = job.status == QUEUED
+            if dequeued:
+                job.status = CANCELLED
+        if dequeued:
+            self._finish(job, CANCELLED)
+        return job
+
+    def emit(self, event, job, **extra):
+        if not self.socketio:
+            return
+        payload = job.to_dict()
+        payload.update(extra)
+        try:
+            self.socketio.emit(event, payload, to=job.id)
+        except Exception as e:
+            logging.error(f"Cannot emit {event} for job {job.id}: {e}")
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        self.emit(f"job_{status}", job)
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.status in FINISHED_STATES]
+        finished.sort(key=lambda job: job.finished_at or 0)
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                # Cancelled while it waited in the queue
+                if job.status != QUEUED:
+                    continue
+                job.status = RUNNING
+            job.started_at = time.time()
+            self.emit('job_started', job)
+            try:
+                job.result = job.func(job)
+                job.check_cancelled()
+            except JobCancelled:
+                self._finish(job, CANCELLED)
+            except Exception as e:
+                logging.error(f"Job {job.id} ({job.kind}) failed: {e}")
+                self._finish(job, FAILED, error=str(e))
+            else:
+                self._finish(job, COMPLETED)
@@ -0,0 +1,139 @@
+import fnmatch
+import hashlib
+import re
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse, urlunparse
+
+# Collects every link of the page in a single WebDriver round-trip:
+# [resolved href, is the link inside <nav>/<header>]
+LINK_EXTRACTION_SCRIPT = """
+return Array.from(document.querySelectorAll('a[href]'), a => [a.href, !!a.closest('nav, header')]);
+"""
+
+# Query parameters that only track the visitor and never change the page
+TRACKING_PARAMS = ('utm_*', 'gclid', 'fbclid', 'msclkid', 'yclid', 'dclid', 'mc_cid', 'mc_eid', '_ga', '_gl',
+                   'igshid')
+
+# Default filters, overridden by the 'link_rules' domain setting. A rule skips a link when it matches:
+#   {"skip": "scheme", "value": [...]}      URL scheme, e.g. mailto
+#   {"skip": "contains", "value": "..."}    substring of the URL (case-insensitive)
+#   {"skip": "extension", "value": [...]}   file extension of the path
+#   {"skip": "regex", "value": "..."}       regular expression searched in the URL
+#   {"skip": "external"}                    other sites than the crawled one
+DEFAULT_LINK_RULES = [
+    {'skip': 'scheme', 'value': ['mailto', 'javascript', 'tel', 'data']},
+    {'skip': 'contains', 'value': 'poczta'},
+    {'skip': 'extension', 'value': ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg', '.pdf', '.zip']},
+    {'skip': 'external'},
+]
+
+
+def site_of(netloc):
+    """Treats 'www.example.com', 'example.com' and 'example.com:443' as the same site."""
+    host = netloc.lower().rsplit('@', 1)[-1].split(':', 1)[0]
+    return host[4:] if host.startswith('www.') else host
+
+
+def page_key(url):
+    """Identifies a normalized URL regardless of the 'www.' prefix, for deduplication."""
+    parsed = urlparse(url)
+    return urlunparse((parsed.scheme, site_of(parsed.netloc), parsed.path, '', parsed.query, ''))
+
+
+def url_file_key(url):
+    """Returns a stable file name stem for a page: a short hash of its normalized URL."""
+    return hashlib.sha1(page_key(normalize_url(url) or url).encode('utf-8')).hexdigest()[:16]
+
+
+def is_tracking_param(name, tracking_params=TRACKING_PARAMS):
+    return any(fnmatch.fnmatchcase(name.lower(), pattern) for pattern in tracking_params)
+
+
+def normalize_url(url, base_url=None, tracking_params=TRACKING_PARAMS, ignore_query=False):
+    """
+    Returns the canonical form of a link, or None for links that are not web pages.
+
+    Relative links are resolved against `base_url`. The scheme and host are lowercased,
+    default ports and the fragment are dropped, tracking parameters are removed, the
+    remaining parameters are sorted and a trailing slash is removed from non-root paths.
+    """
+    if base_url:
+        url = urljoin(base_url, url.strip())
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    if scheme not in ('http', 'https'):
+        return None
+    netloc = parsed.netloc.lower()
+    if (scheme == 'http' and netloc.endswith(':80')) or (scheme == 'https' and netloc.endswith(':443')):
+        netloc = netloc.rsplit(':', 1)[0]
+    path = re.sub(r'/{2,}', '/', parsed.path) or '/'
+    if len(path) > 1:
+        path = path.rstrip('/')
+    query = ''
+    if not ignore_query:
+        params = [(name, value) for name, value in parse_qsl(parsed.query, keep_blank_values=True)
+                  if not is_tracking_param(name, tracking_params)]
+        query = urlencode(sorted(params))
+    return urlunparse((scheme, netloc, path, '', query, ''))
+
+
+def rule_matches(rule, url, base_url=None):
+    kind = rule.get('skip')
+    value = rule.get('value')
+    values = [value] if isinstance(value, str) else (value or [])
+    parsed = urlparse(url)
+    if kind == 'scheme':
+        return parsed.scheme.lower() in values
+    if kind == 'contains':
+        return any(v.lower() in url.lower() for v in values)
+    if kind == 'extension':
+        return parsed.path.lower().endswith(tuple(v.lower() for v in values))
+    if kind == 'regex':
+        return any(re.search(v, url) for v in values)
+    if kind == 'external':
+        return bool(base_url) and bool(parsed.netloc) and site_of(parsed.netloc) != site_of(urlparse(base_url).netloc)
+    raise ValueError(f"Unknown link rule: {rule}")
+
+
+def filter_links(raw_links, base_url=None, rules=None, priority=None, tracking_params=TRACKING_PARAMS,
+                 ignore_query=False, rank=True):
+    """
+    Applies the rules to raw (href, in_nav) pairs and returns unique normalized URLs, ranked.
+
+    Links matching a `priority` pattern come first (in pattern order), then links from the
+    page's navigation, then the rest by path depth; ties keep the document order. With
+    `rank=False` the input order is kept. The page itself is never returned. Also returns
+    {rule index: number of skipped links}.
+    """
+    rules = DEFAULT_LINK_RULES if rules is None else rules
+    priority = priority or []
+    base_url_normalized = normalize_url(base_url, tracking_params=tracking_params, ignore_query=ignore_query) \
+        if base_url else None
+    base_key = page_key(base_url_normalized) if base_url_normalized else None
+    seen = {}
+    skipped = {}
+    for position, (href, in_nav) in enumerate(raw_links):
+        if not href:
+            continue
+        skip = next((index for index, rule in enumerate(rules) if rule_matches(rule, href, base_url)), None)
+        if skip is not None:
+            skipped[skip] = skipped.get(skip, 0) + 1
+            continue
+        url = normalize_url(href, base_url, tracking_params=tracking_params, ignore_query=ignore_query)
+        if url is None:
+            continue
+        key = page_key(url)
+        if key == base_key:
+            continue
+        if key in seen:
+            seen[key]['in_nav'] = seen[key]['in_nav'] or in_nav
+            continue
+        seen[key] = {'url': url, 'position': position, 'in_nav': in_nav}
+
+    def rank_key(link):
+        url = link['url']
+        boost = next((index for index, pattern in enumerate(priority) if re.search(pattern, url)), len(priority))
+        depth = len([part for part in urlparse(url).path.split('/') if part])
+        return boost, not link['in_nav'], depth, link['position']
+
+    links = sorted(seen.values(), key=rank_key) if rank else list(seen.values())
+    return [link['url'] for link in links], skipped
@@ -0,0 +1,223 @@
+import gzip
+import logging
+import os
+import urllib.request
+import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+from urllib.robotparser import RobotFileParser
+
+from domain_config import get_domain_settings
+from link_rules import DEFAULT_LINK_RULES, TRACKING_PARAMS, filter_links, normalize_url, page_key, site_of
+from rate_limiter import get_host_limiter
+
+# Link sources (the 'link_source' domain setting):
+#   'page'     anchors of the rendered main page (needs the browser, the default)
+#   'sitemap'  URLs from the sitemaps listed in robots.txt or /sitemap.xml
+#   'bfs'      breadth-first crawl over plain HTTP, up to 'crawl_depth' levels
+#   'auto'     the sitemap when there is one, otherwise the BFS crawl
+LINK_SOURCES = ('page', 'sitemap', 'bfs', 'auto')
+FETCH_TIMEOUT = int(os.environ.get('LINK_FETCH_TIMEOUT', 10))
+MAX_FETCH_BYTES = 10 * 1024 * 1024
+MAX_SITEMAPS = 20
+USER_AGENT = 'SnapShot'
+SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+
+def fetch(url, timeout=FETCH_TIMEOUT):
+    """Downloads a URL over plain HTTP and returns (body, content type); gzip is decoded."""
+    request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        body = response.read(MAX_FETCH_BYTES)
+        content_type = response.headers.get('Content-Type', '')
+        if response.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+    if body[:2] == b'\x1f\x8b':  # .xml.gz sitemaps
+        body = gzip.decompress(body)
+    return body, content_type
+
+
+class AnchorParser(HTMLParser):
+    """Collects (href, in_nav) pairs like link_rules.LINK_EXTRACTION_SCRIPT does in the browser."""
+
+    def __init__(self):
+        super().__init__()
+        self.links = []
+        self.base_href = None
+        self._nav_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('nav', 'header'):
+            self._nav_depth += 1
+        elif tag == 'base' and self.base_href is None:
+            self.base_href = dict(attrs).get('href')
+        elif tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                self.links.append((href, self._nav_depth > 0))
+
+    def handle_endtag(self, tag):
+        if tag in ('nav', 'header') and self._nav_depth:
+            self._nav_depth -= 1
+
+
+def page_anchors(url):
+    """Returns the (absolute href, in_nav) pairs of a page fetched without a browser."""
+    body, content_type = fetch(url)
+    if 'html' not in content_type.lower():
+        return []
+    parser = AnchorParser()
+    parser.feed(body.decode('utf-8', 'replace'))
+    base = urljoin(url, parser.base_href) if parser.base_href else url
+    return [(urljoin(base, href.strip()), in_nav) for href, in_nav in parser.links]
+
+
+class LinkSource:
+    """Discovers the pages of a site to capture, without loading them in the browser."""
+
+    def __init__(self, base_url, settings=None):
+        self.base_url = base_url
+        self.domain = urlparse(base_url).netloc
+        self.settings = settings or get_domain_settings(self.domain)
+        self.rules = self.settings.get('link_rules')
+        if self.rules is None:
+            self.rules = DEFAULT_LINK_RULES
+        self.priority = self.settings.get('link_priority')
+        self.tracking_params = self.settings.get('tracking_params', TRACKING_PARAMS)
+        self.ignore_query = self.settings.get('ignore_query', False)
+        # Discovery requests count against the same politeness limits as page captures
+        self.limiter = get_host_limiter(self.domain.replace('www.', '').replace(':', '_'))
+        self.robots = None
+        if self.settings.get('respect_robots', True):
+            self.robots = self._load_robots()
+
+    def _load_robots(self):
+        robots = RobotFileParser(urljoin(self.base_url, '/robots.txt'))
+        try:
+            body, _ = fetch(robots.url)
+            robots.parse(body.decode('utf-8', 'replace').splitlines())
+        except Exception as e:
+            logging.info(f"No robots.txt for {self.domain}: {e}")
+            return None
+        return robots
+
+    def allowed(self, url):
+        return self.robots is None or self.robots.can_fetch(USER_AGENT, url)
+
+    def on_site(self, url):
+        """Whether `url` is an http(s) URL of this site; discovery never fetches other hosts."""
+        parsed = urlparse(url)
+        return parsed.scheme in ('http', 'https') and site_of(parsed.netloc) == site_of(self.domain)
+
+    def _filter(self, raw_links, rank=True):
+        links, skipped = filter_links(raw_links, self.base_url, rules=self.rules, priority=self.priority,
+                                      tracking_params=self.tracking_params, ignore_query=self.ignore_query,
+                                      rank=rank)
+        return [link for link in links if self.allowed(link)]
+
+    def sitemap_links(self, max_links):
+        """
+        Returns the pages listed in the site's sitemaps, highest <priority> first and the most
+        recently modified first among equal priorities, or None when the site has no sitemap.
+        """
+        queue = list(self.robots.site_maps() or []) if self.robots else []
+        if not queue:
+            queue = [urljoin(self.base_url, '/sitemap.xml')]
+        entries = []
+        fetched = 0
+        while queue and fetched < MAX_SITEMAPS:
+            sitemap_url = queue.pop(0)
+            # robots.txt and sitemap indexes may point anywhere, including internal hosts
+            if not self.on_site(sitemap_url):
+                logging.info(f"Skipping sitemap {sitemap_url}, it is not on {self.domain}")
+                continue
+            fetched += 1
+            try:
+                with self.limiter.slot():
+                    body, _ = fetch(sitemap_url)
+                root = ET.fromstring(body)
+            except Exception as e:
+                logging.info(f"Cannot read sitemap {sitemap_url}: {e}")
+                continue
+            if root.tag == f"{SITEMAP_NS}sitemapindex":
+                queue.extend(loc.text.strip() for loc in root.iter(f"{SITEMAP_NS}loc") if loc.text)
+                continue
+            for url in root.iter(f"{SITEMAP_NS}url"):
+                loc = url.findtext(f"{SITEMAP_NS}loc")
+                if not loc:
+                    continue
+                try:
+                    priority = float(url.findtext(f"{SITEMAP_NS}priority") or 0.5)
+                except ValueError:
+                    priority = 0.5
+                lastmod = (url.findtext(f"{SITEMAP_NS}lastmod") or '').strip()
+                entries.append((loc.strip(), priority, lastmod))
+        if not entries:
+            return None
+
+        # Stable sort: equal entries keep the sitemap order
+        entries.sort(key=lambda entry: (entry[1], entry[2]), reverse=True)
+        links = self._filter([(loc, False) for loc, priority, lastmod in entries], rank=False)
+        logging.info(f"Sitemap of {self.domain} lists {len(entries)} URLs, {len(links)} usable")
+        return links[:max_links]
+
+    def bfs_links(self, max_links, depth=None):
+        """
+        Crawls the site breadth-first over plain HTTP, at most `depth` levels below the main
+        page. Pages are deduplicated across levels and each level is ranked like the browser
+        links. Pages that only render their links with JavaScript yield nothing here.
+        """
+        depth = depth or self.settings.get('crawl_depth', 2)
+        seen = {page_key(normalize_url(self.base_url))}
+        links = []
+        level = [self.base_url]
+        for _ in range(depth):
+            next_level = []
+            for page in level:
+                if len(links) + len(next_level) >= max_links:
+                    break
+                try:
+                    with self.limiter.slot():
+                        raw_links = page_anchors(page)
+                except Exception as e:
+                    logging.info(f"Cannot fetch {page} for link discovery: {e}")
+                    continue
+                for link in self._filter(raw_links):
+                    key = page_key(link)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    next_level.append(link)
+            links.extend(next_level)
+            if len(links) >= max_links or not next_level:
+                break
+            level = next_level
+        return links[:max_links]
+
+    def links(self, source, max_links):
+        """Returns the links from the given source, or None when the browser has to find them."""
+        if source == 'sitemap':
+            return self.sitemap_links(max_links) or []
+        if source == 'bfs':
+            return self.bfs_links(max_links)
+        if source == 'auto':
+            links = self.sitemap_links(max_links)
+            return links if links else self.bfs_links(max_links)
+        return None
+
+
+def discover_links(url, max_links):
+    """
+    Returns the pages to capture for `url` according to its 'link_source' setting, or None
+    for the 'page' source, where the links are read from the rendered main page instead.
+    """
+    settings = get_domain_settings(urlparse(url).netloc)
+    source = settings.get('link_source', 'page')
+    if source not in LINK_SOURCES:
+        logging.error(f"Unknown link source '{source}' for {url}, using 'page'")
+        source = 'page'
+    if source == 'page':
+        return None
+    links = LinkSource(url, settings).links(source, max_links)
+    logging.info(f"Link source '{source}' found {len(links)} links for {url}")
+    return links
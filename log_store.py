@@ -0,0 +1,223 @@
+import logging
+import os
+import re
+import threading
+from collections import deque
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+MAX_LOG_BYTES = int(os.environ.get('MAX_LOG_BYTES', 5 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 3))
+TAIL_BLOCK_SIZE = 8192
+MAX_READ_BYTES = 256 * 1024
+LEVEL_PATTERN = re.compile(r' - (DEBUG|INFO|WARNING|ERROR|CRITICAL) - ')
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+
+
+def read_tail(path, max_lines):
+    """Returns up to `max_lines` last lines of a file, reading it backwards block by block."""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        while position > 0 and data.count(b'\n') <= max_lines:
+            read_size = min(TAIL_BLOCK_SIZE, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    lines = data.decode('utf-8', 'replace').splitlines()
+    return lines[-max_lines:]
+
+
+def read_from(path, offset=0, max_bytes=MAX_READ_BYTES):
+    """
+    Reads the complete lines written after byte `offset`.
+
+    Returns (lines, new_offset); a partially written last line is left for the next read.
+    """
+    if not os.path.exists(path):
+        return [], 0
+    size = os.path.getsize(path)
+    if offset > size:
+        offset = 0  # The file was truncated or rotated, start over
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(max_bytes)
+    end = data.rfind(b'\n') + 1
+    return data[:end].decode('utf-8', 'replace').splitlines(), offset + end
+
+
+def line_level(line):
+    """Returns the level name of a formatted log line, or None."""
+    match = LEVEL_PATTERN.search(line)
+    return match.group(1) if match else None
+
+
+def line_matches(line, level=None, domain=None):
+    """Checks a log line against a minimum level and a domain substring."""
+    if level:
+        line_level_name = line_level(line)
+        if line_level_name is None or LEVELS.index(line_level_name) < LEVELS.index(level):
+            return False
+    if domain and domain not in line:
+        return False
+    return True
+
+
+class LogStore:
+    """
+    Append-only application log with an in-memory ring buffer of the newest lines.
+
+    Writes append a single line to the log file under a lock, the file is rotated once it
+    grows beyond `max_bytes`, and reads are served from the buffer without touching the disk.
+    Every line gets an increasing sequence number, which clients use as a resume offset.
+    """
+
+    def __init__(self, path, max_lines=1000, max_bytes=MAX_LOG_BYTES, backup_count=LOG_BACKUP_COUNT):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._lock = threading.RLock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tail = read_tail(path, max_lines)
+        self._buffer = deque(enumerate(tail, start=1), maxlen=max_lines)
+        self._seq = len(tail)
+        self._file = None
+        self._listeners = []
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        return self._file
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, line):
+        """Adds a single log line and notifies the listeners."""
+        line = line.rstrip('\n')
+        with self._lock:
+            f = self._open()
+            f.write(line + '\n')
+            f.flush()
+            self._seq += 1
+            seq = self._seq
+            self._buffer.append((seq, line))
+            if f.tell() >= self.max_bytes:
+                self._rotate()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(seq, line)
+            except Exception:
+                pass
+
+    def add_listener(self, listener):
+        """Registers `listener(offset, line)` to be called for every new line."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def _rotate(self):
+        self._close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0 and os.path.exists(self.path):
+            os.replace(self.path, f"{self.path}.1")
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+    def recent(self, limit=None, newest_first=True):
+        """Returns the newest `limit` lines (all buffered lines when None)."""
+        with self._lock:
+            lines = [line for seq, line in self._buffer]
+        if limit is not None:
+            lines = lines[-limit:] if limit > 0 else []
+        if newest_first:
+            lines.reverse()
+        return lines
+
+    def since(self, offset=0):
+        """Returns the buffered (offset, line) pairs newer than `offset`, oldest first."""
+        with self._lock:
+            if offset > self._seq:
+                offset = 0  # Offset from before a restart
+            return [(seq, line) for seq, line in self._buffer if seq > offset]
+
+    @property
+    def offset(self):
+        with self._lock:
+            return self._seq
+
+    def count(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def trim(self, count):
+        """Drops the `count` oldest buffered lines and starts a new log file with the rest."""
+        with self._lock:
+            for _ in range(min(count, len(self._buffer))):
+                self._buffer.popleft()
+            self._rotate()
+            f = self._open()
+            f.writelines(line + '\n' for seq, line in self._buffer)
+            f.flush()
+
+    def handler(self, level=logging.INFO):
+        """Returns a logging handler that writes formatted records into this store."""
+        handler = LogStoreHandler(self)
+        handler.setLevel(level)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+        return handler
+
+    def install(self, level=logging.INFO):
+        """Routes the root logger into this store (replacing logging.basicConfig(filename=...))."""
+        root = logging.getLogger()
+        if not any(isinstance(h, LogStoreHandler) and h.store is self for h in root.handlers):
+            root.addHandler(self.handler(level))
+        root.setLevel(level)
+
+
+class LogStoreHandler(logging.Handler):
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+
+    def emit(self, record):
+        try:
+            self.store.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class CrawlLogHandler(logging.FileHandler):
+    """
+    Writes the records of a single crawl into its own log file.
+
+    Only records for which `accept()` returns True are written (the crawl decides how to
+    recognise its own records), and every written line is passed to `listener(path, offset,
+    line)` together with the byte offset right after it.
+    """
+
+    def __init__(self, path, accept, listener=None):
+        super().__init__(path, encoding='utf-8')
+        self.accept = accept
+        self.listener = listener
+        self.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+
+    def emit(self, record):
+        if not self.accept(record):
+            return
+        with self.lock:
+            super().emit(record)
+            offset = self.stream.tell() if self.stream else 0
+        if self.listener:
+            try:
+                self.listener(self.baseFilename, offset, self.format(record))
+            except Exception:
+                pass
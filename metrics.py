@@ -0,0 +1,250 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram buckets in seconds, from a quick body wait to a slow tiled capture
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    """A metric family with a fixed set of label names, rendered in the Prometheus text format."""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self.samples().items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Gauge(Metric):
+    """A value read when the metrics are rendered: `func()` returns {label values tuple: value}."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), func=None):
+        super().__init__(name, documentation, labels)
+        self.func = func
+
+    def render(self):
+        lines = self.header()
+        try:
+            values = self.func() if self.func else {}
+        except Exception:
+            values = {}
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        """Returns {label values: (non-cumulative bucket counts, sum, count)}."""
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+
+    def render(self):
+        lines = self.header()
+        for key, (counts, total, count) in sorted(self.samples().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+def quantile(buckets, counts, count, q):
+    """Estimates a quantile from bucket counts, interpolating linearly inside the bucket."""
+    if not count:
+        return None
+    rank = q * count
+    seen = 0
+    lower = 0.0
+    for bound, bucket_count in zip(buckets, counts):
+        if bucket_count and seen + bucket_count >= rank:
+            return lower + (bound - lower) * (rank - seen) / bucket_count
+        seen += bucket_count
+        lower = bound
+    # Above the largest bucket
+    return lower
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+# Callables notified of every timed stage as (stage, seconds, domain, device), e.g. by benchmark.py
+stage_listeners = []
+
+STAGE_SECONDS = registry.register(Histogram(
+    'snapshot_stage_seconds', 'Duration of capture pipeline stages.', ('stage', 'domain', 'device')))
+STAGE_FAILURES = registry.register(Counter(
+    'snapshot_stage_failures_total', 'Capture pipeline stages that raised, by kind (timeout or error).',
+    ('stage', 'domain', 'device', 'kind')))
+CRAWLS = registry.register(Counter(
+    'snapshot_crawls_total', 'Crawls of a domain in one device view, by final status.',
+    ('domain', 'device', 'status')))
+PAGES = registry.register(Counter(
+    'snapshot_pages_total', 'Pages handled, by result (captured, reused, failed, throttled).',
+    ('domain', 'device', 'result')))
+
+
+def is_timeout(error):
+    # selenium's TimeoutException, the builtin TimeoutError and socket timeouts
+    return isinstance(error, TimeoutError) or 'Timeout' in type(error).__name__
+
+
+@contextmanager
+def timed(stage, domain='', device=''):
+    """Records how long the block took under `stage`, and whether it failed or timed out."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        if isinstance(e, Exception):
+            STAGE_FAILURES.inc(stage=stage, domain=domain, device=device,
+                               kind='timeout' if is_timeout(e) else 'error')
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start, domain, device)
+
+
+def observe(stage, seconds, domain='', device=''):
+    STAGE_SECONDS.observe(seconds, stage=stage, domain=domain, device=device)
+    for listener in stage_listeners:
+        listener(stage, seconds, domain, device)
+
+
+def count_page(domain, device, result):
+    PAGES.inc(domain=domain, device=device, result=result)
+
+
+def count_crawl(domain, device, status):
+    CRAWLS.inc(domain=domain, device=device, status=status)
+
+
+def _merge(groups):
+    """Sums histogram samples grouped by a key into {key: (counts, sum, count)}."""
+    merged = {}
+    for key, (counts, total, count) in groups:
+        entry = merged.setdefault(key, [[0] * len(STAGE_BUCKETS), 0.0, 0])
+        entry[0] = [a + b for a, b in zip(entry[0], counts)]
+        entry[1] += total
+        entry[2] += count
+    return merged
+
+
+def _describe(counts, total, count):
+    return {
+        'count': count,
+        'avg': round(total / count, 3) if count else None,
+        'p50': round(quantile(STAGE_BUCKETS, counts, count, 0.5), 3) if count else None,
+        'p95': round(quantile(STAGE_BUCKETS, counts, count, 0.95), 3) if count else None,
+        'total': round(total, 3),
+    }
+
+
+def summary():
+    """
+    Aggregates for the dashboard: every stage over all sites, and per domain and device the
+    page time, page results and failures, slowest sites first.
+    """
+    samples = STAGE_SECONDS.samples()
+    stages = _merge((key[0], value) for key, value in samples.items())
+    sites = _merge(((key[1], key[2]), value) for key, value in samples.items() if key[0] == 'page')
+
+    failures = {}
+    stage_failures = {}
+    for (stage, domain, device, kind), value in STAGE_FAILURES.samples().items():
+        site = failures.setdefault((domain, device), {'timeout': 0, 'error': 0})
+        site[kind] = site.get(kind, 0) + value
+        stage_failures[stage] = stage_failures.get(stage, 0) + value
+    results = {}
+    for (domain, device, result), value in PAGES.samples().items():
+        results.setdefault((domain, device), {})[result] = value
+
+    site_rows = []
+    for (domain, device), entry in sites.items():
+        row = {'domain': domain, 'device': device}
+        row.update(_describe(*entry))
+        row['pages'] = results.get((domain, device), {})
+        row['failures'] = failures.get((domain, device), {'timeout': 0, 'error': 0})
+        site_rows.append(row)
+    site_rows.sort(key=lambda row: row['p95'] if row['p95'] is not None else 0, reverse=True)
+
+    stage_rows = [dict(stage=stage, failures=stage_failures.get(stage, 0), **_describe(*entry))
+                  for stage, entry in stages.items()]
+    stage_rows.sort(key=lambda row: row['total'], reverse=True)
+    return {'stages': stage_rows, 'sites': site_rows}
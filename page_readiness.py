@@ -0,0 +1,69 @@
+import logging
+import time
+
+# How often the page state is polled and how long it has to stay unchanged
+READY_POLL_INTERVAL = 0.1
+NETWORK_IDLE_WINDOW = 0.5
+LAYOUT_STABLE_WINDOW = 0.5
+
+PAGE_STATE_SCRIPT = """
+var images = Array.prototype.slice.call(document.images || []);
+var root = document.documentElement;
+return {
+    readyState: document.readyState,
+    fontsLoaded: !document.fonts || document.fonts.status === 'loaded',
+    pendingImages: images.filter(function (img) { return img.loading !== 'lazy' && !img.complete; }).length,
+    resources: window.performance ? performance.getEntriesByType('resource').length : 0,
+    width: root ? root.scrollWidth : 0,
+    height: root ? root.scrollHeight : 0
+};
+"""
+
+
+def get_page_state(driver):
+    """Reads the readiness-related state of the current page in a single script call."""
+    return driver.execute_script(PAGE_STATE_SCRIPT) or {}
+
+
+def wait_for_page_ready(driver, timeout=15):
+    """
+    Waits until the current page is ready to be captured and returns the seconds waited.
+
+    A page is ready when document.readyState is 'complete', web fonts and eager images have
+    loaded, no new network resources appeared for NETWORK_IDLE_WINDOW seconds and the
+    document size stayed the same for LAYOUT_STABLE_WINDOW seconds. Gives up after `timeout`
+    seconds and lets the capture continue with whatever has rendered so far.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    last_resources = last_size = None
+    resources_since = size_since = start
+
+    while True:
+        now = time.monotonic()
+        try:
+            state = get_page_state(driver)
+        except Exception as e:
+            logging.warning(f"Cannot read page state: {e}")
+            state = {}
+
+        resources = state.get('resources')
+        if resources != last_resources:
+            last_resources, resources_since = resources, now
+
+        size = (state.get('width'), state.get('height'))
+        if size != last_size:
+            last_size, size_since = size, now
+
+        if (state.get('readyState') == 'complete'
+                and state.get('fontsLoaded')
+                and not state.get('pendingImages')
+                and now - resources_since >= NETWORK_IDLE_WINDOW
+                and now - size_since >= LAYOUT_STABLE_WINDOW):
+            return now - start
+
+        if now >= deadline:
+            logging.warning(f"Page not ready after {timeout}s (state: {state}), capturing anyway")
+            return now - start
+
+        time.sleep(READY_POLL_INTERVAL)
@@ -0,0 +1,135 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from domain_config import get_domain_settings
+
+# Defaults for the per-domain politeness settings (see domain_config.py)
+DEFAULT_RATE_LIMIT = float(os.environ.get('DEFAULT_RATE_LIMIT', 1.0))  # page loads per second
+DEFAULT_BURST = int(os.environ.get('DEFAULT_BURST', 2))
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get('MAX_CAPTURES_PER_DOMAIN', 2))
+BACKOFF_BASE = 5
+BACKOFF_MAX = 300
+# Responses that mean "slow down"; everything else resets the backoff
+THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+
+# Status of the last navigation; null when the browser does not expose it (Chrome < 109)
+NAVIGATION_STATUS_SCRIPT = """
+const entry = performance.getEntriesByType('navigation')[0];
+return entry && entry.responseStatus ? entry.responseStatus : null;
+"""
+
+
+class Throttled(Exception):
+    """Raised when a site answered a page load with a throttling or server error status."""
+
+    def __init__(self, url, status):
+        super().__init__(f"{url} returned HTTP {status}")
+        self.url = url
+        self.status = status
+
+
+def get_navigation_status(driver):
+    try:
+        return driver.execute_script(NAVIGATION_STATUS_SCRIPT)
+    except Exception:
+        return None
+
+
+class HostLimiter:
+    """
+    Politeness limits for one domain: a token bucket for page loads per second, a cap on
+    concurrent page loads and an exponential backoff after throttling responses.
+    """
+
+    def __init__(self, domain):
+        self.domain = domain
+        self._condition = threading.Condition()
+        self._active = 0
+        self._tokens = None
+        self._updated = time.monotonic()
+        self._blocked_until = 0
+        self._strikes = 0
+        self.configure()
+
+    def configure(self):
+        """(Re)reads the domain's settings, so config changes apply without a restart."""
+        settings = get_domain_settings(self.domain)
+        with self._condition:
+            self.rate = float(settings.get('rate_limit') or DEFAULT_RATE_LIMIT)
+            self.burst = max(1, int(settings.get('burst') or DEFAULT_BURST))
+            self.max_concurrency = max(1, int(settings.get('max_concurrency') or DEFAULT_MAX_CONCURRENCY))
+            self.backoff_base = float(settings.get('backoff_base') or BACKOFF_BASE)
+            self.backoff_max = float(settings.get('backoff_max') or BACKOFF_MAX)
+            if self._tokens is None:
+                self._tokens = float(self.burst)
+            self._condition.notify_all()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wait_time(self, now):
+        """Seconds until a page load may start, 0 when it may start now."""
+        if self._active >= self.max_concurrency:
+            return None  # Until a slot is released
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        self._refill(now)
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        return 0
+
+    @contextmanager
+    def slot(self):
+        """Waits for a free slot, a token and the end of any backoff, and holds the slot."""
+        with self._condition:
+            while True:
+                wait = self._wait_time(time.monotonic())
+                if wait == 0:
+                    break
+                self._condition.wait(wait)
+            self._tokens -= 1
+            self._active += 1
+        try:
+            yield self
+        finally:
+            with self._condition:
+                self._active -= 1
+                self._condition.notify_all()
+
+    def report(self, status):
+        """Feeds the HTTP status of a page load into the backoff."""
+        if status is None:
+            return
+        with self._condition:
+            if status in THROTTLE_STATUSES:
+                self._strikes += 1
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (self._strikes - 1))
+                self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+                logging.warning(f"{self.domain} answered HTTP {status}, pausing page loads for {delay:.1f}s")
+            elif self._strikes:
+                self._strikes = 0
+                self._condition.notify_all()
+
+    @property
+    def backoff_remaining(self):
+        with self._condition:
+            return max(0.0, self._blocked_until - time.monotonic())
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_host_limiter(domain):
+    """Returns the shared limiter of a domain, refreshing its settings from the domain config."""
+    with _limiters_lock:
+        limiter = _limiters.get(domain)
+        if limiter is None:
+            limiter = _limiters[domain] = HostLimiter(domain)
+            return limiter
+    limiter.configure()
+    return limiter
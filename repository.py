@@ -0,0 +1,245 @@
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 'json' keeps data.json / users.json as they are, 'sqlite' keeps both documents in one database
+REPOSITORY_BACKEND = os.environ.get('REPOSITORY_BACKEND', 'json')
+REPOSITORY_DB = os.environ.get('REPOSITORY_DB', 'snapshot.db')
+
+
+@contextmanager
+def file_lock(path):
+    """Holds an exclusive lock on `<path>.lock`, shared with other processes using the same file."""
+    lock_path = f"{path}.lock"
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    with open(lock_path, 'a+') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class JsonDocument:
+    """
+    A JSON file cached in memory.
+
+    Reads return a copy of the cached data and only touch the disk when the file's mtime or
+    size changed. Updates run read-modify-write under a file lock and replace the file
+    atomically, so concurrent writers (threads or processes) never lose each other's changes.
+    """
+
+    def __init__(self, path, default):
+        self.path = path
+        self.default = default
+        self._lock = threading.RLock()
+        self._stamp = None
+        self._data = None
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read(self):
+        stamp = self._file_stamp()
+        if stamp is None:
+            return copy.deepcopy(self.default)
+        if stamp != self._stamp:
+            with open(self.path, 'r') as f:
+                self._data = json.load(f)
+            self._stamp = stamp
+        return self._data
+
+    def load(self):
+        with self._lock:
+            return copy.deepcopy(self._read())
+
+    def _write(self, data):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._data = data
+        self._stamp = self._file_stamp()
+
+    def update(self, func):
+        """Applies `func(data)` to the current data and writes the result; returns what func returned."""
+        with self._lock, file_lock(self.path):
+            data = copy.deepcopy(self._read())
+            result = func(data)
+            self._write(data)
+            return result
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+
+class SqliteDocument:
+    """The JsonDocument interface on top of a row in a SQLite table, for multi-process deployments."""
+
+    def __init__(self, name, default, db_path=REPOSITORY_DB):
+        self.name = name
+        self.default = default
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = None
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS documents '
+                         '(name TEXT PRIMARY KEY, version INTEGER NOT NULL, data TEXT NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _read(self, conn):
+        row = conn.execute('SELECT version, data FROM documents WHERE name = ?', (self.name,)).fetchone()
+        if row is None:
+            return None, copy.deepcopy(self.default)
+        version, data = row
+        with self._lock:
+            if version != self._version:
+                self._data = json.loads(data)
+                self._version = version
+            return version, self._data
+
+    def load(self):
+        version, data = self._read(self._connect())
+        return copy.deepcopy(data)
+
+    def update(self, func):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version, data = self._read(conn)
+            data = copy.deepcopy(data)
+            result = func(data)
+            conn.execute('INSERT INTO documents (name, version, data) VALUES (?, 1, ?) '
+                         'ON CONFLICT(name) DO UPDATE SET version = version + 1, data = excluded.data',
+                         (self.name, json.dumps(data)))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return result
+
+    def exists(self):
+        row = self._connect().execute('SELECT 1 FROM documents WHERE name = ?', (self.name,)).fetchone()
+        return row is not None
+
+
+def open_document(name, path, default):
+    """Returns the document for the configured backend, importing the JSON file into SQLite once."""
+    if REPOSITORY_BACKEND != 'sqlite':
+        return JsonDocument(path, default)
+    document = SqliteDocument(name, default)
+    if not document.exists() and os.path.exists(path):
+        data = JsonDocument(path, default).load()
+        document.update(lambda current: current.update(data) if isinstance(data, dict) else None)
+        logging.info(f"Imported '{path}' into {REPOSITORY_DB}")
+    return document
+
+
+class DomainRepository:
+    """The list of domains to capture (data.json)."""
+
+    def __init__(self, path='data.json'):
+        self.document = open_document('domains', path, {'domains': []})
+
+    def list(self):
+        return self.document.load().get('domains', [])
+
+    def replace_all(self, domains):
+        def apply(data):
+            data['domains'] = list(dict.fromkeys(domains))
+        self.document.update(apply)
+
+    def add(self, domain):
+        """Adds a domain; returns False when it is already on the list."""
+        def apply(data):
+            domains = data.setdefault('domains', [])
+            if domain in domains:
+                return False
+            domains.append(domain)
+            return True
+        return self.document.update(apply)
+
+    def remove(self, domain):
+        """Removes a domain; returns False when it is not on the list."""
+        def apply(data):
+            domains = data.setdefault('domains', [])
+            if domain not in domains:
+                return False
+            domains.remove(domain)
+            return True
+        return self.document.update(apply)
+
+    def rename(self, old_domain, new_domain):
+        """Replaces a domain in place; returns False when it is not on the list."""
+        def apply(data):
+            domains = data.setdefault('domains', [])
+            if old_domain not in domains:
+                return False
+            domains[domains.index(old_domain)] = new_domain
+            data['domains'] = list(dict.fromkeys(domains))
+            return True
+        return self.document.update(apply)
+
+
+class UserRepository:
+    """Users and their password hashes and roles (users.json)."""
+
+    def __init__(self, path='users.json'):
+        self.document = open_document('users', path, {})
+
+    def exists(self):
+        return self.document.exists()
+
+    def all(self):
+        return self.document.load()
+
+    def get(self, username):
+        return self.all().get(username)
+
+    def add(self, username, user):
+        """Adds a user; returns False when the name is taken."""
+        def apply(users):
+            if username in users:
+                return False
+            users[username] = user
+            return True
+        return self.document.update(apply)
+
+    def replace_all(self, users):
+        def apply(data):
+            data.clear()
+            data.update(users)
+        self.document.update(apply)
@@ -0,0 +1,248 @@
+import fnmatch
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from selenium import webdriver
+
+from domain_config import get_domain_settings
+
+try:
+    from seleniumwire import webdriver as wire_webdriver
+except ImportError:  # Only needed for REQUEST_INTERCEPTION=wire
+    wire_webdriver = None
+
+# 'cdp' blocks requests through the DevTools protocol inside Chrome. 'wire' routes all traffic
+# through the selenium-wire proxy, which adds the asset cache and header-based resource types
+# but costs a Python MITM hop per request. 'off' disables request filtering.
+REQUEST_INTERCEPTION = os.environ.get('REQUEST_INTERCEPTION', 'cdp')
+ASSET_CACHE_MB = int(os.environ.get('ASSET_CACHE_MB', 64))
+MAX_CACHED_ASSET_BYTES = 2 * 1024 * 1024
+# Seconds an asset without max-age or Expires is reused, and the limit for every asset, so a
+# stylesheet or script changed at the same URL shows up in the next crawl
+ASSET_CACHE_TTL = int(os.environ.get('ASSET_CACHE_TTL', 600))
+ASSET_CACHE_MAX_TTL = int(os.environ.get('ASSET_CACHE_MAX_TTL', 3600))
+
+# Third-party hosts by category, selected per domain with 'block_categories'
+BLOCK_CATEGORIES = {
+    'analytics': ['*google-analytics.com*', '*googletagmanager.com*', '*hotjar.com*', '*clarity.ms*',
+                  '*mc.yandex.ru*', '*segment.io*', '*segment.com*', '*mixpanel.com*', '*connect.facebook.net*',
+                  '*facebook.com/tr*'],
+    'ads': ['*doubleclick.net*', '*googlesyndication.com*', '*googleadservices.com*', '*adservice.google.*',
+            '*amazon-adsystem.com*', '*criteo.com*', '*taboola.com*', '*outbrain.com*'],
+    'chat': ['*intercom.io*', '*intercomcdn.com*', '*tawk.to*', '*crisp.chat*', '*livechatinc.com*',
+             '*zopim.com*', '*zdassets.com*', '*smartsupp.com*', '*tidio.co*'],
+    # Not blocked by default: embedded players are part of what the page looks like
+    'video': ['*youtube.com/embed*', '*youtube-nocookie.com*', '*player.vimeo.com*', '*ytimg.com*'],
+}
+
+# Resource types for 'block_resource_types'. selenium-wire recognises them by the
+# Sec-Fetch-Dest header, the DevTools fallback only by file extension.
+RESOURCE_TYPES = {
+    'media': ('video', 'audio', 'track'),
+    'font': ('font',),
+    'image': ('image',),
+}
+RESOURCE_EXTENSIONS = {
+    'media': ('.mp4', '.webm', '.ogv', '.mov', '.m3u8', '.mp3', '.ogg', '.wav'),
+    'font': ('.woff', '.woff2', '.ttf', '.otf', '.eot'),
+    'image': ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.svg'),
+}
+# Same-site assets that may be served from the local cache
+CACHEABLE_DESTINATIONS = ('style', 'script', 'font', 'image')
+CACHEABLE_EXTENSIONS = ('.css', '.js', '.woff', '.woff2', '.ttf', '.otf', '.png', '.jpg', '.jpeg', '.gif', '.webp',
+                        '.svg', '.avif')
+
+
+def freshness_lifetime(headers):
+    """
+    Returns how many seconds a response may be reused: its max-age, or Expires minus Date,
+    less its Age; ASSET_CACHE_TTL without either, at most ASSET_CACHE_MAX_TTL, and 0 for
+    no-store, no-cache and private responses.
+    """
+    directives = {}
+    for directive in (headers.get('Cache-Control') or '').lower().split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name] = value.strip().strip('"')
+    if {'no-store', 'no-cache', 'private'} & directives.keys():
+        return 0
+    try:
+        if 'max-age' in directives:
+            lifetime = int(directives['max-age'])
+        elif headers.get('Expires'):
+            date = parsedate_to_datetime(headers['Date']).timestamp() if headers.get('Date') else time.time()
+            lifetime = parsedate_to_datetime(headers['Expires']).timestamp() - date
+        else:
+            lifetime = ASSET_CACHE_TTL
+        lifetime -= int(headers.get('Age') or 0)
+    except (TypeError, ValueError):  # An invalid Expires means the response is already stale
+        return 0
+    return max(0, min(lifetime, ASSET_CACHE_MAX_TTL))
+
+
+class AssetCache:
+    """
+    In-memory LRU cache of static responses, shared by all drivers and bounded by size.
+    Entries expire after the freshness lifetime of their response (see freshness_lifetime).
+    """
+
+    def __init__(self, max_bytes=ASSET_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None and entry[3] <= time.monotonic():
+                self._remove(url)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+            return entry[:3]
+
+    def put(self, url, status, headers, body, ttl):
+        if len(body) > MAX_CACHED_ASSET_BYTES or ttl <= 0:
+            return
+        with self._lock:
+            self._remove(url)
+            self._entries[url] = (status, headers, body, time.monotonic() + ttl)
+            self._size += len(body)
+            while self._size > self.max_bytes and self._entries:
+                _, (_, _, old_body, _) = self._entries.popitem(last=False)
+                self._size -= len(old_body)
+
+    def _remove(self, url):
+        entry = self._entries.pop(url, None)
+        if entry is not None:
+            self._size -= len(entry[2])
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._size, 'hits': self.hits, 'misses': self.misses}
+
+
+asset_cache = AssetCache()
+
+
+def interception_mode():
+    if REQUEST_INTERCEPTION == 'wire' and wire_webdriver is None:
+        logging.warning("REQUEST_INTERCEPTION=wire but selenium-wire is not installed, using the DevTools protocol")
+        return 'cdp'
+    return REQUEST_INTERCEPTION if REQUEST_INTERCEPTION in ('wire', 'off') else 'cdp'
+
+
+def create_driver(service, options):
+    """Starts Chrome behind the selenium-wire proxy when requests are intercepted with it."""
+    if interception_mode() == 'wire':
+        return wire_webdriver.Chrome(service=service, options=options, seleniumwire_options={
+            'request_storage': 'memory',
+            'request_storage_max_size': 100,
+            'suppress_connection_errors': True,
+        })
+    return webdriver.Chrome(service=service, options=options)
+
+
+def block_patterns(settings):
+    """Returns the wildcard URL patterns blocked for a domain."""
+    patterns = []
+    for category in settings.get('block_categories', []):
+        patterns.extend(BLOCK_CATEGORIES.get(category, []))
+    patterns.extend(settings.get('block_urls', []))
+    return patterns
+
+
+def same_site(url, site):
+    host = (urlparse(url).hostname or '').lower()
+    return host == site or host.endswith(f".{site}")
+
+
+def is_static_asset(url, destination=None):
+    if destination:
+        return destination in CACHEABLE_DESTINATIONS
+    return urlparse(url).path.lower().endswith(CACHEABLE_EXTENSIONS)
+
+
+class RequestFilter:
+    """Blocking and caching rules for the pages of one domain, applied to a driver per page load."""
+
+    def __init__(self, domain):
+        settings = get_domain_settings(domain)
+        self.site = domain.replace('www.', '').split(':')[0].lower()
+        self.patterns = block_patterns(settings)
+        self.resource_types = [t for t in settings.get('block_resource_types', []) if t in RESOURCE_TYPES]
+        self.cache_assets = settings.get('asset_cache', True)
+        self.blocked = 0
+
+    def should_block(self, url, destination=None):
+        if any(fnmatch.fnmatchcase(url, pattern) for pattern in self.patterns):
+            return True
+        for resource_type in self.resource_types:
+            if destination in RESOURCE_TYPES[resource_type]:
+                return True
+            if destination is None and urlparse(url).path.lower().endswith(RESOURCE_EXTENSIONS[resource_type]):
+                return True
+        return False
+
+    # selenium-wire hooks, called from the proxy threads
+    def intercept_request(self, request):
+        destination = request.headers.get('Sec-Fetch-Dest')
+        if self.should_block(request.url, destination):
+            self.blocked += 1
+            request.abort()
+            return
+        if self.cache_assets and request.method == 'GET' and same_site(request.url, self.site) \
+                and is_static_asset(request.url, destination):
+            cached = asset_cache.get(request.url)
+            if cached:
+                status, headers, body = cached
+                request.create_response(status_code=status, headers=headers, body=body)
+
+    def intercept_response(self, request, response):
+        if not self.cache_assets or request.method != 'GET' or response.status_code != 200:
+            return
+        if not same_site(request.url, self.site) or not is_static_asset(request.url,
+                                                                        request.headers.get('Sec-Fetch-Dest')):
+            return
+        ttl = freshness_lifetime(response.headers)
+        if not ttl:
+            return
+        headers = [(name, value) for name, value in response.headers.items() if name.lower() != 'set-cookie']
+        asset_cache.put(request.url, response.status_code, headers, response.body, ttl)
+
+    def cdp_patterns(self):
+        patterns = list(self.patterns)
+        for resource_type in self.resource_types:
+            patterns.extend(f"*{extension}" for extension in RESOURCE_EXTENSIONS[resource_type])
+        return patterns
+
+
+def apply_request_filter(driver, domain):
+    """Installs the domain's request filter on a pooled driver before it loads a page."""
+    mode = interception_mode()
+    if mode == 'off':
+        return None
+    request_filter = RequestFilter(domain)
+    try:
+        if mode == 'wire' and hasattr(driver, 'request_interceptor'):
+            driver.request_interceptor = request_filter.intercept_request
+            driver.response_interceptor = request_filter.intercept_response
+            # Finished requests are only kept for debugging; drop them between pages
+            del driver.requests
+        else:
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': request_filter.cdp_patterns()})
+    except Exception as e:
+        logging.warning(f"Cannot install request filter for {domain}: {e}")
+        return None
+    return request_filter
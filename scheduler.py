@@ -0,0 +1,199 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from change_cache import CAPTURE_CACHE_FOLDER, get_http_validators
+from domain_config import get_domain_settings
+from job_queue import FINISHED_STATES, COMPLETED
+
+# Recurring captures of the domains from data.json, see CaptureScheduler
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', '0') == '1'
+SCHEDULER_TICK = int(os.environ.get('SCHEDULER_TICK', 30))
+# Scheduled crawls running at once; each crawl keeps up to CAPTURE_WORKERS Chrome sessions busy
+SCHEDULER_MAX_ACTIVE = int(os.environ.get('SCHEDULER_MAX_ACTIVE', 2))
+# Minimum time between two scheduled starts, so a backlog is worked off steadily
+SCHEDULER_MIN_GAP = int(os.environ.get('SCHEDULER_MIN_GAP', 60))
+# Failed crawls are retried after RETRY_DELAY * 2^failures, but never later than the interval
+RETRY_DELAY = 300
+# How often the main page of a domain that is not due yet is checked for changes (HEAD request)
+CHANGE_CHECK_INTERVAL = int(os.environ.get('SCHEDULER_CHANGE_CHECK_INTERVAL', 900))
+SCHEDULE_FILE = os.path.join(CAPTURE_CACHE_FOLDER, 'schedule.json')
+
+
+def phase(key, interval):
+    """Returns a stable offset in [0, interval) for the key, spreading first runs over the interval."""
+    digest = hashlib.sha1(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big') % max(1, int(interval))
+
+
+def domain_url(domain):
+    return domain if domain.startswith(('http://', 'https://')) else f"https://{domain}"
+
+
+class CaptureScheduler:
+    """
+    Submits recurring crawls of every domain in every configured device view.
+
+    Per-domain settings (see domain_config.py): `capture_interval` in seconds (0 disables),
+    `capture_devices` and `capture_priority`. Due crawls are ordered by how overdue they
+    are, their priority and whether the main page reports new HTTP validators, and are
+    started one by one while fewer than `max_active` jobs are queued or running.
+    """
+
+    def __init__(self, job_queue, load_domains, submit, state_path=SCHEDULE_FILE, max_active=SCHEDULER_MAX_ACTIVE,
+                 min_gap=SCHEDULER_MIN_GAP):
+        self.job_queue = job_queue
+        self.load_domains = load_domains
+        self.submit = submit
+        self.state_path = state_path
+        self.max_active = max_active
+        self.min_gap = min_gap
+        self._lock = threading.Lock()
+        self._active = {}
+        self._last_start = 0
+        self._state = {}
+        if os.path.exists(state_path):
+            try:
+                with open(state_path, 'r') as f:
+                    self._state = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.error(f"Cannot read schedule '{state_path}': {e}")
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._state, f, indent=4)
+        os.replace(tmp_path, self.state_path)
+
+    def _entries(self, now):
+        """Yields (key, domain, device_type, settings, entry, due) for every scheduled capture."""
+        for domain in self.load_domains():
+            settings = get_domain_settings(domain)
+            interval = settings.get('capture_interval') or 0
+            if interval <= 0:
+                continue
+            for device_type in settings.get('capture_devices', ['desktop', 'mobile']):
+                key = f"{domain}|{device_type}"
+                entry = self._state.setdefault(key, {'created_at': now})
+                if entry.get('last_run') is None:
+                    due = entry['created_at'] + phase(key, min(interval, 3600))
+                elif entry.get('failures'):
+                    due = entry['last_run'] + min(interval, RETRY_DELAY * 2 ** (entry['failures'] - 1))
+                else:
+                    due = entry['last_run'] + interval
+                yield key, domain, device_type, settings, entry, due
+
+    def _collect_finished(self):
+        for key, job in list(self._active.items()):
+            if job.status not in FINISHED_STATES:
+                continue
+            entry = self._state.setdefault(key, {})
+            entry['last_run'] = job.finished_at or time.time()
+            entry['last_status'] = job.status
+            entry['failures'] = 0 if job.status == COMPLETED else entry.get('failures', 0) + 1
+            del self._active[key]
+
+    def _busy_jobs(self):
+        return sum(1 for job in self.job_queue.list() if job.status not in FINISHED_STATES)
+
+    def _change_checks(self, now):
+        """Returns (key, domain, validators) of captures whose main page is checked for changes now."""
+        checks = []
+        for key, domain, device_type, settings, entry, due in self._entries(now):
+            interval = settings['capture_interval']
+            # A changed main page may be captured early, after a quarter of the interval
+            if (key not in self._active and now < due and entry.get('last_run')
+                    and now >= entry['last_run'] + interval / 4
+                    and now >= entry.get('checked_at', 0) + CHANGE_CHECK_INTERVAL):
+                entry['checked_at'] = now
+                checks.append((key, domain, entry.get('validators')))
+        return checks
+
+    def _candidates(self, now, changes):
+        candidates = []
+        for key, domain, device_type, settings, entry, due in self._entries(now):
+            if key in self._active:
+                continue
+            if key in changes:
+                entry['changed'] = changes[key]
+            changed = now < due and entry.get('changed', False)
+            if now < due and not changed:
+                continue
+            interval = settings['capture_interval']
+            score = (now - due) / interval + settings.get('capture_priority', 0) + (1 if changed else 0)
+            candidates.append((score, key, domain, device_type))
+        candidates.sort(reverse=True)
+        return candidates
+
+    def due(self, now=None):
+        """Returns the due captures, most urgent first, as (score, key, domain, device_type)."""
+        now = now or time.time()
+        with self._lock:
+            checks = self._change_checks(now)
+        # The HEAD requests run without the lock, so status() never waits for slow sites
+        changes = {key: self._main_page_changed(domain, validators) for key, domain, validators in checks}
+        with self._lock:
+            return self._candidates(now, changes)
+
+    @staticmethod
+    def _main_page_changed(domain, previous_validators):
+        validators = get_http_validators(domain_url(domain))
+        return bool(validators and previous_validators and validators != previous_validators)
+
+    def tick(self, now=None):
+        """Starts at most one due capture; returns the started job or None."""
+        now = now or time.time()
+        with self._lock:
+            self._collect_finished()
+            ready = now - self._last_start >= self.min_gap and self._busy_jobs() < self.max_active
+        job = None
+        # Only the scheduler thread ticks, so nothing else starts a capture between these steps
+        candidates = self.due(now) if ready else []
+        if candidates:
+            score, key, domain, device_type = candidates[0]
+            validators = get_http_validators(domain_url(domain))
+            with self._lock:
+                entry = self._state[key]
+                entry['validators'] = validators
+                entry['changed'] = False
+                job = self.submit(domain, device_type)
+                self._active[key] = job
+                self._last_start = now
+            logging.info(f"Scheduled capture of {domain} ({device_type}), score {score:.2f}, "
+                         f"{len(candidates) - 1} more due")
+        with self._lock:
+            self._save()
+        return job
+
+    def status(self):
+        """Returns the schedule of every capture for the status endpoint."""
+        now = time.time()
+        with self._lock:
+            return [{
+                'domain': domain,
+                'deviceType': device_type,
+                'interval': settings['capture_interval'],
+                'last_run': entry.get('last_run'),
+                'last_status': entry.get('last_status'),
+                'failures': entry.get('failures', 0),
+                'next_due': due,
+                'running': key in self._active,
+            } for key, domain, device_type, settings, entry, due in self._entries(now)]
+
+    def start(self, tick=SCHEDULER_TICK):
+        """Runs tick() every `tick` seconds in a daemon thread."""
+        def run():
+            while True:
+                try:
+                    self.tick()
+                except Exception as e:
+                    logging.error(f"Scheduler tick failed: {e}")
+                time.sleep(tick)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
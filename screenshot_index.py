@@ -0,0 +1,305 @@
+import base64
+import json
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+# SQLite index with one row per screenshot file, so listings and searches never walk the disk
+SCREENSHOT_INDEX_DB = os.environ.get('SCREENSHOT_INDEX_DB', 'screenshots.db')
+SCREENSHOT_ROOT = os.path.join('static', 'screenshots')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+RECONCILE_INTERVAL = int(os.environ.get('SCREENSHOT_RECONCILE_INTERVAL', 600))
+MAX_PAGE_SIZE = 200
+SORT_COLUMNS = ('captured_at', 'size', 'domain', 'filename')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS screenshots (
+    path TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    device TEXT,
+    filename TEXT NOT NULL,
+    source_url TEXT,
+    captured_at REAL NOT NULL,
+    mtime REAL,
+    size INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_screenshots_captured_at ON screenshots (captured_at);
+CREATE INDEX IF NOT EXISTS idx_screenshots_domain ON screenshots (domain, device, captured_at);
+CREATE INDEX IF NOT EXISTS idx_screenshots_folder ON screenshots (folder);
+CREATE INDEX IF NOT EXISTS idx_screenshots_device ON screenshots (device, captured_at);
+"""
+
+
+def get_image_size(file_path):
+    """Reads the width and height from a PNG header without decoding the image."""
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(24)
+    except OSError:
+        return None, None
+    if len(header) == 24 and header[:8] == b'\x89PNG\r\n\x1a\n' and header[12:16] == b'IHDR':
+        return struct.unpack('>II', header[16:24])
+    return None, None
+
+
+def escape_like(value):
+    """Escapes LIKE wildcards so the value is matched literally."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def normalize_domain(domain):
+    """Maps a domain as entered by users (e.g. 'www.example.com:8080') to its folder name."""
+    return domain.strip().lower().replace('www.', '').replace(':', '_')
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError("Invalid cursor.")
+    return values
+
+
+class ScreenshotIndex:
+    """Metadata index of all screenshots stored below `root`."""
+
+    def __init__(self, db_path=SCREENSHOT_INDEX_DB, root=SCREENSHOT_ROOT):
+        self.db_path = db_path
+        self.root = os.path.abspath(root)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(screenshots)')]
+            if 'mtime' not in columns:
+                # Indexes created before captured_at was kept apart from the file's mtime
+                conn.execute('ALTER TABLE screenshots ADD COLUMN mtime REAL')
+                conn.execute('UPDATE screenshots SET mtime = captured_at')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def relative_path(self, file_path):
+        """Returns the path of a screenshot relative to the screenshot root, using '/' separators."""
+        rel_path = os.path.relpath(os.path.abspath(file_path), self.root)
+        return rel_path.replace(os.sep, '/')
+
+    def _row_for(self, file_path, source_url=None, stat=None, captured_at=None):
+        rel_path = self.relative_path(file_path)
+        parts = rel_path.split('/')
+        stat = stat or os.stat(file_path)
+        width, height = get_image_size(file_path)
+        return {
+            'path': rel_path,
+            'folder': '/'.join(parts[:-1]),
+            'domain': parts[0] if len(parts) > 1 else '',
+            'device': parts[1] if len(parts) > 2 else None,
+            'filename': parts[-1],
+            'source_url': source_url,
+            'captured_at': stat.st_mtime if captured_at is None else captured_at,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'width': width,
+            'height': height,
+        }
+
+    def record(self, file_path, source_url=None, captured_at=None):
+        """
+        Adds or refreshes the entry for a screenshot that was just written, captured now unless
+        `captured_at` says otherwise. Stored screenshots are hard links to shared blobs, so the
+        file's mtime is not the capture time.
+        """
+        try:
+            row = self._row_for(file_path, source_url, captured_at=time.time() if captured_at is None else captured_at)
+        except OSError as e:
+            logging.error(f"Cannot index screenshot '{file_path}': {e}")
+            return
+        with self._write_lock, self._connect() as conn:
+            self._upsert(conn, row)
+
+    @staticmethod
+    def _upsert(conn, row):
+        conn.execute(
+            """
+            INSERT INTO screenshots (path, folder, domain, device, filename, source_url, captured_at, mtime, size,
+                                     width, height)
+            VALUES (:path, :folder, :domain, :device, :filename, :source_url, :captured_at, :mtime, :size, :width,
+                    :height)
+            ON CONFLICT(path) DO UPDATE SET
+                captured_at = excluded.captured_at,
+                mtime = excluded.mtime,
+                size = excluded.size,
+                width = excluded.width,
+                height = excluded.height,
+                source_url = COALESCE(excluded.source_url, screenshots.source_url)
+            """,
+            row,
+        )
+
+    def remove(self, file_path):
+        """Drops the entry of a deleted screenshot."""
+        with self._write_lock, self._connect() as conn:
+            conn.execute('DELETE FROM screenshots WHERE path = ?', (self.relative_path(file_path),))
+
+    def reconcile(self):
+        """
+        Brings the index in line with the files on disk and returns (added/updated, removed).
+
+        Only files whose size or mtime differs from the indexed ones were changed outside the
+        app; they are dated by their mtime. Captures still being written (*.partial.png) are skipped.
+        """
+        start = time.monotonic()
+        on_disk = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.lower().endswith(IMAGE_EXTENSIONS) and '.partial.' not in filename:
+                    file_path = os.path.join(dirpath, filename)
+                    try:
+                        on_disk[self.relative_path(file_path)] = (file_path, os.stat(file_path))
+                    except OSError:
+                        pass
+
+        conn = self._connect()
+        with self._write_lock, conn:
+            # Screenshots recorded while the walk ran are in this snapshot but maybe not in on_disk
+            indexed = {row['path']: (row['size'], row['mtime'])
+                       for row in conn.execute('SELECT path, size, mtime FROM screenshots')}
+            changed = []
+            for rel_path, (file_path, stat) in on_disk.items():
+                if indexed.get(rel_path) == (stat.st_size, stat.st_mtime):
+                    continue
+                # A screenshot replaced since the walk may have been recorded with its new stat already
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                if indexed.get(rel_path) != (stat.st_size, stat.st_mtime):
+                    changed.append((file_path, stat))
+            removed = [rel_path for rel_path in indexed if rel_path not in on_disk
+                       and not os.path.exists(os.path.join(self.root, rel_path))]
+            for file_path, stat in changed:
+                self._upsert(conn, self._row_for(file_path, stat=stat))
+            conn.executemany('DELETE FROM screenshots WHERE path = ?', [(rel_path,) for rel_path in removed])
+
+        if changed or removed:
+            logging.info(f"Screenshot index reconciled in {time.monotonic() - start:.2f}s: "
+                         f"{len(changed)} updated, {len(removed)} removed")
+        return len(changed), len(removed)
+
+    def start_reconciler(self, interval=RECONCILE_INTERVAL):
+        """Reconciles once now and then every `interval` seconds in a daemon thread."""
+        def run():
+            while True:
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    logging.error(f"Screenshot index reconcile failed: {e}")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def count(self):
+        return self._connect().execute('SELECT COUNT(*) FROM screenshots').fetchone()[0]
+
+    def list_folder(self, folder):
+        """Returns the file names stored directly in the given folder (relative to the root)."""
+        rows = self._connect().execute('SELECT filename FROM screenshots WHERE folder = ? ORDER BY filename',
+                                       (folder.strip('/'),))
+        return [row['filename'] for row in rows]
+
+    def list_by_folder(self):
+        """Returns {folder: [file names]} for every folder that contains screenshots."""
+        screenshots = {}
+        for row in self._connect().execute('SELECT folder, filename FROM screenshots ORDER BY folder, filename'):
+            screenshots.setdefault(row['folder'], []).append(row['filename'])
+        return screenshots
+
+    def search(self, start=None, end=None, folder_prefix=None):
+        """Returns the paths of screenshots captured in [start, end), optionally below a folder."""
+        query = 'SELECT path FROM screenshots WHERE 1 = 1'
+        params = []
+        if start is not None:
+            query += ' AND captured_at >= ?'
+            params.append(start)
+        if end is not None:
+            query += ' AND captured_at < ?'
+            params.append(end)
+        if folder_prefix:
+            query += " AND (folder = ? OR folder LIKE ? ESCAPE '\\')"
+            params.extend([folder_prefix, f"{escape_like(folder_prefix)}/%"])
+        query += ' ORDER BY captured_at DESC'
+        return [row['path'] for row in self._connect().execute(query, params)]
+
+    def query(self, start=None, end=None, domain=None, domain_match='exact', device=None, sort='captured_at',
+              order='desc', limit=50, cursor=None):
+        """
+        Returns one page of screenshot rows and the cursor of the next page (None on the last page).
+
+        Capture time is filtered as [start, end). The domain is matched exactly or as a prefix of
+        the folder name, both of which use the domain index. Pages are keyset-paginated on
+        (sort column, path), so deep pages cost the same as the first one.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Invalid sort column: {sort}. Must be one of {', '.join(SORT_COLUMNS)}.")
+        if order not in ('asc', 'desc'):
+            raise ValueError("Invalid sort order. Must be 'asc' or 'desc'.")
+        if domain_match not in ('exact', 'prefix'):
+            raise ValueError("Invalid domain match. Must be 'exact' or 'prefix'.")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        query = 'SELECT * FROM screenshots WHERE 1 = 1'
+        params = []
+        if start is not None:
+            query += ' AND captured_at >= ?'
+            params.append(start)
+        if end is not None:
+            query += ' AND captured_at < ?'
+            params.append(end)
+        if domain:
+            domain = normalize_domain(domain)
+            if domain_match == 'exact':
+                query += ' AND domain = ?'
+                params.append(domain)
+            else:
+                query += ' AND domain >= ? AND domain < ?'
+                params.extend([domain, domain + '\uffff'])
+        if device:
+            query += ' AND device = ?'
+            params.append(device)
+        if cursor:
+            value, path = decode_cursor(cursor)
+            operator = '<' if order == 'desc' else '>'
+            query += f' AND ({sort} {operator} ? OR ({sort} = ? AND path {operator} ?))'
+            params.extend([value, value, path])
+        query += f' ORDER BY {sort} {order.upper()}, path {order.upper()} LIMIT ?'
+        params.append(limit + 1)
+
+        rows = [dict(row) for row in self._connect().execute(query, params)]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1][sort], rows[-1]['path']])
+        return rows, next_cursor
+
+
+screenshot_index = ScreenshotIndex()
@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import os
+import threading
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow screenshots are deduplicated but not recompressed
+    Image = None
+
+# Content-addressed blob storage. Screenshot paths under static/screenshots stay where they are,
+# but become hard links to a single blob per distinct image, so URLs and /download keep working.
+BLOB_FOLDER = os.environ.get('SCREENSHOT_BLOB_FOLDER', os.path.join('storage', 'blobs'))
+OPTIMIZE_PNG = os.environ.get('SCREENSHOT_OPTIMIZE_PNG', '1') == '1'
+
+_store_lock = threading.Lock()
+
+
+def optimize_png(path):
+    """Recompresses a PNG losslessly in place and returns the number of bytes saved."""
+    if Image is None or not OPTIMIZE_PNG:
+        return 0
+    before = os.path.getsize(path)
+    tmp_path = f"{path}.opt"
+    try:
+        with Image.open(path) as image:
+            if image.format != 'PNG':
+                return 0
+            image.save(tmp_path, 'PNG', optimize=True)
+        if os.path.getsize(tmp_path) < before:
+            os.replace(tmp_path, path)
+            return before - os.path.getsize(path)
+    except Exception as e:
+        logging.error(f"Cannot optimize '{path}': {e}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return 0
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blob_path(content_hash, extension='.png'):
+    return os.path.join(BLOB_FOLDER, content_hash[:2], content_hash + extension)
+
+
+def _link(source, target):
+    """Atomically replaces `target` with a hard link to `source`."""
+    tmp_path = f"{target}.lnk"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    os.link(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def store_screenshot(path):
+    """
+    Optimizes a freshly written screenshot and deduplicates it against the blob store.
+
+    Returns the content hash. When hard links are not supported (e.g. the blob folder is on
+    another file system) the screenshot is left as a regular file. The mtime of a shared blob
+    says nothing about when a page was captured; capture times live in the screenshot index.
+    """
+    optimize_png(path)
+    content_hash = file_hash(path)
+    extension = os.path.splitext(path)[1].lower() or '.png'
+    blob = blob_path(content_hash, extension)
+
+    with _store_lock:
+        try:
+            if os.path.exists(blob):
+                if not os.path.samefile(blob, path):
+                    _link(blob, path)
+                    logging.info(f"Stored '{path}' as a duplicate of blob {content_hash[:12]}")
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.link(path, blob)
+        except OSError as e:
+            logging.warning(f"Cannot deduplicate '{path}': {e}")
+    return content_hash
+
+
+def collect_garbage(keep=()):
+    """
+    Deletes blobs that are no longer referenced by any screenshot and returns the bytes freed.
+    Blobs whose content hash is in `keep` (earlier page versions of retained runs) stay.
+    """
+    freed = 0
+    for dirpath, dirnames, filenames in os.walk(BLOB_FOLDER):
+        for filename in filenames:
+            blob = os.path.join(dirpath, filename)
+            if os.path.splitext(filename)[0] in keep:
+                continue
+            try:
+                stat = os.stat(blob)
+                if stat.st_nlink <= 1:
+                    os.remove(blob)
+                    freed += stat.st_size
+            except OSError as e:
+                logging.error(f"Cannot collect blob '{blob}': {e}")
+    if freed:
+        logging.info(f"Removed unreferenced screenshot blobs, freed {freed / (1024 * 1024):.1f} MB")
+    return freed
+
+
+def storage_stats():
+    """Returns the number of blobs and their total size on disk."""
+    blobs = 0
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(BLOB_FOLDER):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, filename))
+                blobs += 1
+            except OSError:
+                pass
+    return {'blobs': blobs, 'bytes': size}
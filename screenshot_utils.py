@@ -1,18 +1,35 @@
 import logging
 import os
+import queue
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
 from datetime import datetime
 from urllib.parse import urlparse
 
-import psutil
-from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
-from webdriver_manager.chrome import ChromeDriverManager
+
+from capture_runs import RESUME_CRAWLS, run_store
+from change_cache import ChangeCache, get_http_validators, get_page_signature
+from chrome_governor import chrome_governor
+from domain_config import get_domain_setting, get_domain_settings
+from driver_pool import create_pool
+from full_page_capture import capture_full_page, load_lazy_content
+from link_rules import DEFAULT_LINK_RULES, LINK_EXTRACTION_SCRIPT, TRACKING_PARAMS, filter_links, url_file_key
+from link_sources import discover_links
+from log_store import CrawlLogHandler
+from metrics import count_crawl, count_page, observe, timed
+from page_readiness import wait_for_page_ready
+from rate_limiter import THROTTLE_STATUSES, Throttled, get_host_limiter, get_navigation_status
+from request_filter import apply_request_filter, create_driver
+from screenshot_index import screenshot_index
+from screenshot_store import file_hash, store_screenshot
+from thumbnails import generate_derivatives, remove_derivatives
+from visual_diff import schedule_diff
 
 # Base folder for storing screenshots
 BASE_SCREENSHOT_FOLDER = os.path.join('static', 'screenshots')
@@ -21,6 +38,7 @@ os.makedirs(BASE_SCREENSHOT_FOLDER, exist_ok=True)
 # Browser settings for desktop
 chrome_options_desktop = Options()
 chrome_options_desktop.add_argument("--headless")
+chrome_options_desktop.add_argument("--window-size=1920,1080")
 chrome_options_desktop.add_argument("--hide-scrollbars")
 chrome_options_desktop.add_argument('--no-sandbox')
 chrome_options_desktop.add_argument('--disable-dev-shm-usage')
@@ -35,14 +53,37 @@ chrome_options_mobile.add_argument('--no-sandbox')
 chrome_options_mobile.add_argument('--disable-dev-shm-usage')
 chrome_options_mobile.add_argument("--ignore-certificate-errors")
 
+# Shared pool of warm Chrome drivers, one set per device profile
+driver_pool = create_pool({'desktop': chrome_options_desktop, 'mobile': chrome_options_mobile}, factory=create_driver)
+
+# Concurrency limits for the capture engine
+CAPTURE_WORKERS = int(os.environ.get('CAPTURE_WORKERS', 2))
+MAX_CAPTURES_GLOBAL = int(os.environ.get('MAX_CAPTURES_GLOBAL', 4))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 2))
+# How many times a page that was answered with a throttling status is queued again
+MAX_THROTTLE_RETRIES = int(os.environ.get('MAX_THROTTLE_RETRIES', 2))
+# Threads that recompress, hash and thumbnail screenshots after the page gave back its browser
+POSTPROCESS_WORKERS = int(os.environ.get('POSTPROCESS_WORKERS', 2))
+
 # Global variables for thread management
 screenshot_thread = None
 stop_screenshots = False
 stop_screenshots_lock = threading.Lock()
 
+global_capture_slots = threading.BoundedSemaphore(MAX_CAPTURES_GLOBAL)
+postprocess_executor = ThreadPoolExecutor(max_workers=POSTPROCESS_WORKERS)
+
+# Which crawl the current thread works for, so its records end up in that crawl's log.txt
+crawl_context = threading.local()
+# Called as listener(domain, date_str, offset, line) for every line written to a crawl log
+crawl_log_listeners = []
+
+
+def get_screenshots(screenshots_dir=BASE_SCREENSHOT_FOLDER):
+    """Get all screenshots organized by folder (e.g. 'example.com/desktop')."""
+    if os.path.abspath(screenshots_dir) == screenshot_index.root:
+        return screenshot_index.list_by_folder()
 
-def get_screenshots(screenshots_dir):
-    """Get all screenshots organized by domain and device type."""
     screenshots = {}
     for dirpath, dirnames, filenames in os.walk(screenshots_dir):
         for dirname in dirnames:
@@ -100,146 +141,540 @@ def create_directory_for_domain(domain_name):
     return mobile_folder, desktop_folder
 
 
-def setup_logging(domain, date_str):
-    """Sets up logging for the given domain and date."""
+def notify_crawl_log(domain, date_str, offset, line):
+    for listener in list(crawl_log_listeners):
+        listener(domain, date_str, offset, line)
+
+
+def setup_logging(domain, date_str, crawl_id=None):
+    """
+    Sets up logging for the given domain and date.
+
+    Records logged from threads whose `crawl_context.crawl_id` equals `crawl_id` are written to
+    `<domain>/<date_str>/log.txt`. Returns the handler, which has to be passed to
+    teardown_logging() once the crawl is done.
+    """
     log_folder = os.path.join(BASE_SCREENSHOT_FOLDER, domain, date_str)
     os.makedirs(log_folder, exist_ok=True)
     log_file = os.path.join(log_folder, 'log.txt')
-    logging.basicConfig(filename=log_file, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    return logging
+    crawl_id = crawl_id or f"{domain}/{date_str}"
+    handler = CrawlLogHandler(
+        log_file,
+        accept=lambda record: getattr(crawl_context, 'crawl_id', None) == crawl_id,
+        listener=lambda path, offset, line: notify_crawl_log(domain, date_str, offset, line),
+    )
+    logging.getLogger().addHandler(handler)
+    return handler
+
 
+def teardown_logging(handler):
+    """Detaches and closes a crawl log handler created by setup_logging()."""
+    logging.getLogger().removeHandler(handler)
+    handler.close()
 
-def take_full_page_screenshot(driver, filename, is_mobile=False):
-    """Takes a full-page screenshot."""
-    original_size = driver.get_window_size()
-    total_width = driver.execute_script("return document.documentElement.scrollWidth")
-    total_height = driver.execute_script("return document.documentElement.scrollHeight")
 
-    driver.set_window_size(375 if is_mobile else total_width, total_height)
-    time.sleep(5)
-    driver.save_screenshot(filename)
+def take_full_page_screenshot(driver, filename, is_mobile=False, ready_timeout=15, mode='cdp', domain=''):
+    """
+    Takes a full-page screenshot.
+
+    The 'cdp' mode renders the whole page through Page.captureScreenshot without touching the
+    window (see full_page_capture.py); the 'resize' mode, also used when the DevTools
+    capture fails, stretches the window to the page height.
+    """
+    device = 'mobile' if is_mobile else 'desktop'
+    # Write to a new file and swap it in, so a stored (hard-linked) previous capture is never overwritten
+    partial_filename = f"{os.path.splitext(filename)[0]}.partial.png"
+    if mode == 'cdp':
+        try:
+            with timed('lazy_content', domain, device):
+                load_lazy_content(driver)
+                waited = wait_for_page_ready(driver, ready_timeout)
+            with timed('capture_cdp', domain, device):
+                width, height = capture_full_page(driver, partial_filename, is_mobile=is_mobile)
+                os.replace(partial_filename, filename)
+            logging.info(f"Captured {width}x{height} page into {filename} ({waited:.2f}s for lazy content)")
+            return
+        except Exception as e:
+            logging.warning(f"DevTools capture failed for {filename}, resizing the window instead: {e}")
+
+    with timed('resize', domain, device):
+        original_size = driver.get_window_size()
+        total_width = driver.execute_script("return document.documentElement.scrollWidth")
+        total_height = driver.execute_script("return document.documentElement.scrollHeight")
+        driver.set_window_size(375 if is_mobile else total_width, total_height)
+        waited = wait_for_page_ready(driver, ready_timeout)
+    logging.info(f"Layout settled {waited:.2f}s after resizing for {filename}")
+    with timed('save_screenshot', domain, device):
+        driver.save_screenshot(partial_filename)
+        os.replace(partial_filename, filename)
     driver.set_window_size(original_size['width'], original_size['height'])
     if stop_screenshots:
         return
 
 
 def get_all_links(driver, base_url=None):
-    """Retrieves all links from the given page, excluding mailto, image files, and specific keywords."""
-    links = []
+    """
+    Retrieves the links of the current page, filtered and ranked by the domain's link rules.
+
+    All anchors are read with a single script evaluation; see link_rules.py for the URL
+    normalization and the rules (mailto, 'poczta', image files, javascript and external
+    links are skipped by default).
+    """
+    domain = urlparse(base_url).netloc if base_url else ''
+    settings = get_domain_settings(domain)
+    rules = settings.get('link_rules')
+    priority = settings.get('link_priority')
+    tracking_params = settings.get('tracking_params', TRACKING_PARAMS)
+    ignore_query = settings.get('ignore_query', False)
+
     attempts = 3
     for _ in range(attempts):
         try:
-            elements = driver.find_elements(By.TAG_NAME, 'a')
-            for element in elements:
-                href = element.get_attribute('href')
-                if href:
-                    # Skip mailto links
-                    if href.startswith('mailto:'):
-                        logging.info(f"Skipping mailto link: {href}")
-                        continue
-                    # Skip links containing 'poczta'
-                    if 'poczta' in href.lower():
-                        logging.info(f"Skipping link (contains 'poczta'): {href}")
-                        continue
-                    # Skip image files
-                    if href.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp')):
-                        logging.info(f"Skipping link (image file): {href}")
-                        continue
-                    # Skip javascript links
-                    if href.startswith('javascript:'):
-                        logging.info(f"Skipping javascript link: {href}")
-                        continue
-                    
-                    # If base_url is provided, filter for links from the same domain
-                    if base_url:
-                        parsed_href = urlparse(href)
-                        if parsed_href.netloc == '' or parsed_href.netloc == urlparse(base_url).netloc:
-                            links.append(href)
-                        else:
-                            logging.info(f"Skipping link (external domain): {href}")
-                    else:
-                        links.append(href)
+            raw_links = driver.execute_script(LINK_EXTRACTION_SCRIPT) or []
             break
         except Exception as e:
             logging.error(f"Error retrieving links: {e}")
             time.sleep(1)
-    return list(set(links))  # Remove duplicates
+    else:
+        return []
 
+    links, skipped = filter_links(raw_links, base_url, rules=rules, priority=priority,
+                                  tracking_params=tracking_params, ignore_query=ignore_query)
+    rules = DEFAULT_LINK_RULES if rules is None else rules
+    for index, count in skipped.items():
+        logging.info(f"Skipped {count} links by rule {rules[index]}")
+    return links
+
+
+def kill_screenshot_process(owner=None):
+    """
+    Kills the Chrome processes started for screenshots by one job, or by all jobs when no
+    owner is given. Browsers of other applications are left alone.
+    """
+    return chrome_governor.kill(owner)
+
+
+def resource_owner(progress=None):
+    """Returns who is charged for the Chrome usage of a crawl: its job, or the crawl itself."""
+    return getattr(progress, 'id', None) or getattr(crawl_context, 'crawl_id', None)
+
+
+def capture_page(driver, link, screenshot_path, device_type, domain_name, cache=None, run=None, pending=None):
+    """
+    Loads a single page and saves its full-page screenshot.
+
+    With a change cache, the previous screenshot is reused when the page did not change:
+    the 'headers' detection mode compares ETag/Last-Modified before loading the page at all,
+    the 'dom' mode compares a hash of the rendered content before taking the screenshot.
+    Returns True when a new screenshot was written. Raises Throttled right after the page
+    load when the site answered 429/5xx, instead of waiting for a page that will not come.
+    With a capture run (see capture_runs.py) the page version is recorded in it. Every
+    stage is timed into the metrics (see metrics.py).
+
+    With a `pending` list, storing, indexing and thumbnailing the new screenshot (see
+    finish_capture) run on the post-processing threads and their future is appended to it,
+    so the caller can give back its browser and slots right away and wait for them later.
+    """
+    try:
+        with timed('page', domain_name, device_type):
+            captured = _capture_page(driver, link, screenshot_path, device_type, domain_name, cache, run, pending)
+    except Throttled:
+        count_page(domain_name, device_type, 'throttled')
+        raise
+    except Exception:
+        count_page(domain_name, device_type, 'failed')
+        raise
+    count_page(domain_name, device_type, 'captured' if captured else 'reused')
+    return captured
+
+
+def _capture_page(driver, link, screenshot_path, device_type, domain_name, cache, run, pending):
+    ready_timeout = get_domain_setting(domain_name, 'ready_timeout', 15)
+    detection = get_domain_setting(domain_name, 'change_detection', 'dom') if cache else 'off'
+
+    validators = None
+    if detection == 'headers':
+        with timed('http_validators', domain_name, device_type):
+            validators = get_http_validators(link)
+        if cache.matches_validators(link, device_type, validators) and cache.reuse(link, device_type, screenshot_path):
+            logging.info(f"Page {link} not modified, reusing previous screenshot")
+            screenshot_index.record(screenshot_path, source_url=link)
+            if run:
+                run.record_page(link, screenshot_path, file_hash(screenshot_path), False)
+            return False
+
+    try:
+        with timed('navigate', domain_name, device_type):
+            request_filter = apply_request_filter(driver, domain_name)
+            driver.get(link)
+            status = get_navigation_status(driver)
+        get_host_limiter(domain_name).report(status)
+        if status in THROTTLE_STATUSES:
+            raise Throttled(link, status)
+        with timed('wait_body', domain_name, device_type):
+            WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.TAG_NAME, 'body')))
+        with timed('ready', domain_name, device_type):
+            waited = wait_for_page_ready(driver, ready_timeout)
+        blocked = f", {request_filter.blocked} requests blocked" if request_filter and request_filter.blocked else ''
+        logging.info(f"Page {link} ready after {waited:.2f}s{blocked}")
+
+        signature = None
+        if detection != 'off':
+            with timed('signature', domain_name, device_type):
+                signature = get_page_signature(driver)
+            if cache.matches_signature(link, device_type, signature) and cache.reuse(link, device_type,
+                                                                                     screenshot_path):
+                logging.info(f"Page {link} unchanged, reusing previous screenshot")
+                screenshot_index.record(screenshot_path, source_url=link)
+                if run:
+                    run.record_page(link, screenshot_path, file_hash(screenshot_path), False)
+                return False
+
+        with timed('screenshot', domain_name, device_type):
+            take_full_page_screenshot(driver, screenshot_path, is_mobile=(device_type == 'mobile'),
+                                      ready_timeout=ready_timeout,
+                                      mode=get_domain_setting(domain_name, 'capture_mode', 'cdp'),
+                                      domain=domain_name)
+        args = (link, screenshot_path, device_type, domain_name, cache, run, signature, validators)
+        if pending is None:
+            finish_capture(*args)
+        else:
+            pending.append(postprocess_executor.submit(_finish_in_crawl, getattr(crawl_context, 'crawl_id', None),
+                                                       args))
+        return True
+    finally:
+        driver_pool.record_page(driver)
+
+
+def finish_capture(link, screenshot_path, device_type, domain_name, cache, run, signature, validators):
+    """Optimizes and deduplicates a new screenshot, then records it in the run, cache and index."""
+    with timed('store', domain_name, device_type):
+        content_hash = store_screenshot(screenshot_path)
+    with timed('record', domain_name, device_type):
+        if run:
+            run.record_page(link, screenshot_path, content_hash, True)
+        if cache:
+            cache.record(link, device_type, screenshot_path, signature=signature, validators=validators)
+        screenshot_index.record(screenshot_path, source_url=link)
+    with timed('derivatives', domain_name, device_type):
+        generate_derivatives(screenshot_path)
+
+
+def _finish_in_crawl(crawl_id, args):
+    # Log into the crawl's log.txt like the capture worker that submitted it
+    crawl_context.crawl_id = crawl_id
+    try:
+        finish_capture(*args)
+    except Exception as e:
+        logging.error(f"Cannot store screenshot of {args[0]}: {str(e)}")
+        raise
+    finally:
+        crawl_context.crawl_id = None
+
+
+def wait_for_pending(pending):
+    """Waits until the post-processing of every screenshot in `pending` is done."""
+    for future in pending:
+        try:
+            future.result()
+        except Exception:
+            pass  # logged by _finish_in_crawl
 
-def kill_screenshot_process():
-    """Kill Chrome processes used for screenshots."""
-    for proc in psutil.process_iter(['pid', 'name']):
-        if 'chrome' in proc.info['name'].lower():
+
+@contextmanager
+def capture_slot(domain_name, device_type):
+    """Holds a slot of the domain's rate limiter and a global capture slot; the wait is timed."""
+    with ExitStack() as stack:
+        with timed('slot_wait', domain_name, device_type):
+            stack.enter_context(get_host_limiter(domain_name).slot())
+            stack.enter_context(global_capture_slots)
+        yield
+
+
+def prune_screenshots(folder, device_type, keep):
+    """
+    Deletes the screenshots of a device folder that a completed crawl no longer refers to:
+    files of the old index-based naming (`screen_<i>_<device>.png`) and page files of URLs
+    that dropped out of its link list. Returns the number of deleted files.
+    """
+    keep = {os.path.abspath(path) for path in keep}
+    removed = 0
+    for filename in os.listdir(folder):
+        if not filename.startswith(('screen_', 'page_')) or not filename.endswith(f"_{device_type}.png"):
+            continue
+        path = os.path.join(folder, filename)
+        if os.path.abspath(path) in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.error(f"Cannot remove outdated screenshot '{path}': {e}")
+            continue
+        # Earlier versions stay in the blobs of the retained runs
+        screenshot_index.remove(path)
+        remove_derivatives(screenshot_index.relative_path(path))
+        removed += 1
+    if removed:
+        logging.info(f"Removed {removed} outdated screenshots from {folder}")
+    return removed
+
+
+def should_stop(progress=None):
+    """Returns True when all captures were stopped or the given job was cancelled."""
+    return stop_screenshots or bool(progress and progress.cancelled)
+
+
+def capture_links(links, device_type, domain_name, folder, max_links=40, workers=CAPTURE_WORKERS, progress=None,
+                  cache=None, run=None, pending=None):
+    """
+    Captures the given links concurrently and returns the paths of the saved screenshots.
+
+    Links are spread over `workers` threads, each with its own pooled driver. Every capture
+    also holds a slot of the domain's rate limiter (see rate_limiter.py) and a global slot,
+    so parallel crawls stay within the per-domain politeness limits and MAX_CAPTURES_GLOBAL.
+    Pages answered with a throttling status are queued again and wait out the backoff.
+    Screenshots are named `page_{key}_{device}.png` after a hash of the normalized URL, so a
+    page keeps its file across runs; pages a resumed run already saved are not captured again.
+    Their post-processing futures are appended to `pending` (see capture_page).
+    """
+    saved = []
+    saved_lock = threading.Lock()
+    # Pages being captured count against max_links too, so busy workers never overshoot it
+    reserved = 0
+    worker_errors = []
+
+    link_queue = queue.Queue()
+    for link in links:
+        if run and link in run.captured and len(saved) < max_links:
+            saved.append(run.captured[link])
+            if progress:
+                progress.page_done(link, run.captured[link])
+            continue
+        link_queue.put((link, 0))
+
+    crawl_id = getattr(crawl_context, 'crawl_id', None)
+
+    def take_link():
+        """Takes the next link and reserves its place in `saved`, or returns None when done."""
+        nonlocal reserved
+        with saved_lock:
+            if len(saved) + reserved >= max_links:
+                return None
             try:
-                proc.kill()
-            except psutil.NoSuchProcess:
-                pass
+                item = link_queue.get_nowait()
+            except queue.Empty:
+                return None
+            reserved += 1
+            return item
 
+    def release_link(path=None):
+        nonlocal reserved
+        with saved_lock:
+            reserved -= 1
+            if path:
+                saved.append(path)
 
-def visit_links_and_take_screenshots(url, device_type, max_links=40):
-    """Takes screenshots of a website and its links in specified device type view."""
+    def worker():
+        crawl_context.crawl_id = crawl_id
+        try:
+            run_worker()
+        except Exception as e:
+            logging.error(f"Capture worker for {domain_name} ({device_type}) failed: {str(e)}")
+            worker_errors.append(e)
+
+    def run_worker():
+        with driver_pool.driver(device_type, owner=resource_owner(progress)) as driver:
+            while not should_stop(progress):
+                item = take_link()
+                if item is None:
+                    return
+                link, retries = item
+
+                screenshot_path = os.path.join(folder, f"page_{url_file_key(link)}_{device_type}.png")
+                try:
+                    with capture_slot(domain_name, device_type):
+                        capture_page(driver, link, screenshot_path, device_type, domain_name, cache=cache,
+                                     run=run, pending=pending)
+                    release_link(screenshot_path)
+                    if progress:
+                        progress.page_done(link, screenshot_path)
+                except Throttled as e:
+                    release_link()
+                    if retries < MAX_THROTTLE_RETRIES:
+                        logging.info(f"{e}, trying again after the backoff")
+                        link_queue.put((link, retries + 1))
+                        continue
+                    logging.error(f"Giving up on {link}: {e}")
+                    if progress:
+                        progress.page_failed(link, e)
+                except Exception as e:
+                    release_link()
+                    logging.error(f"Error capturing screenshot for {link}: {str(e)}")
+                    if progress:
+                        progress.page_failed(link, e)
+
+    if not links:
+        return saved
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, min(workers, len(links))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Links left over because workers failed, e.g. when no driver became free in time
+    if worker_errors and not should_stop(progress):
+        remaining = max(0, max_links - len(saved))
+        while remaining:
+            try:
+                link, retries = link_queue.get_nowait()
+            except queue.Empty:
+                break
+            remaining -= 1
+            logging.error(f"Not captured {link}: {worker_errors[-1]}")
+            if progress:
+                progress.page_failed(link, worker_errors[-1])
+    return saved
+
+
+def crawl_site(url, device_type, max_links=40, workers=CAPTURE_WORKERS, progress=None, links=None):
+    """
+    Captures the main page of `url` and its links, raising if the main page cannot be captured.
+
+    `progress` is an optional job object (see job_queue.Job) that receives per-page updates
+    and can cancel the crawl. When `links` is given those pages are captured, otherwise the
+    domain's link source decides (see link_sources.py), falling back to the links found on
+    the rendered main page. Returns the paths of all saved screenshots.
+
+    A crawl that was interrupted (see capture_runs.py) is continued: the planned links are
+    taken from its run and the pages it already saved are skipped. Once a crawl of the
+    discovered links completes, screenshots of pages it no longer links to are deleted.
+    """
     url = is_valid_url(url)
     domain_name = urlparse(url).netloc.replace('www.', '').replace(':', '_')
     mobile_folder, desktop_folder = create_directory_for_domain(domain_name)
+    folder = desktop_folder if device_type == 'desktop' else mobile_folder
+    saved = []
+    # Post-processing of the screenshots, finished before the run is closed
+    pending = []
+    cache = ChangeCache(domain_name, device_type)
+    # Crawls of explicitly given links always start over and cover only part of the site
+    explicit_links = links is not None
+    run = run_store.start(domain_name, device_type, resume=RESUME_CRAWLS, explicit=explicit_links)
+    run_status = 'failed'
 
-    setup_logging(domain_name, datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
-
-    options = chrome_options_desktop if device_type == 'desktop' else chrome_options_mobile
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+    crawl_context.crawl_id = f"{domain_name}/{device_type}/{time.time()}"
+    crawl_started = time.perf_counter()
+    log_handler = setup_logging(domain_name, datetime.now().strftime("%Y-%m-%d_%H-%M-%S"), crawl_context.crawl_id)
 
     try:
-        driver.get(url)
-        WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.TAG_NAME, 'body')))
-        time.sleep(5)  # Wait for page to fully render
-
-        if device_type == 'desktop':
-            driver.set_window_size(1920, 1080)
-        
-        # Take screenshot of the main page
-        main_screenshot_path = os.path.join(
-            desktop_folder if device_type == 'desktop' else mobile_folder,
-            f"main_page_{device_type}.png"
-        )
-        take_full_page_screenshot(driver, main_screenshot_path, is_mobile=(device_type == 'mobile'))
-
-        # Get all links from the page
-        links = get_all_links(driver, url)
-        logging.info(f"Found {len(links)} links on page {url}")
-
-        processed_links = set()
-        link_count = 0
-        
-        # Process each link
-        for i, link in enumerate(links):
-            if link_count >= max_links:
-                break
-                
-            if link in processed_links:
-                continue
-                
-            processed_links.add(link)
-            
+        if run.resumed:
+            links = run.links
+            logging.info(f"Resuming run {run.id} of {url}: {len(run.captured)} pages already saved")
+        elif links is None:
             try:
-                driver.get(link)
-                WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.TAG_NAME, 'body')))
-                time.sleep(5)
-
-                if device_type == 'desktop':
-                    driver.set_window_size(1920, 1080)
-                    
-                screenshot_path = os.path.join(
-                    desktop_folder if device_type == 'desktop' else mobile_folder,
-                    f"screen_{i + 1}_{device_type}.png"
-                )
-                
-                take_full_page_screenshot(driver, screenshot_path, is_mobile=(device_type == 'mobile'))
-                link_count += 1
-                
+                with timed('discover_links', domain_name, device_type):
+                    links = discover_links(url, max_links)
             except Exception as e:
-                logging.error(f"Error capturing screenshot for {link}: {str(e)}")
+                logging.error(f"Link discovery failed for {url}, using the links of the main page: {e}")
+
+        if progress:
+            progress.add_total(1)
+        main_screenshot_path = os.path.join(folder, f"main_page_{device_type}.png")
+        if url in run.captured:
+            saved.append(run.captured[url])
+            if progress:
+                progress.page_done(url, run.captured[url])
+        else:
+            with driver_pool.driver(device_type, owner=resource_owner(progress)) as driver:
+                # Take screenshot of the main page; like links, it waits out the backoff when throttled
+                retries = 0
+                while True:
+                    try:
+                        with capture_slot(domain_name, device_type):
+                            capture_page(driver, url, main_screenshot_path, device_type, domain_name, cache=cache,
+                                         run=run, pending=pending)
+                        break
+                    except Throttled as e:
+                        if retries < MAX_THROTTLE_RETRIES and not should_stop(progress):
+                            retries += 1
+                            logging.info(f"{e}, trying again after the backoff")
+                            continue
+                        if progress:
+                            progress.page_failed(url, e)
+                        raise
+                    except Exception as e:
+                        if progress:
+                            progress.page_failed(url, e)
+                        raise
+                saved.append(main_screenshot_path)
+                if progress:
+                    progress.page_done(url, main_screenshot_path)
+
+                # Get all links from the page
+                if links is None:
+                    with timed('extract_links', domain_name, device_type):
+                        links = get_all_links(driver, url)
+                    logging.info(f"Found {len(links)} links on page {url}")
+        run.set_links(links)
+
+        if should_stop(progress):
+            run_status = 'cancelled'
+            return saved
+
+        # Process the links in parallel, each worker on its own driver
+        if progress:
+            progress.add_total(min(len(links), max_links))
+        saved.extend(capture_links(links, device_type, domain_name, folder, max_links=max_links, workers=workers,
+                                   progress=progress, cache=cache, run=run, pending=pending))
+        run_status = 'cancelled' if should_stop(progress) else 'completed'
+        return saved
+    finally:
+        wait_for_pending(pending)
+        cache.save()
+        observe('crawl', time.perf_counter() - crawl_started, domain_name, device_type)
+        count_crawl(domain_name, device_type, run_status)
+        run.finish(run_status)
+        if run_status == 'completed':
+            schedule_diff(run.id)
+            if not explicit_links:
+                planned = [os.path.join(folder, f"page_{url_file_key(link)}_{device_type}.png") for link in links]
+                prune_screenshots(folder, device_type, saved + planned)
+        teardown_logging(log_handler)
+        crawl_context.crawl_id = None
+
 
+def visit_links_and_take_screenshots(url, device_type, max_links=40, workers=CAPTURE_WORKERS, progress=None,
+                                     links=None):
+    """Takes screenshots of a website and its links in specified device type view."""
+    try:
+        return crawl_site(url, device_type, max_links=max_links, workers=workers, progress=progress, links=links)
     except Exception as e:
         logging.error(f"Error processing {url}: {str(e)}")
-        
-    finally:
-        driver.quit()
+        return []
+
+
+def capture_batch(urls, device_types, max_links=40, concurrency=BATCH_CONCURRENCY, progress=None):
+    """
+    Crawls every URL in every device view concurrently and returns one result per pair.
+
+    At most `concurrency` sites are crawled at once; the number of pages loading at the
+    same time is still bounded by the global capture slots and the driver pool. A failing
+    URL is reported in its own result and never stops the rest of the batch.
+    """
+    def run(url, device_type):
+        result = {'url': url, 'deviceType': device_type, 'screenshots': [], 'error': None}
+        if should_stop(progress):
+            result['error'] = 'Cancelled'
+            return result
+        try:
+            result['screenshots'] = crawl_site(url, device_type, max_links=max_links, progress=progress)
+            result['url'] = is_valid_url(url)
+        except Exception as e:
+            logging.error(f"Error processing {url} ({device_type}): {str(e)}")
+            result['error'] = str(e)
+        return result
+
+    pairs = [(url, device_type) for url in urls for device_type in device_types]
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(pairs) or 1))) as executor:
+        return list(executor.map(lambda pair: run(*pair), pairs))
@@ -1,13 +1,56 @@
-document.addEventListener("DOMContentLoaded", function() {
-    const progressBar = document.getElementById("progress-bar");
-    const eventSource = new EventSource("/screenshots");
-
-    eventSource.onmessage = function(event) {
-        const progress = event.data;
-        progressBar.style.width = progress + "%";
-        progressBar.innerText = progress + "%";
-        if (progress >= 100) {
-            eventSource.close();
+// Tracks background screenshot jobs whose progress is pushed over Socket.IO.
+const SnapShotJobs = (function () {
+    let socket = null;
+    const handlers = {};
+
+    function getSocket() {
+        if (!socket) {
+            socket = io();
+            ['job_progress', 'job_completed', 'job_failed', 'job_cancelled'].forEach(event => {
+                socket.on(event, data => {
+                    const handler = handlers[data.job_id];
+                    if (handler) {
+                        handler(event, data);
+                    }
+                });
+            });
+            // (Re)subscribe after every (re)connect so no updates are lost
+            socket.on('connect', () => {
+                Object.keys(handlers).forEach(jobId => socket.emit('subscribe_job', { job_id: jobId }));
+            });
+        }
+        return socket;
+    }
+
+    function track(jobId, callbacks) {
+        handlers[jobId] = (event, data) => {
+            if (event === 'job_progress') {
+                if (callbacks.onProgress) callbacks.onProgress(data);
+            } else {
+                delete handlers[jobId];
+                if (callbacks.onDone) callbacks.onDone(data);
+            }
+        };
+        const s = getSocket();
+        if (s.connected) {
+            s.emit('subscribe_job', { job_id: jobId });
+        }
+    }
+
+    function cancel(jobId) {
+        return fetch(`/jobs/${jobId}/cancel`, { method: 'POST' }).then(response => response.json());
+    }
+
+    function status(jobId) {
+        return fetch(`/jobs/${jobId}`).then(response => response.json());
+    }
+
+    function percent(completed, failed, total) {
+        if (!total) {
+            return 0;
         }
-    };
-});
\ No newline at end of file
+        return Math.min(100, Math.round(((completed + failed) / total) * 100));
+    }
+
+    return { track, cancel, status, percent };
+})();
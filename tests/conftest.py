@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# Module-level singletons (e.g. screenshot_index) open their database on import; keep it out of the repo
+os.environ.setdefault('SCREENSHOT_INDEX_DB', os.path.join(tempfile.mkdtemp(prefix='snapshot-tests-'), 'screenshots.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,91 @@
+import pytest
+
+from link_rules import filter_links, normalize_url, page_key, rule_matches, site_of, url_file_key
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('HTTP://Example.COM:80/a/', 'http://example.com/a'),
+    ('https://example.com:443', 'https://example.com/'),
+    ('https://example.com:8443/a', 'https://example.com:8443/a'),
+    ('https://example.com//a///b/#top', 'https://example.com/a/b'),
+    ('https://example.com/?b=2&a=1', 'https://example.com/?a=1&b=2'),
+    ('https://example.com/p?utm_source=x&id=3&gclid=y&fbclid=z', 'https://example.com/p?id=3'),
+    ('https://example.com/p?q=', 'https://example.com/p?q='),
+    ('mailto:office@example.com', None),
+    ('javascript:void(0)', None),
+])
+def test_normalize_url(url, expected):
+    assert normalize_url(url) == expected
+
+
+def test_normalize_url_resolves_relative_links():
+    assert normalize_url(' ../kontakt/ ', 'https://example.com/oferta/torty/') == 'https://example.com/oferta/kontakt'
+    assert normalize_url('?page=2', 'https://example.com/blog') == 'https://example.com/blog?page=2'
+
+
+def test_normalize_url_ignore_query():
+    assert normalize_url('https://example.com/p?id=3', ignore_query=True) == 'https://example.com/p'
+
+
+def test_site_of_ignores_www_port_and_credentials():
+    assert site_of('WWW.Example.com:443') == 'example.com'
+    assert site_of('user:secret@example.com') == 'example.com'
+
+
+def test_page_key_and_file_key_ignore_www():
+    assert page_key('https://www.example.com/a') == page_key('https://example.com/a')
+    assert url_file_key('https://www.example.com/a/') == url_file_key('https://example.com/a?utm_medium=x')
+    assert url_file_key('https://example.com/a') != url_file_key('https://example.com/b')
+    assert len(url_file_key('https://example.com/a')) == 16
+
+
+@pytest.mark.parametrize('rule, url, skipped', [
+    ({'skip': 'scheme', 'value': ['mailto']}, 'mailto:a@example.com', True),
+    ({'skip': 'contains', 'value': 'Poczta'}, 'https://poczta.example.com/', True),
+    ({'skip': 'extension', 'value': ['.pdf']}, 'https://example.com/Menu.PDF', True),
+    ({'skip': 'extension', 'value': ['.pdf']}, 'https://example.com/menu.pdf.html', False),
+    ({'skip': 'regex', 'value': r'/tag/\d+'}, 'https://example.com/tag/12', True),
+    ({'skip': 'external'}, 'https://other.com/', True),
+    ({'skip': 'external'}, 'https://www.example.com/a', False),
+    ({'skip': 'external'}, '/relative', False),
+])
+def test_rule_matches(rule, url, skipped):
+    assert rule_matches(rule, url, 'https://example.com/') is skipped
+
+
+def test_unknown_rule_raises():
+    with pytest.raises(ValueError):
+        rule_matches({'skip': 'nope'}, 'https://example.com/')
+
+
+def test_filter_links_deduplicates_skips_and_ranks():
+    raw = [
+        ('https://example.com/a/b/c', False),
+        ('https://example.com/', False),
+        ('https://www.example.com/kontakt/', True),
+        ('https://example.com/a', False),
+        ('https://example.com/a?utm_source=x', False),
+        ('https://other.com/', False),
+        ('mailto:a@example.com', False),
+        ('https://example.com/cennik.pdf', False),
+        ('', False),
+    ]
+    links, skipped = filter_links(raw, 'https://example.com')
+    # Navigation first, then by path depth; the page itself is dropped
+    assert links == ['https://www.example.com/kontakt', 'https://example.com/a', 'https://example.com/a/b/c']
+    assert skipped == {0: 1, 2: 1, 3: 1}
+
+
+def test_filter_links_priority_and_document_order():
+    raw = [('https://example.com/x/y', False), ('https://example.com/z', False),
+           ('https://example.com/oferta/1/2', False)]
+    links, _ = filter_links(raw, 'https://example.com', priority=['/oferta/'])
+    assert links == ['https://example.com/oferta/1/2', 'https://example.com/z', 'https://example.com/x/y']
+    links, _ = filter_links(raw, 'https://example.com', rank=False)
+    assert links == ['https://example.com/x/y', 'https://example.com/z', 'https://example.com/oferta/1/2']
+
+
+def test_filter_links_merges_nav_flag_of_duplicates():
+    raw = [('https://example.com/a/b', False), ('https://example.com/c', False), ('https://example.com/a/b/', True)]
+    links, _ = filter_links(raw, 'https://example.com')
+    assert links[0] == 'https://example.com/a/b'
@@ -0,0 +1,59 @@
+from log_store import LogStore, line_matches, read_from, read_tail
+
+
+def test_read_from_returns_complete_lines_and_resume_offset(tmp_path):
+    path = tmp_path / 'log.txt'
+    path.write_bytes(b'one\ntwo\nthr')
+    lines, offset = read_from(str(path))
+    assert lines == ['one', 'two'] and offset == 8
+    assert read_from(str(path), offset) == ([], 8)
+
+    with open(path, 'ab') as f:
+        f.write(b'ee\nfour\n')
+    assert read_from(str(path), offset) == (['three', 'four'], 19)
+
+
+def test_read_from_respects_max_bytes(tmp_path):
+    path = tmp_path / 'log.txt'
+    path.write_bytes(b'aaaa\nbbbb\ncccc\n')
+    lines, offset = read_from(str(path), 0, max_bytes=12)
+    assert lines == ['aaaa', 'bbbb'] and offset == 10
+    assert read_from(str(path), offset, max_bytes=12) == (['cccc'], 15)
+
+
+def test_read_from_starts_over_after_truncation(tmp_path):
+    path = tmp_path / 'log.txt'
+    path.write_bytes(b'new\n')
+    assert read_from(str(path), 500) == (['new'], 4)
+
+
+def test_read_from_missing_file(tmp_path):
+    assert read_from(str(tmp_path / 'missing.txt'), 10) == ([], 0)
+
+
+def test_read_tail(tmp_path, monkeypatch):
+    monkeypatch.setattr('log_store.TAIL_BLOCK_SIZE', 7)
+    path = tmp_path / 'log.txt'
+    path.write_text(''.join(f"line {n}\n" for n in range(50)))
+    assert read_tail(str(path), 3) == ['line 47', 'line 48', 'line 49']
+    assert read_tail(str(tmp_path / 'missing.txt'), 3) == []
+
+
+def test_line_matches():
+    line = '2026-01-01 10:00:00 - WARNING - example.com slow'
+    assert line_matches(line, level='INFO', domain='example.com')
+    assert not line_matches(line, level='ERROR')
+    assert not line_matches('no level here', level='DEBUG')
+    assert not line_matches(line, domain='example.org')
+
+
+def test_store_sequence_offsets(tmp_path):
+    path = str(tmp_path / 'logs' / 'app.log')
+    store = LogStore(path, max_lines=5, max_bytes=40, backup_count=1)
+    for n in range(1, 8):
+        store.append(f"line {n}")
+    assert store.offset == 7
+    assert store.since(5) == [(6, 'line 6'), (7, 'line 7')]
+    assert store.recent(2) == ['line 7', 'line 6']
+    # An offset from before a restart is ahead of the store, so every buffered line is returned
+    assert [seq for seq, line in store.since(100)] == [3, 4, 5, 6, 7]
@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+import rate_limiter
+from rate_limiter import HostLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    settings = {'rate_limit': 2, 'burst': 2, 'max_concurrency': 2, 'backoff_base': 5, 'backoff_max': 30}
+    monkeypatch.setattr(rate_limiter, 'get_domain_settings', lambda domain: dict(settings))
+    return settings
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', clock)
+    return clock
+
+
+def test_backoff_doubles_up_to_the_limit(settings, clock):
+    limiter = HostLimiter('example.com')
+    delays = []
+    for _ in range(5):
+        limiter.report(429)
+        delays.append(limiter.backoff_remaining)
+        clock.now += 100
+    assert delays == [5, 10, 20, 30, 30]
+
+
+def test_success_resets_the_backoff(settings, clock):
+    limiter = HostLimiter('example.com')
+    limiter.report(503)
+    limiter.report(503)
+    clock.now += 100
+    limiter.report(200)
+    limiter.report(502)
+    assert limiter.backoff_remaining == 5
+
+
+def test_backoff_never_shrinks_and_unknown_status_is_ignored(settings, clock):
+    limiter = HostLimiter('example.com')
+    for _ in range(3):
+        limiter.report(429)
+    limiter.report(200)
+    limiter.report(None)
+    limiter.report(429)
+    assert limiter.backoff_remaining == 20
+    assert limiter._wait_time(clock.now) == 20
+
+
+def test_token_bucket(settings, clock):
+    limiter = HostLimiter('example.com')
+    for _ in range(2):
+        with limiter.slot():
+            pass
+    assert limiter._wait_time(clock.now) == 0.5
+    clock.now += 0.5
+    assert limiter._wait_time(clock.now) == 0
+
+
+def test_concurrency_cap(settings, clock):
+    settings['max_concurrency'] = 1
+    limiter = HostLimiter('example.com')
+    with limiter.slot():
+        clock.now += 10
+        assert limiter._wait_time(clock.now) is None
+    assert limiter._wait_time(clock.now) == 0
+
+
+def test_configure_applies_new_settings(settings, clock):
+    limiter = HostLimiter('example.com')
+    settings.update(rate_limit=0.5, backoff_base=1)
+    limiter.configure()
+    assert limiter.rate == 0.5
+    limiter.report(429)
+    assert limiter.backoff_remaining == 1
+
+
+def test_slot_waits_out_the_backoff(settings):
+    settings.update(rate_limit=100, backoff_base=0.2)
+    limiter = HostLimiter('example.com')
+    limiter.report(503)
+    started = time.monotonic()
+    with limiter.slot():
+        assert time.monotonic() - started >= 0.19
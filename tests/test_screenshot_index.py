@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from screenshot_index import ScreenshotIndex, decode_cursor, encode_cursor, normalize_domain
+
+
+@pytest.fixture
+def index(tmp_path):
+    root = tmp_path / 'screenshots'
+    index = ScreenshotIndex(str(tmp_path / 'index.db'), str(root))
+    # Ten screenshots per device of two domains, captured a second apart; sizes repeat to test ties
+    for domain in ('example.com', 'example.org'):
+        for device in ('desktop', 'mobile'):
+            folder = root / domain / device
+            folder.mkdir(parents=True)
+            for n in range(10):
+                path = folder / f"page_{n}_{device}.png"
+                path.write_bytes(b'x' * (100 + n % 3))
+                index.record(str(path), captured_at=1000 + n)
+    return index
+
+
+def all_pages(index, **kwargs):
+    rows, cursor = index.query(**kwargs)
+    pages = [rows]
+    while cursor:
+        rows, cursor = index.query(cursor=cursor, **kwargs)
+        pages.append(rows)
+    return pages
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor([12.5, 'a/b.png'])) == [12.5, 'a/b.png']
+
+
+@pytest.mark.parametrize('cursor', ['not base64!', encode_cursor([1]), encode_cursor({'a': 1})])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_normalize_domain():
+    assert normalize_domain(' WWW.Example.com:8080 ') == 'example.com_8080'
+
+
+@pytest.mark.parametrize('sort', ['captured_at', 'size', 'domain', 'filename'])
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_pages_cover_every_row_once_in_order(index, sort, order):
+    pages = all_pages(index, sort=sort, order=order, limit=7)
+    rows = [row for page in pages for row in page]
+    assert len(pages) == 6
+    assert all(len(page) == 7 for page in pages[:-1])
+    assert len({row['path'] for row in rows}) == len(rows) == 40
+    keys = [(row[sort], row['path']) for row in rows]
+    assert keys == sorted(keys, reverse=order == 'desc')
+
+
+def test_last_page_has_no_cursor(index):
+    rows, cursor = index.query(limit=40)
+    assert len(rows) == 40 and cursor is None
+
+
+def test_filters(index):
+    rows = [row for page in all_pages(index, domain='www.example.com', device='mobile', start=1003, end=1006,
+                                      limit=2) for row in page]
+    assert sorted(row['captured_at'] for row in rows) == [1003, 1004, 1005]
+    assert {(row['domain'], row['device']) for row in rows} == {('example.com', 'mobile')}
+
+
+def test_domain_prefix_match(index):
+    rows, _ = index.query(domain='example.', domain_match='prefix', limit=200)
+    assert {row['domain'] for row in rows} == {'example.com', 'example.org'}
+    rows, _ = index.query(domain='example.', limit=200)
+    assert rows == []
+
+
+@pytest.mark.parametrize('kwargs', [{'sort': 'path; DROP TABLE screenshots'}, {'order': 'up'},
+                                    {'domain_match': 'regex'}])
+def test_invalid_arguments(index, kwargs):
+    with pytest.raises(ValueError):
+        index.query(**kwargs)
+
+
+def test_reconcile_skips_partial_captures_and_drops_deleted_files(index, tmp_path):
+    folder = tmp_path / 'screenshots' / 'example.com' / 'desktop'
+    (folder / 'page_x_desktop.partial.png').write_bytes(b'partial')
+    os.remove(folder / 'page_0_desktop.png')
+    assert index.reconcile() == (0, 1)
+    assert 'page_x_desktop.partial.png' not in index.list_folder('example.com/desktop')
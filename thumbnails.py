@@ -0,0 +1,118 @@
+import logging
+import os
+import threading
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow is optional, galleries fall back to the original files
+    Image = None
+    features = None
+
+SCREENSHOT_ROOT = os.path.join('static', 'screenshots')
+THUMBNAIL_FOLDER = os.path.join('static', 'thumbnails')
+GENERATE_ON_CAPTURE = os.environ.get('THUMBNAILS_ON_CAPTURE', '1') == '1'
+
+# width, maximum height (the top of the page is kept) and encoder quality of every derivative
+DERIVATIVE_SIZES = {
+    'thumb': {'width': 320, 'max_height': 480, 'quality': 70},
+    'preview': {'width': 1024, 'max_height': 8192, 'quality': 80},
+}
+
+# Striped locks: derivatives of one path always share a lock, and their number stays fixed
+_locks = [threading.Lock() for _ in range(64)]
+
+
+def is_available():
+    return Image is not None
+
+
+def derivative_format():
+    """Returns WebP when the Pillow build supports it, JPEG otherwise."""
+    if features is not None and features.check('webp'):
+        return 'WEBP', '.webp'
+    return 'JPEG', '.jpg'
+
+
+def derivative_path(rel_path, size):
+    """Returns where the derivative of the screenshot (relative to the screenshot root) is cached."""
+    _, extension = derivative_format()
+    return os.path.join(THUMBNAIL_FOLDER, size, os.path.splitext(rel_path)[0] + extension)
+
+
+def _lock_for(path):
+    return _locks[hash(path) % len(_locks)]
+
+
+def create_derivative(source_path, target_path, size):
+    """Crops the top of the page to the size's aspect ratio, scales it down and saves it."""
+    spec = DERIVATIVE_SIZES[size]
+    image_format, _ = derivative_format()
+    with Image.open(source_path) as image:
+        scale = spec['width'] / image.width if image.width > spec['width'] else 1
+        # Crop in source pixels first so tall pages are never scaled as a whole
+        crop_height = min(image.height, int(spec['max_height'] / scale))
+        image = image.crop((0, 0, image.width, crop_height))
+        image = image.convert('RGB')
+        image.thumbnail((spec['width'], spec['max_height']), Image.LANCZOS)
+
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        tmp_path = f"{target_path}.tmp"
+        if image_format == 'WEBP':
+            image.save(tmp_path, image_format, quality=spec['quality'], method=4)
+        else:
+            image.save(tmp_path, image_format, quality=spec['quality'], optimize=True, progressive=True)
+        os.replace(tmp_path, target_path)
+
+
+def get_derivative(rel_path, size, refresh=False):
+    """
+    Returns the path of a cached derivative of the screenshot, generating it when missing or stale.
+
+    Returns None when Pillow is not installed, the size is unknown or the source does not exist.
+    `refresh` recreates it even when it looks newer than the source.
+    """
+    if not is_available() or size not in DERIVATIVE_SIZES:
+        return None
+    if os.path.isabs(rel_path) or os.path.normpath(rel_path).startswith('..'):
+        return None
+    source_path = os.path.join(SCREENSHOT_ROOT, rel_path)
+    if not os.path.isfile(source_path):
+        return None
+
+    target_path = derivative_path(rel_path, size)
+    with _lock_for(target_path):
+        try:
+            if not refresh and os.path.getmtime(target_path) >= os.path.getmtime(source_path):
+                return target_path
+        except OSError:
+            pass
+        try:
+            create_derivative(source_path, target_path, size)
+        except Exception as e:
+            logging.error(f"Cannot create {size} for '{rel_path}': {e}")
+            return None
+    return target_path
+
+
+def generate_derivatives(screenshot_path):
+    """
+    Recreates every derivative right after a capture, if enabled, or drops the old ones.
+
+    A recaptured screenshot can be a hard link to an older blob, so its mtime alone does not
+    show that cached derivatives are stale.
+    """
+    rel_path = os.path.relpath(screenshot_path, SCREENSHOT_ROOT)
+    if not GENERATE_ON_CAPTURE or not is_available():
+        remove_derivatives(rel_path)
+        return
+    for size in DERIVATIVE_SIZES:
+        get_derivative(rel_path, size, refresh=True)
+
+
+def remove_derivatives(rel_path):
+    """Deletes the cached derivatives of a removed screenshot."""
+    for size in DERIVATIVE_SIZES:
+        try:
+            os.remove(derivative_path(rel_path, size))
+        except OSError:
+            pass
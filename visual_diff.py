@@ -0,0 +1,267 @@
+import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:  # NumPy and Pillow are optional, without them runs are recorded but not diffed
+    np = None
+    Image = None
+
+from capture_runs import DIFF_FOLDER, run_store
+from screenshot_store import blob_path
+
+DIFF_ON_CAPTURE = os.environ.get('DIFF_ON_CAPTURE', '1') == '1'
+# Each worker holds two decoded screenshots, up to several hundred MB for the tallest pages
+DIFF_WORKERS = int(os.environ.get('DIFF_WORKERS', max(1, min(4, (os.cpu_count() or 2) - 1))))
+# 'pixel' compares every pixel, 'perceptual' compares the brightness and contrast of blocks,
+# which ignores anti-aliasing and sub-pixel shifts
+DIFF_METHOD = os.environ.get('DIFF_METHOD', 'perceptual')
+PIXEL_THRESHOLD = 24
+PERCEPTUAL_THRESHOLD = 8.0
+BLOCK_SIZE = 16
+# Changed blocks closer than this many blocks are merged into one region
+REGION_GAP = 2
+MAX_REGIONS = 20
+BAND_HEIGHT = 2048
+LUMA = (0.299, 0.587, 0.114)
+
+_diff_scheduler = ThreadPoolExecutor(max_workers=1)
+
+
+def is_available():
+    return np is not None
+
+
+def open_image(path, mode):
+    """Decodes an image in the given mode ('RGB' or 'L', the luma of LUMA)."""
+    image = Image.open(path)
+    if image.mode == mode:
+        image.load()
+        return image
+    try:
+        return image.convert(mode)
+    finally:
+        image.close()
+
+
+def read_band(image, top, bottom, width):
+    """Returns rows [top, bottom) of the image as an array, padded with white past its edges."""
+    shape = (bottom - top, width, 3) if image.mode == 'RGB' else (bottom - top, width)
+    band = np.full(shape, 255, dtype=np.uint8)
+    rows, cols = min(bottom, image.height) - top, min(width, image.width)
+    if rows > 0 and cols > 0:
+        band[:rows, :cols] = np.asarray(image.crop((0, top, cols, top + rows)))
+    return band
+
+
+def pixel_mask(previous, current, threshold=PIXEL_THRESHOLD):
+    """Marks pixels where any channel differs by more than `threshold`, band by band."""
+    mask = np.empty(current.shape[:2], dtype=bool)
+    for top in range(0, current.shape[0], BAND_HEIGHT):
+        band = slice(top, top + BAND_HEIGHT)
+        delta = np.abs(previous[band].astype(np.int16) - current[band].astype(np.int16))
+        mask[band] = delta.max(axis=2) > threshold
+    return mask
+
+
+def perceptual_mask(previous, current, threshold=PERCEPTUAL_THRESHOLD, block=BLOCK_SIZE):
+    """
+    Marks blocks whose mean brightness or contrast changed by more than `threshold`. Takes
+    grayscale (or RGB) arrays whose height and width are multiples of `block`.
+    """
+    height, width = current.shape[:2]
+    luma = np.array(LUMA, dtype=np.float32)
+
+    def block_stats(image):
+        gray = image.astype(np.float32) if image.ndim == 2 else image @ luma
+        blocks = gray.reshape(height // block, block, width // block, block)
+        return blocks.mean(axis=(1, 3)), blocks.std(axis=(1, 3))
+
+    previous_mean, previous_std = block_stats(previous)
+    current_mean, current_std = block_stats(current)
+    changed = (np.abs(previous_mean - current_mean) > threshold) | (np.abs(previous_std - current_std) > threshold)
+    return np.repeat(np.repeat(changed, block, axis=0), block, axis=1)
+
+
+def block_grid(mask, block=BLOCK_SIZE):
+    """Reduces a mask to one flag per block, set when any pixel of the block is set."""
+    height, width = mask.shape
+    rows, cols = -(-height // block), -(-width // block)
+    padded = np.zeros((rows * block, cols * block), dtype=bool)
+    padded[:height, :width] = mask
+    return padded.reshape(rows, block, cols, block).any(axis=(1, 3))
+
+
+def changed_regions(grid, height, width, block=BLOCK_SIZE, gap=REGION_GAP, limit=MAX_REGIONS):
+    """Groups changed blocks into bounding boxes {x, y, width, height}, largest first."""
+    rows, cols = grid.shape
+    seen = np.zeros_like(grid)
+    boxes = []
+    for row, col in np.argwhere(grid):
+        if seen[row, col]:
+            continue
+        seen[row, col] = True
+        queue = deque([(row, col)])
+        top, left, bottom, right = row, col, row, col
+        while queue:
+            r, c = queue.popleft()
+            top, left, bottom, right = min(top, r), min(left, c), max(bottom, r), max(right, c)
+            for nr in range(max(0, r - gap), min(rows, r + gap + 1)):
+                for nc in range(max(0, c - gap), min(cols, c + gap + 1)):
+                    if grid[nr, nc] and not seen[nr, nc]:
+                        seen[nr, nc] = True
+                        queue.append((nr, nc))
+        boxes.append({
+            'x': int(left * block),
+            'y': int(top * block),
+            'width': int(min(width, (right + 1) * block) - left * block),
+            'height': int(min(height, (bottom + 1) * block) - top * block),
+        })
+    boxes.sort(key=lambda box: box['width'] * box['height'], reverse=True)
+    return boxes[:limit]
+
+
+def highlight(band, mask):
+    """Dims a band of the screenshot and tints its changed pixels red."""
+    overlay = band // 2 + 127
+    overlay[mask] = (band[mask].astype(np.uint16) * 3 // 10 + np.array([178, 0, 0])).astype(np.uint8)
+    return overlay
+
+
+def save_mask(image, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    image.save(tmp_path, 'PNG')
+    os.replace(tmp_path, path)
+
+
+def diff_images(previous_path, current_path, method=DIFF_METHOD, mask_path=None):
+    """
+    Compares two screenshots and returns the change score (share of changed pixels),
+    the number of changed pixels and the changed regions; optionally saves a diff mask.
+
+    Pages can be tens of thousands of pixels tall, so only the decoded images are held in
+    full (the previous one as grayscale for the perceptual method); they are compared in
+    bands of BAND_HEIGHT rows and the mask is drawn into the current image band by band.
+    """
+    perceptual = method == 'perceptual'
+    block = BLOCK_SIZE
+    previous = current = None
+    try:
+        previous = open_image(previous_path, 'L' if perceptual else 'RGB')
+        current = open_image(current_path, 'L' if perceptual and not mask_path else 'RGB')
+        height, width = max(previous.height, current.height), max(previous.width, current.width)
+        if mask_path and current.size != (width, height):
+            canvas = Image.new('RGB', (width, height), (255, 255, 255))
+            canvas.paste(current, (0, 0))
+            current.close()
+            current = canvas
+
+        rows, cols = -(-height // block), -(-width // block)
+        grid = np.zeros((rows, cols), dtype=bool)
+        changed_pixels = 0
+        # BAND_HEIGHT is a multiple of the block size, so blocks never straddle two bands
+        for top in range(0, height, BAND_HEIGHT):
+            bottom = min(top + BAND_HEIGHT, height)
+            if perceptual:
+                padded_bottom = min(top + BAND_HEIGHT, rows * block)
+                band = read_band(current, top, padded_bottom, cols * block)
+                mask = perceptual_mask(read_band(previous, top, padded_bottom, cols * block), band)
+                mask, band = mask[:bottom - top, :width], band[:bottom - top, :width]
+            else:
+                band = read_band(current, top, bottom, width)
+                mask = pixel_mask(read_band(previous, top, bottom, width), band)
+            changed_pixels += int(mask.sum())
+            grid[top // block:top // block + -(-(bottom - top) // block)] |= block_grid(mask, block)
+            if mask_path:
+                current.paste(Image.fromarray(highlight(band, mask)), (0, top))
+
+        result = {
+            'score': changed_pixels / (height * width) if height * width else 0.0,
+            'changed_pixels': changed_pixels,
+            'boxes': changed_regions(grid, height, width) if changed_pixels else [],
+            'mask_path': None,
+        }
+        if mask_path and changed_pixels:
+            save_mask(current, mask_path)
+            result['mask_path'] = mask_path
+        return result
+    finally:
+        for image in (previous, current):
+            if image is not None:
+                image.close()
+
+
+def _diff_page(task):
+    """Process pool entry point: diffs one page and never raises."""
+    url, previous_path, current_path, method, mask_path = task
+    try:
+        return url, diff_images(previous_path, current_path, method, mask_path), None
+    except Exception as e:
+        return url, None, str(e)
+
+
+def diff_run(run_id, method=DIFF_METHOD, workers=DIFF_WORKERS):
+    """
+    Diffs every page of a run against its previous capture and stores the results.
+
+    Pages whose content hash did not change score 0 without being decoded; the rest are
+    compared in a process pool. Returns the number of diffed pages.
+    """
+    if not is_available():
+        logging.info("NumPy or Pillow is not installed, skipping visual diffs")
+        return 0
+    previous_versions = run_store.previous_versions(run_id)
+    tasks = []
+    hashes = {}
+    for page in run_store.pages(run_id):
+        previous_hash = previous_versions.get(page['url'])
+        if not previous_hash or not page['content_hash']:
+            continue
+        hashes[page['url']] = (previous_hash, page['content_hash'])
+        if previous_hash == page['content_hash']:
+            run_store.record_diff(run_id, {'url': page['url'], 'previous_hash': previous_hash,
+                                           'content_hash': previous_hash, 'score': 0.0, 'changed_pixels': 0,
+                                           'boxes': [], 'method': method})
+            continue
+        previous_path = blob_path(previous_hash)
+        current_path = blob_path(page['content_hash'])
+        if not os.path.exists(current_path):
+            current_path = page['path']
+        if not os.path.exists(previous_path) or not os.path.exists(current_path):
+            continue
+        mask_path = os.path.join(DIFF_FOLDER, run_id, f"{page['content_hash'][:16]}.png")
+        tasks.append((page['url'], previous_path, current_path, method, mask_path))
+
+    if tasks:
+        # Spawned, not forked: the app process runs Flask, Selenium and lock-holding threads
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(tasks))),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            for url, result, error in executor.map(_diff_page, tasks):
+                if error:
+                    logging.error(f"Cannot diff {url}: {error}")
+                    continue
+                previous_hash, content_hash = hashes[url]
+                result.update({'url': url, 'previous_hash': previous_hash, 'content_hash': content_hash,
+                               'method': method})
+                run_store.record_diff(run_id, result)
+    logging.info(f"Diffed run {run_id}: {len(hashes)} pages with a previous version, {len(tasks)} changed")
+    return len(hashes)
+
+
+def schedule_diff(run_id):
+    """Diffs a finished run in the background, one run at a time."""
+    if not DIFF_ON_CAPTURE or not is_available():
+        return None
+
+    def run():
+        try:
+            return diff_run(run_id)
+        except Exception as e:
+            logging.error(f"Visual diff of run {run_id} failed: {e}")
+
+    return _diff_scheduler.submit(run)